@@ -9,7 +9,6 @@ from aiohttp import ClientSession
 from msgpackr.constants import UNDEFINED
 
 from novelai_api import NovelAIAPI
-from novelai_api.utils import get_encryption_key
 
 
 class API:
@@ -64,7 +63,7 @@ class API:
 
     @property
     def encryption_key(self):
-        return get_encryption_key(self._username, self._password)
+        return self.api.key_derivation.get_encryption_key(self._username, self._password)
 
     async def __aenter__(self):
         self._session = ClientSession()
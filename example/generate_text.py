@@ -54,9 +54,15 @@ async def main():
         # NOTE: context size is allowed_max_tokens - output_length - 20 (if generate_until_sentence is True)
         # e.g. 8192 - 50 - 20 = 8122
         preset.max_length = 50
+        # NOTE: longer prompts are trimmed from the top before being sent (see CONTEXT_SIZE in Preset.py).
+        #       Set api.subscription_tier to use the context size of your tier, and pass keep_head to the generate
+        #       functions to keep the start of the prompt (e.g. keep_head=Tokenizer.encode(model, PREAMBLE[model]))
 
         # NOTE: instantiate with arguments
         global_settings = GlobalSettings(num_logprobs=GlobalSettings.NO_LOGPROBS)
+        # NOTE: with logprobs, the response can be analyzed with novelai_api.Logprobs (requires numpy)
+        #       e.g. Logprobs.from_response(gen).perplexity(), or Logprobs.from_stream(events) for streaming
+        # global_settings = GlobalSettings(num_logprobs=10)
         # NOTE: change arguments after instantiation
         global_settings.bias_dinkus_asterism = True
         global_settings.rep_pen_whitelist = True
@@ -127,8 +133,9 @@ async def main():
         # NOTE: decoded response
         logger.info(Tokenizer.decode(model, b64_to_tokens(gen["output"], bytes_per_token)))
 
-        # NOTE: streamed generation
-        async for token in api.high_level.generate_stream(
+        # NOTE: streamed generation. The timings of the stream are in stream.metrics once it ends
+        #       (or passed to api.stream_metrics_callback, if set)
+        stream = api.high_level.generate_stream(
             prompt,
             model,
             preset,
@@ -137,7 +144,8 @@ async def main():
             biases=bias_groups,
             prefix=module,
             stop_sequences=stop_sequence,
-        ):
+        )
+        async for token in stream:
             logger.info(
                 "%s  %s  '%s'",
                 # NOTE: b64-encoded token id
@@ -147,6 +155,7 @@ async def main():
                 # NOTE: decoded token (do note that decoding single tokens can yield broken unicode characters)
                 Tokenizer.decode(model, b64_to_tokens(token["token"], bytes_per_token)),
             )
+        logger.info(stream.metrics)
 
         # ... and more examples can be found in tests/test_generate.py
 
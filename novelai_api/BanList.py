@@ -1,11 +1,16 @@
 from typing import Dict, Iterable, List, Union
 
 from novelai_api.Preset import Model
+from novelai_api.Tokenizer import Tokenizer
 from novelai_api.utils import tokenize_if_not
 
 
 class BanList:
     _sequences: List[Union[List[int], str]]
+    # incremented on every change, so derived data can detect that it is outdated
+    _version: int
+    # tokenized sequences, per tokenizer name. Cleared when sequences are added
+    _tokenized: Dict[str, List[List[int]]]
 
     enabled: bool
 
@@ -17,6 +22,8 @@ class BanList:
         :param enabled: Is the ban list enabled
         """
 
+        self._version = 0
+        self._tokenized = {}
         self.enabled = enabled
 
         self._sequences = []
@@ -53,8 +60,17 @@ class BanList:
 
             self._sequences.append(sequence)
 
+        self._tokenized.clear()
+        self._version += 1
+
         return self
 
+    def __setattr__(self, key, value):
+        object.__setattr__(self, key, value)
+
+        if not key.startswith("_"):
+            self._version += 1
+
     def __iadd__(self, o: Union[List[int], str]) -> "BanList":
         """
         Add elements to the ban list. Elements can be string or tokenized strings
@@ -72,6 +88,16 @@ class BanList:
 
         return self._sequences.__iter__()
 
+    def _get_tokenized(self, model: Model) -> List[List[int]]:
+        tokenizer_name = Tokenizer.get_tokenizer_name(model)
+
+        tokenized = self._tokenized.get(tokenizer_name)
+        if tokenized is None:
+            tokenized = [tokenize_if_not(model, s) for s in self._sequences]
+            self._tokenized[tokenizer_name] = tokenized
+
+        return tokenized
+
     def get_tokenized_entries(self, model: Model) -> Iterable[List[int]]:
         """
         Return the tokenized sequences for the ban list, if it is enabled
@@ -79,7 +105,20 @@ class BanList:
         :param model: Model to use for tokenization
         """
 
-        return (tokenize_if_not(model, s) for s in self._sequences if self.enabled)
+        return iter(self.to_bad_words_ids(model))
+
+    def to_bad_words_ids(self, model: Model) -> List[List[int]]:
+        """
+        Return the tokenized sequences for the ban list (empty if it is disabled), ready for the "bad_words_ids"
+        parameter. The tokenization is done once per tokenizer, and the returned list should not be modified
+
+        :param model: Model to use for tokenization
+        """
+
+        if not self.enabled:
+            return []
+
+        return self._get_tokenized(model)
 
     def __str__(self) -> str:
         return self._sequences.__str__()
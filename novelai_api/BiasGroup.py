@@ -1,11 +1,18 @@
-from typing import Any, Dict, Iterable, List, Union
+from typing import Any, Dict, Iterable, List, Tuple, Union
 
 from novelai_api.Preset import Model
+from novelai_api.Tokenizer import Tokenizer
 from novelai_api.utils import tokenize_if_not
 
 
 class BiasGroup:
     _sequences: List[Union[List[int], str]]
+    # incremented on every change, so derived data can detect that it is outdated
+    _version: int
+    # tokenized sequences, per tokenizer name. Cleared when sequences are added
+    _tokenized: Dict[str, List[List[int]]]
+    # "logit_bias_exp" entries, per tokenizer name, with the version they were built for
+    _entries: Dict[str, Tuple[int, List[Dict[str, Any]]]]
 
     bias: float
     ensure_sequence_finish: bool
@@ -28,6 +35,9 @@ class BiasGroup:
         :param enabled: Is the bias group enabled
         """
 
+        self._version = 0
+        self._tokenized = {}
+        self._entries = {}
         self._sequences = []
 
         self.bias = bias
@@ -96,8 +106,17 @@ class BiasGroup:
 
             self._sequences.append(sequence)
 
+        self._tokenized.clear()
+        self._version += 1
+
         return self
 
+    def __setattr__(self, key, value):
+        object.__setattr__(self, key, value)
+
+        if not key.startswith("_"):
+            self._version += 1
+
     def __iadd__(
         self, sequences: Union[Dict[str, List[List[int]]], Dict[str, List[int]], List[int], str]
     ) -> "BiasGroup":
@@ -126,6 +145,16 @@ class BiasGroup:
             for s in self._sequences
         )
 
+    def _get_tokenized(self, model: Model) -> List[List[int]]:
+        tokenizer_name = Tokenizer.get_tokenizer_name(model)
+
+        tokenized = self._tokenized.get(tokenizer_name)
+        if tokenized is None:
+            tokenized = [tokenize_if_not(model, s) for s in self._sequences]
+            self._tokenized[tokenizer_name] = tokenized
+
+        return tokenized
+
     def get_tokenized_entries(self, model: Model) -> Iterable[Dict[str, any]]:
         """
         Return the tokenized sequences for the bias group, if it is enabled
@@ -133,16 +162,37 @@ class BiasGroup:
         :param model: Model to use for tokenization
         """
 
-        return (
+        return iter(self.to_logit_bias_exp(model))
+
+    def to_logit_bias_exp(self, model: Model) -> List[Dict[str, Any]]:
+        """
+        Return the tokenized entries for the bias group (empty if it is disabled), ready for the "logit_bias_exp"
+        parameter. The entries are built once per tokenizer and settings, and the returned list should not be modified
+
+        :param model: Model to use for tokenization
+        """
+
+        if not self.enabled:
+            return []
+
+        tokenizer_name = Tokenizer.get_tokenizer_name(model)
+
+        cached = self._entries.get(tokenizer_name)
+        if cached is not None and cached[0] == self._version:
+            return cached[1]
+
+        entries = [
             {
                 "bias": self.bias,
                 "ensure_sequence_finish": self.ensure_sequence_finish,
                 "generate_once": self.generate_once,
-                "sequence": tokenize_if_not(model, s),
+                "sequence": sequence,
             }
-            for s in self._sequences
-            if self.enabled
-        )
+            for sequence in self._get_tokenized(model)
+        ]
+        self._entries[tokenizer_name] = (self._version, entries)
+
+        return entries
 
     def __str__(self) -> str:
         return (
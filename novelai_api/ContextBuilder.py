@@ -0,0 +1,380 @@
+"""
+Assembly of the context of a story (story text, memory, author's note, lorebook entries), fitted in a token budget
+the way the NovelAI client does it.
+"""
+
+import re
+from enum import Enum
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Pattern, Tuple, Union
+
+from novelai_api.Preset import Model
+from novelai_api.StoryText import StoryText
+from novelai_api.Tokenizer import Tokenizer
+
+# text and tokens of a part of an entry
+Chunk = Tuple[str, List[int]]
+
+
+class TrimDirection(Enum):
+    """
+    Side an entry is trimmed from when it doesn't fit in its budget
+    """
+
+    TrimTop = "trimTop"
+    TrimBottom = "trimBottom"
+    DoNotTrim = "doNotTrim"
+
+
+class TrimType(Enum):
+    """
+    Unit of text for trimming and insertion
+    """
+
+    Newline = "newline"
+    Sentence = "sentence"
+    Token = "token"
+
+
+# positions where a text can be cut without changing its tokenization, for each tokenizer. These are the starts of
+# lines (GPT2-like tokenizers attach the newlines of a blank line to the next word, so only single newlines count)
+_LINE_START_GPT2 = re.compile(r"(?<=\S\n)(?=\S)")
+_LINE_START = re.compile(r"(?<=\n)(?=\S)")
+
+_CHUNK_BOUNDARIES = {
+    "gpt2": _LINE_START_GPT2,
+    "gpt2-genji": _LINE_START_GPT2,
+    "pile": _LINE_START_GPT2,
+    "nerdstash_v1": _LINE_START,
+    "nerdstash_v2": _LINE_START,
+    "llama3": _LINE_START,
+}
+
+# context config of the story, for the keys it doesn't set (the defaults of the client, not the ones of the entries)
+_STORY_CONFIG_DEFAULTS = {
+    "prefix": "",
+    "suffix": "",
+    "tokenBudget": 1,
+    "budgetPriority": 0,
+    "trimDirection": TrimDirection.TrimTop.value,
+}
+
+# end of a sentence, and the whitespace after it
+_SENTENCE_END = re.compile(r"[.!?…]+[\"'”’*)\]]*\s+")
+
+
+class ContextEntry:
+    """
+    Source of the context (memory, author's note, lorebook entry...), with its context config
+    (the "contextConfig" object of the NovelAI layout)
+    """
+
+    #: Name of the entry, for debugging
+    name: str
+    #: Text of the entry
+    text: str
+    #: Text added before the entry
+    prefix: str
+    #: Text added after the entry
+    suffix: str
+    #: Maximum number of tokens of the entry (a number in ]0, 1] is a fraction of the context size)
+    token_budget: Union[int, float]
+    #: Number of tokens kept for the entry, before the entries of higher priority are placed
+    #: (a number in ]0, 1] is a fraction of the context size)
+    reserved_tokens: Union[int, float]
+    #: Entries of higher priority are placed first (and inserted first)
+    priority: int
+    #: Side the entry is trimmed from
+    trim_direction: TrimDirection
+    #: Smallest unit the entry can be trimmed by
+    maximum_trim_type: TrimType
+    #: Unit the insertion position is counted in
+    insertion_type: TrimType
+    #: Position of the entry in the context (0 is the start, -1 is the end)
+    insertion_position: int
+
+    def __init__(self, text: str, config: Dict[str, Any], name: str = ""):
+        """
+        :param text: Text of the entry
+        :param config: Context config of the entry
+        :param name: Name of the entry, for debugging
+        """
+
+        self.name = name
+        self.text = text
+        self.prefix = config.get("prefix", "")
+        self.suffix = config.get("suffix", "\n")
+        self.token_budget = config.get("tokenBudget", 2048)
+        self.reserved_tokens = config.get("reservedTokens", 0)
+        self.priority = config.get("budgetPriority", 400)
+        self.trim_direction = TrimDirection(config.get("trimDirection", TrimDirection.TrimBottom.value))
+        self.maximum_trim_type = TrimType(config.get("maximumTrimType", TrimType.Sentence.value))
+        self.insertion_type = TrimType(config.get("insertionType", TrimType.Newline.value))
+        self.insertion_position = config.get("insertionPosition", -1)
+
+    def __repr__(self) -> str:
+        return f"ContextEntry({self.name!r}, priority={self.priority}, position={self.insertion_position})"
+
+
+@lru_cache(maxsize=1024)
+def _parse_key(key: str) -> Pattern:
+    # "/regex/flags" keys are regexes, the others are matched as is, case-insensitively
+    match = re.fullmatch(r"/(.+)/([a-z]*)", key, re.DOTALL)
+    if match is not None:
+        pattern, letters = match.groups()
+
+        flags = 0
+        for letter, flag in (("i", re.IGNORECASE), ("m", re.MULTILINE), ("s", re.DOTALL)):
+            if letter in letters:
+                flags |= flag
+
+        try:
+            return re.compile(pattern, flags)
+        except re.error:
+            # invalid regexes are matched as is, like the client does
+            pass
+
+    return re.compile(re.escape(key), re.IGNORECASE)
+
+
+def get_activated_lore(entries: Iterable[Dict[str, Any]], story: StoryText) -> List[Dict[str, Any]]:
+    """
+    Get the lorebook entries activated by the end of the story: the enabled entries that are forced, or
+    have a key in the last "searchRange" characters of the story
+
+    :param entries: Lorebook entries (``storycontent["data"]["lorebook"]["entries"]``)
+    :param story: Text of the story
+
+    :return: The activated entries, in order
+    """
+
+    entries = [e for e in entries if e.get("enabled", True)]
+    if not entries:
+        return []
+
+    # search the longest range once, and slice it for the others
+    longest = max(e.get("searchRange", 1000) for e in entries)
+    tail = story.tail(longest)
+
+    activated = []
+    for entry in entries:
+        if entry.get("forceActivation", False):
+            activated.append(entry)
+            continue
+
+        search_range = entry.get("searchRange", 1000)
+        text = tail[len(tail) - search_range :] if search_range < len(tail) else tail
+        if any(_parse_key(key).search(text) for key in entry.get("keys", [])):
+            activated.append(entry)
+
+    return activated
+
+
+class ContextBuilder:
+    """
+    Assemble the context of a story: each source is trimmed to its budget, in order of priority, then inserted
+    in the story at its position.
+
+    The texts are tokenized by line, and the tokens are kept between calls, so only the lines that changed since
+    the previous context are tokenized.
+    """
+
+    _tokenizer_name: Optional[str]
+    _boundary: Optional[Pattern]
+    #: Tokens of the chunks used by the current context, and by the previous one
+    _cache: Dict[str, List[int]]
+    _previous_cache: Dict[str, List[int]]
+
+    #: Model the context is built for
+    model: Model
+
+    def __init__(self, model: Model):
+        """
+        :param model: Model the context is built for
+        """
+
+        self._tokenizer_name = None
+        self._boundary = None
+        self._cache = {}
+        self._previous_cache = {}
+
+        self.model = model
+
+    def _check_model(self):
+        tokenizer_name = Tokenizer.get_tokenizer_name(self.model)
+
+        if tokenizer_name != self._tokenizer_name:
+            self._tokenizer_name = tokenizer_name
+            # tokenizers without a known boundary tokenize each text as a whole
+            self._boundary = _CHUNK_BOUNDARIES.get(tokenizer_name)
+            self._cache = {}
+            self._previous_cache = {}
+
+    def _encode(self, chunk: str) -> List[int]:
+        tokens = self._cache.get(chunk)
+        if tokens is None:
+            tokens = self._previous_cache.get(chunk)
+            if tokens is None:
+                tokens = Tokenizer.encode(self.model, chunk)
+
+            self._cache[chunk] = tokens
+
+        return tokens
+
+    def _chunks(self, text: str) -> List[Chunk]:
+        parts = [text] if self._boundary is None else self._boundary.split(text)
+
+        return [(part, self._encode(part)) for part in parts if part]
+
+    def _story_chunks(self, story: StoryText, entry: ContextEntry, size: int) -> List[Chunk]:
+        # only tokenize the end of the story, growing it until it has enough tokens
+        length = size * 4
+        while True:
+            tail = story.tail(length)
+            whole = len(story) <= length
+
+            chunks = self._chunks((entry.prefix if whole else "") + tail + entry.suffix)
+            if whole or size <= sum(len(tokens) for _, tokens in chunks):
+                return chunks
+
+            length *= 2
+
+    @staticmethod
+    def _resolve(value: Union[int, float], context_size: int) -> int:
+        # the client writes 100% as 1, so an int 1 is a fraction too
+        if 0 < value <= 1:
+            return int(value * context_size)
+
+        return int(value)
+
+    def _cut(self, text: str, tokens: List[int], budget: int, keep_end: bool, max_type: TrimType) -> List[int]:
+        # the longest part of the chunk starting (or ending) at a sentence boundary that fits in the budget
+        cuts = [m.end() for m in _SENTENCE_END.finditer(text) if m.end() < len(text)]
+        parts = [text[c:] for c in cuts] if keep_end else [text[:c] for c in reversed(cuts)]
+
+        best = []
+        lo, hi = 0, len(parts)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            part = Tokenizer.encode(self.model, parts[mid])
+
+            if len(part) <= budget:
+                best = part
+                hi = mid
+            else:
+                lo = mid + 1
+
+        if not best and max_type is TrimType.Token:
+            best = tokens[len(tokens) - budget :] if keep_end else tokens[:budget]
+
+        return best
+
+    def _fit(self, entry: ContextEntry, chunks: List[Chunk], budget: int) -> List[List[int]]:
+        if sum(len(tokens) for _, tokens in chunks) <= budget:
+            return [tokens for _, tokens in chunks]
+
+        if entry.trim_direction is TrimDirection.DoNotTrim or budget <= 0:
+            return []
+
+        keep_end = entry.trim_direction is TrimDirection.TrimTop
+
+        kept = []
+        used = 0
+        for text, tokens in reversed(chunks) if keep_end else chunks:
+            if used + len(tokens) <= budget:
+                kept.append(tokens)
+                used += len(tokens)
+                continue
+
+            # the first line that doesn't fit is cut, if the entry can be trimmed by less than a line
+            if entry.maximum_trim_type is not TrimType.Newline:
+                part = self._cut(text, tokens, budget - used, keep_end, entry.maximum_trim_type)
+                if part:
+                    kept.append(part)
+
+            break
+
+        if keep_end:
+            kept.reverse()
+
+        return kept
+
+    @staticmethod
+    def _position(position: int, length: int) -> int:
+        index = position if 0 <= position else length + position + 1
+
+        return min(max(index, 0), length)
+
+    def _insert(self, context: List[List[int]], tokens: List[int], entry: ContextEntry):
+        if entry.insertion_type is TrimType.Token:
+            flat = [t for segment in context for t in segment]
+            index = self._position(entry.insertion_position, len(flat))
+            context[:] = [flat[:index], tokens, flat[index:]]
+        else:
+            # the segments of the context are lines, sentences are approximated by lines
+            context.insert(self._position(entry.insertion_position, len(context)), tokens)
+
+    def build(
+        self,
+        story: StoryText,
+        story_config: Dict[str, Any],
+        entries: Iterable[ContextEntry],
+        context_size: int,
+    ) -> List[int]:
+        """
+        Build the context
+
+        :param story: Text of the story
+        :param story_config: Context config of the story ("storyContextConfig" of the storycontent)
+        :param entries: Other sources of the context (memory, author's note, activated lorebook entries...)
+        :param context_size: Maximum number of tokens of the context
+
+        :return: The tokens of the context
+        """
+
+        if context_size < 1:
+            raise ValueError(f"context_size must be at least 1, got {context_size}")
+
+        self._check_model()
+
+        story_entry = ContextEntry("", {**_STORY_CONFIG_DEFAULTS, **story_config}, "story")
+
+        # the story is the first source, and the base the others are inserted in
+        sources = [(story_entry, self._story_chunks(story, story_entry, context_size))]
+        for entry in entries:
+            if entry.text:
+                sources.append((entry, self._chunks(entry.prefix + entry.text + entry.suffix)))
+
+        reserved = [
+            min(self._resolve(entry.reserved_tokens, context_size), sum(len(tokens) for _, tokens in chunks))
+            for entry, chunks in sources
+        ]
+        total_reserved = sum(reserved)
+        remaining = context_size
+
+        # sorted is stable, so the story goes first among the sources of the same priority
+        order = sorted(range(len(sources)), key=lambda i: -sources[i][0].priority)
+
+        fitted = {}
+        for i in order:
+            entry, chunks = sources[i]
+
+            # the reservations of the sources not placed yet are kept
+            total_reserved -= reserved[i]
+            budget = min(self._resolve(entry.token_budget, context_size), remaining - total_reserved)
+
+            segments = self._fit(entry, chunks, budget)
+            if segments:
+                fitted[i] = segments
+                remaining -= sum(len(segment) for segment in segments)
+
+        context = fitted.get(0, [])
+        for i in order:
+            if i != 0 and i in fitted:
+                self._insert(context, [t for segment in fitted[i] for t in segment], sources[i][0])
+
+        # only keep the tokens of this context and the previous one
+        self._previous_cache = self._cache
+        self._cache = {}
+
+        return [t for segment in context for t in segment]
@@ -0,0 +1,368 @@
+"""
+History of a story (the datablocks of a storycontent), stored in columns.
+
+Each datablock is a row in parallel int arrays, and the fragments are interned, so a history of hundreds of thousands
+of steps takes a fraction of the memory of the list of dicts used by the NovelAI JSON layout.
+"""
+
+from array import array
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+Fragment = Dict[str, Any]
+
+# keys of a datablock that are stored in the columns, in the order of the NovelAI layout
+_BLOCK_KEYS = (
+    "nextBlock",
+    "prevBlock",
+    "origin",
+    "startIndex",
+    "endIndex",
+    "dataFragment",
+    "fragmentIndex",
+    "removedFragments",
+    "chain",
+)
+
+
+class DatablockTree:
+    """
+    Tree of the datablocks of a story. Blocks are referenced by index, like in the NovelAI layout
+    (``prevBlock``, ``nextBlock``, ``currentBlock``)
+    """
+
+    _prev: array
+    _first_child: array
+    _last_child: array
+    _next_sibling: array
+    _start: array
+    _end: array
+    _fragment_index: array
+    _fragment: array
+    _origin: array
+    _chain: array
+
+    #: Interned fragments, referenced by the blocks
+    _fragments: List[Fragment]
+    _fragment_ids: Dict[Tuple, int]
+    #: Interned origins
+    _origins: List[str]
+    _origin_ids: Dict[str, int]
+
+    #: Removed fragments of the blocks that have some (most blocks don't)
+    _removed: Dict[int, Tuple[int, ...]]
+    #: Keys of the blocks that are not part of the known layout, kept as is
+    _extra: Dict[int, Dict[str, Any]]
+
+    def __init__(self):
+        self._prev = array("i")
+        self._first_child = array("i")
+        self._last_child = array("i")
+        self._next_sibling = array("i")
+        self._start = array("i")
+        self._end = array("i")
+        self._fragment_index = array("i")
+        self._fragment = array("i")
+        self._origin = array("i")
+        self._chain = array("b")
+
+        self._fragments = []
+        self._fragment_ids = {}
+        self._origins = []
+        self._origin_ids = {}
+
+        self._removed = {}
+        self._extra = {}
+
+    def __len__(self) -> int:
+        return len(self._prev)
+
+    def _intern_fragment(self, fragment: Fragment) -> int:
+        try:
+            key = tuple(fragment.items())
+            index = self._fragment_ids.get(key)
+        except TypeError:
+            # unhashable content, don't intern it
+            key = None
+            index = None
+
+        if index is None:
+            index = len(self._fragments)
+            self._fragments.append(dict(fragment))
+
+            if key is not None:
+                self._fragment_ids[key] = index
+
+        return index
+
+    def _intern_origin(self, origin: str) -> int:
+        index = self._origin_ids.get(origin)
+        if index is None:
+            index = len(self._origins)
+            self._origins.append(origin)
+            self._origin_ids[origin] = index
+
+        return index
+
+    def _add_row(self, block: Dict[str, Any]) -> int:
+        index = len(self._prev)
+
+        self._prev.append(block["prevBlock"])
+        self._first_child.append(-1)
+        self._last_child.append(-1)
+        self._next_sibling.append(-1)
+        self._start.append(block["startIndex"])
+        self._end.append(block["endIndex"])
+        self._fragment_index.append(block["fragmentIndex"])
+        self._fragment.append(self._intern_fragment(block["dataFragment"]))
+        self._origin.append(self._intern_origin(block["origin"]))
+        self._chain.append(bool(block["chain"]))
+
+        removed = block.get("removedFragments")
+        if removed:
+            self._removed[index] = tuple(self._intern_fragment(f) for f in removed)
+
+        extra = {k: v for k, v in block.items() if k not in _BLOCK_KEYS}
+        if extra:
+            self._extra[index] = extra
+
+        return index
+
+    def _link(self, parent: int, child: int):
+        last = self._last_child[parent]
+        if last < 0:
+            self._first_child[parent] = child
+        else:
+            self._next_sibling[last] = child
+
+        self._last_child[parent] = child
+
+    @classmethod
+    def from_json(cls, datablocks: List[Dict[str, Any]]) -> "DatablockTree":
+        """
+        Create a tree from the datablocks of a storycontent (``storycontent["data"]["story"]["datablocks"]``)
+
+        :param datablocks: Datablocks in the NovelAI layout
+        """
+
+        tree = cls()
+
+        for block in datablocks:
+            tree._add_row(block)
+
+        # the children are linked in the order of nextBlock, which isn't necessarily the order of the blocks
+        linked = set()
+        for i, block in enumerate(datablocks):
+            for child in block["nextBlock"]:
+                if not 0 <= child < len(datablocks):
+                    raise ValueError(f"Block {i} has an invalid next block: {child}")
+
+                if child in linked:
+                    raise ValueError(f"Block {child} is the next block of several blocks")
+
+                linked.add(child)
+                tree._link(i, child)
+
+        return tree
+
+    def block(self, index: int) -> Dict[str, Any]:
+        """
+        Get a block in the NovelAI layout
+
+        :param index: Index of the block
+        """
+
+        block = {
+            "nextBlock": list(self.children(index)),
+            "prevBlock": self._prev[index],
+            "origin": self._origins[self._origin[index]],
+            "startIndex": self._start[index],
+            "endIndex": self._end[index],
+            "dataFragment": dict(self._fragments[self._fragment[index]]),
+            "fragmentIndex": self._fragment_index[index],
+            "removedFragments": self.removed_fragments(index),
+            "chain": bool(self._chain[index]),
+        }
+
+        extra = self._extra.get(index)
+        if extra is not None:
+            block.update(extra)
+
+        return block
+
+    def to_json(self) -> List[Dict[str, Any]]:
+        """
+        Convert the tree to the datablocks of a storycontent
+        """
+
+        return [self.block(i) for i in range(len(self))]
+
+    def append(
+        self,
+        prev: int,
+        origin: str,
+        start: int,
+        end: int,
+        fragment: Fragment,
+        fragment_index: int,
+        removed: Optional[List[Fragment]] = None,
+        chain: bool = False,
+    ) -> int:
+        """
+        Add a block, as the last next block of ``prev``
+
+        :param prev: Index of the previous block (-1 for a root)
+        :param origin: Origin of the block ("root", "ai", "edit", ...)
+        :param start: Start of the replaced range of the text
+        :param end: End of the replaced range of the text
+        :param fragment: Fragment inserted in place of the range
+        :param fragment_index: Index of the fragment in the text
+        :param removed: Fragments removed by the block
+        :param chain: Whether the block is chained with the previous one
+
+        :return: Index of the new block
+        """
+
+        if not -1 <= prev < len(self):
+            raise ValueError(f"Invalid previous block: {prev}")
+
+        index = self._add_row(
+            {
+                "prevBlock": prev,
+                "origin": origin,
+                "startIndex": start,
+                "endIndex": end,
+                "dataFragment": fragment,
+                "fragmentIndex": fragment_index,
+                "removedFragments": removed,
+                "chain": chain,
+            }
+        )
+
+        if 0 <= prev:
+            self._link(prev, index)
+
+        return index
+
+    def prev(self, index: int) -> int:
+        """
+        Index of the previous block (-1 for the root)
+        """
+
+        return self._prev[index]
+
+    def children(self, index: int) -> Iterator[int]:
+        """
+        Indices of the next blocks, in order
+        """
+
+        child = self._first_child[index]
+        while 0 <= child:
+            yield child
+            child = self._next_sibling[child]
+
+    def last_child(self, index: int) -> int:
+        """
+        Index of the last next block (-1 if there is none)
+        """
+
+        return self._last_child[index]
+
+    def start(self, index: int) -> int:
+        """
+        Start of the range of the text replaced by the block
+        """
+
+        return self._start[index]
+
+    def end(self, index: int) -> int:
+        """
+        End of the range of the text replaced by the block
+        """
+
+        return self._end[index]
+
+    def fragment(self, index: int) -> Fragment:
+        """
+        Fragment inserted by the block. The fragment is shared, it must not be modified
+        """
+
+        return self._fragments[self._fragment[index]]
+
+    def removed_fragments(self, index: int) -> List[Fragment]:
+        """
+        Fragments removed by the block (copies)
+        """
+
+        return [dict(self._fragments[i]) for i in self._removed.get(index, ())]
+
+    def set_removed_fragments(self, index: int, removed: List[Fragment]):
+        """
+        Set the fragments removed by the block
+        """
+
+        if removed:
+            self._removed[index] = tuple(self._intern_fragment(f) for f in removed)
+        else:
+            self._removed.pop(index, None)
+
+    def compact(self, current: int, depth: int = 0) -> List[int]:
+        """
+        Prune the dead branches of the history: the alternatives branching off the path to the current block
+        more than ``depth`` blocks above it. The path from the root to the current block, and everything after
+        the current block (redo history), are always kept. Unused fragments are dropped.
+
+        The blocks are renumbered, keeping their relative order.
+
+        :param current: Index of the current block
+        :param depth: Number of blocks above the current one whose alternatives are kept
+
+        :return: Mapping from the old indices to the new ones (-1 for pruned blocks)
+        """
+
+        if not 0 <= current < len(self):
+            raise ValueError(f"Invalid current block: {current}")
+
+        if depth < 0:
+            raise ValueError(f"depth must be positive, got {depth}")
+
+        keep = bytearray(len(self))
+
+        # roots of the subtrees kept whole
+        subtrees = [current]
+
+        child = current
+        node = self._prev[current]
+        distance = 1
+        while 0 <= node:
+            keep[node] = 1
+            if distance <= depth:
+                subtrees.extend(c for c in self.children(node) if c != child)
+
+            child = node
+            node = self._prev[node]
+            distance += 1
+
+        while subtrees:
+            node = subtrees.pop()
+            keep[node] = 1
+            subtrees.extend(self.children(node))
+
+        mapping = [-1] * len(self)
+        kept = 0
+        for i in range(len(self)):
+            if keep[i]:
+                mapping[i] = kept
+                kept += 1
+
+        blocks = []
+        for i in range(len(self)):
+            if keep[i]:
+                block = self.block(i)
+                block["prevBlock"] = mapping[block["prevBlock"]] if 0 <= block["prevBlock"] else block["prevBlock"]
+                block["nextBlock"] = [mapping[c] for c in block["nextBlock"] if keep[c]]
+                blocks.append(block)
+
+        # rebuilding also drops the fragments that are not referenced anymore
+        self.__dict__.update(DatablockTree.from_json(blocks).__dict__)
+
+        return mapping
@@ -4,8 +4,6 @@ import io
 from pathlib import Path
 from typing import Any, Dict, Union
 
-from PIL import Image
-
 
 class RequestType(enum.Enum):
     """Enum for the type of request."""
@@ -74,6 +72,9 @@ class DirectorToolsPreset:
         if not isinstance(image, bytes):
             raise ValueError("Invalid image data. Expected bytes or Path object.")
 
+        # imported here, as PIL is slow to import and only needed for this
+        from PIL import Image  # pylint: disable=C0415
+
         self.image = base64.b64encode(image).decode("utf-8")
         img = Image.open(io.BytesIO(image))
         self.width, self.height = img.size
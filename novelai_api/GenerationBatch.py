@@ -0,0 +1,430 @@
+import asyncio
+import functools
+import time
+from typing import Any, AsyncIterator, Dict, Generator, Iterable, List, Optional, Tuple, Union
+
+from novelai_api.BanList import BanList
+from novelai_api.BiasGroup import BiasGroup
+from novelai_api.GenerationTemplate import GenerationTemplate
+from novelai_api.GlobalSettings import GlobalSettings
+from novelai_api.Preset import Model, Preset
+
+
+class GenerationRequest:
+    """
+    One generation of a batch. Either a template, or the model and settings, must be given
+    """
+
+    #: Context to give to the AI (raw text or list of tokens)
+    prompt: Union[List[int], str]
+    #: Template holding the model and the generation settings (None to build it from the other attributes)
+    template: Optional[GenerationTemplate]
+    #: Model to use for the AI
+    model: Optional[Model]
+    #: Preset to use for the generation settings
+    preset: Optional[Preset]
+    #: Global settings (used for generation)
+    global_settings: Optional[GlobalSettings]
+    #: Tokens to ban for this generation
+    bad_words: Optional[Union[Iterable[BanList], BanList]]
+    #: Tokens to bias (up or down) for this generation
+    biases: Optional[Union[Iterable[BiasGroup], BiasGroup]]
+    #: Module to use for this generation
+    prefix: Optional[str]
+    #: List of strings or tokens to stop the generation at
+    stop_sequences: Optional[Union[List[List[int]], List[str]]]
+    #: Tokens at the start of the prompt to keep if it has to be trimmed
+    keep_head: Union[int, List[int], None]
+    #: Additional parameters to pass to the request
+    kwargs: Dict[str, Any]
+
+    def __init__(
+        self,
+        prompt: Union[List[int], str],
+        model: Optional[Model] = None,
+        preset: Optional[Preset] = None,
+        global_settings: Optional[GlobalSettings] = None,
+        bad_words: Optional[Union[Iterable[BanList], BanList]] = None,
+        biases: Optional[Union[Iterable[BiasGroup], BiasGroup]] = None,
+        prefix: Optional[str] = None,
+        stop_sequences: Optional[Union[List[List[int]], List[str]]] = None,
+        keep_head: Union[int, List[int], None] = None,
+        template: Optional[GenerationTemplate] = None,
+        **kwargs,
+    ):
+        if template is None and (model is None or preset is None or global_settings is None):
+            raise ValueError("Either a template, or a model, preset and global settings must be provided")
+
+        self.prompt = prompt
+        self.template = template
+        self.model = model
+        self.preset = preset
+        self.global_settings = global_settings
+        self.bad_words = bad_words
+        self.biases = biases
+        self.prefix = prefix
+        self.stop_sequences = stop_sequences
+        self.keep_head = keep_head
+        self.kwargs = kwargs
+
+    def _get_template_key(self) -> Tuple:
+        def ids(value) -> Tuple[int, ...]:
+            if value is None:
+                return ()
+
+            if isinstance(value, (BanList, BiasGroup)):
+                return (id(value),)
+
+            return tuple(id(e) for e in value)
+
+        stop_sequences = self.stop_sequences
+        if stop_sequences is not None:
+            stop_sequences = tuple(s if isinstance(s, str) else tuple(s) for s in stop_sequences)
+
+        return (
+            self.model,
+            id(self.preset),
+            id(self.global_settings),
+            ids(self.bad_words),
+            ids(self.biases),
+            self.prefix,
+            stop_sequences,
+        )
+
+
+class GenerationResult:
+    """
+    Outcome of one generation of a batch
+    """
+
+    #: Index of the request in the batch
+    index: int
+    #: Request that was run
+    request: GenerationRequest
+    #: Response of the generation (None if it failed or was cancelled)
+    result: Optional[Dict[str, Any]]
+    #: Error raised by the generation (None if it succeeded)
+    error: Optional[BaseException]
+    #: Time taken by the generation (in seconds), without the time spent waiting for a slot
+    latency: float
+
+    def __init__(
+        self,
+        index: int,
+        request: GenerationRequest,
+        result: Optional[Dict[str, Any]],
+        error: Optional[BaseException],
+        latency: float,
+    ):
+        self.index = index
+        self.request = request
+        self.result = result
+        self.error = error
+        self.latency = latency
+
+    @property
+    def succeeded(self) -> bool:
+        """
+        True if the generation succeeded
+        """
+
+        return self.error is None
+
+    @property
+    def cancelled(self) -> bool:
+        """
+        True if the generation was cancelled
+        """
+
+        return isinstance(self.error, asyncio.CancelledError)
+
+    def __repr__(self) -> str:
+        status = "ok" if self.succeeded else "cancelled" if self.cancelled else repr(self.error)
+
+        return f"GenerationResult(#{self.index}, {status}, {self.latency:.3f}s)"
+
+
+class GenerationStats:
+    """
+    Throughput and latency of a batch
+    """
+
+    #: Number of requests in the batch
+    total: int
+    #: Number of successful generations
+    succeeded: int
+    #: Number of failed generations
+    failed: int
+    #: Number of cancelled generations
+    cancelled: int
+    #: Latencies of the finished (successful or failed) generations, in completion order
+    latencies: List[float]
+
+    _start: Optional[float]
+    _end: Optional[float]
+
+    def __init__(self, total: int):
+        self.total = total
+        self.succeeded = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.latencies = []
+
+        self._start = None
+        self._end = None
+
+    def _add(self, result: GenerationResult):
+        if result.succeeded:
+            self.succeeded += 1
+        elif result.cancelled:
+            self.cancelled += 1
+        else:
+            self.failed += 1
+
+        if not result.cancelled:
+            self.latencies.append(result.latency)
+
+    @property
+    def elapsed(self) -> float:
+        """
+        Time since the start of the batch, until its end (in seconds)
+        """
+
+        if self._start is None:
+            return 0.0
+
+        end = time.perf_counter() if self._end is None else self._end
+
+        return end - self._start
+
+    @property
+    def throughput(self) -> float:
+        """
+        Successful generations per second
+        """
+
+        elapsed = self.elapsed
+
+        return self.succeeded / elapsed if elapsed else 0.0
+
+    def latency_percentile(self, percentile: float) -> float:
+        """
+        Get a percentile of the latencies (nearest-rank)
+
+        :param percentile: Percentile to get, between 0 and 100
+        """
+
+        if not self.latencies:
+            return 0.0
+
+        latencies = sorted(self.latencies)
+        rank = max(0, min(len(latencies) - 1, round(percentile / 100 * len(latencies)) - 1))
+
+        return latencies[rank]
+
+    @property
+    def mean_latency(self) -> float:
+        """
+        Mean latency of the finished generations (in seconds)
+        """
+
+        return sum(self.latencies) / len(self.latencies) if self.latencies else 0.0
+
+    def __repr__(self) -> str:
+        return (
+            f"GenerationStats({self.succeeded}/{self.total} succeeded, {self.failed} failed, "
+            f"{self.cancelled} cancelled, {self.elapsed:.2f}s, {self.throughput:.2f} gen/s, "
+            f"mean latency {self.mean_latency:.3f}s, p95 {self.latency_percentile(95):.3f}s)"
+        )
+
+
+class GenerationBatch:
+    """
+    Generations run concurrently, with a limit on the number of requests in flight.
+
+    Await the batch to get the results in the order of the requests, or iterate over it (``async for``)
+    to get them as they complete. Errors don't stop the batch, they are stored in the results.
+    The generations start on the first await or iteration.
+    """
+
+    _high_level: "HighLevel"  # noqa: F821
+    _requests: List[GenerationRequest]
+    _tasks: Optional[List[asyncio.Task]]
+    _results: List[Optional[GenerationResult]]
+    #: Indices of the finished generations, in the order they finished
+    _completed: List[int]
+    _changed: Optional[asyncio.Event]
+
+    #: Maximum number of generations in flight
+    concurrency: int
+    #: Throughput and latency of the batch
+    stats: GenerationStats
+
+    def __init__(
+        self,
+        high_level: "HighLevel",  # noqa: F821
+        requests: Iterable[Union[GenerationRequest, Tuple]],
+        concurrency: int = 4,
+    ):
+        """
+        :param high_level: High-level API to run the generations with
+        :param requests: Requests to run. Tuples are expanded as the arguments of :class:`GenerationRequest`
+        :param concurrency: Maximum number of generations in flight
+        """
+
+        if concurrency < 1:
+            raise ValueError(f"Concurrency must be at least 1, got {concurrency}")
+
+        self._high_level = high_level
+        self._requests = [r if isinstance(r, GenerationRequest) else GenerationRequest(*r) for r in requests]
+        self._tasks = None
+        self._results = [None] * len(self._requests)
+        self._completed = []
+        self._changed = None
+
+        self.concurrency = concurrency
+        self.stats = GenerationStats(len(self._requests))
+
+    def _get_templates(self) -> List[GenerationTemplate]:
+        # requests with the same settings share the same template, so the settings are only compiled once
+        templates: Dict[Tuple, GenerationTemplate] = {}
+
+        result = []
+        for request in self._requests:
+            if request.template is not None:
+                result.append(request.template)
+                continue
+
+            key = request._get_template_key()
+            template = templates.get(key)
+            if template is None:
+                template = GenerationTemplate(
+                    request.model,
+                    request.preset,
+                    request.global_settings,
+                    request.bad_words,
+                    request.biases,
+                    request.prefix,
+                    request.stop_sequences,
+                )
+                templates[key] = template
+
+            result.append(template)
+
+        return result
+
+    async def _run(self, index: int, template: GenerationTemplate, semaphore: asyncio.Semaphore):
+        request = self._requests[index]
+
+        result = None
+        error = None
+        start = None
+
+        try:
+            async with semaphore:
+                start = time.perf_counter()
+                result = await self._high_level.generate_from_template(
+                    request.prompt, template, request.keep_head, **request.kwargs
+                )
+        except asyncio.CancelledError as e:
+            # the task must end up cancelled, so the cancellation goes on once the result is recorded
+            error = e
+            raise
+        except Exception as e:  # pylint: disable=W0703
+            error = e
+        finally:
+            latency = 0.0 if start is None else time.perf_counter() - start
+            self._finish(GenerationResult(index, request, result, error, latency))
+
+    def _finish(self, result: GenerationResult):
+        if self._results[result.index] is not None:
+            return
+
+        self._results[result.index] = result
+        self._completed.append(result.index)
+        self.stats._add(result)
+
+        if len(self._completed) == len(self._results):
+            self.stats._end = time.perf_counter()
+
+        self._changed.set()
+
+    def _on_task_done(self, index: int, task: asyncio.Task):
+        # a task cancelled before its first step never runs _run, so its result is filled here (for the others,
+        # _run already recorded it)
+        if task.cancelled():
+            self._finish(GenerationResult(index, self._requests[index], None, asyncio.CancelledError(), 0.0))
+
+    def _start(self):
+        if self._tasks is not None:
+            return
+
+        templates = self._get_templates()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        self._changed = asyncio.Event()
+        self.stats._start = time.perf_counter()
+        if not self._requests:
+            self.stats._end = self.stats._start
+
+        self._tasks = [asyncio.ensure_future(self._run(i, template, semaphore)) for i, template in enumerate(templates)]
+        for i, task in enumerate(self._tasks):
+            task.add_done_callback(functools.partial(self._on_task_done, i))
+
+    def cancel(self):
+        """
+        Cancel the generations that are not finished. Their result holds a CancelledError
+        """
+
+        if self._tasks is None:
+            # never started, nothing is running
+            self._tasks = []
+            self._changed = asyncio.Event()
+            for i, request in enumerate(self._requests):
+                self._finish(GenerationResult(i, request, None, asyncio.CancelledError(), 0.0))
+
+            return
+
+        for task in self._tasks:
+            task.cancel()
+
+    async def __aiter__(self) -> AsyncIterator[GenerationResult]:
+        self._start()
+
+        try:
+            # read from the results, so the batch can be iterated several times
+            i = 0
+            while i < len(self._results):
+                if i < len(self._completed):
+                    yield self._results[self._completed[i]]
+                    i += 1
+                else:
+                    self._changed.clear()
+                    await self._changed.wait()
+        finally:
+            # the iteration was left early (break or error), don't leave generations running
+            self.cancel()
+
+    async def results(self) -> List[GenerationResult]:
+        """
+        Wait for all the generations to finish
+
+        :return: The results, in the order of the requests
+        """
+
+        self._start()
+
+        try:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        finally:
+            self.cancel()
+
+        # the done callbacks may not have run yet
+        for i, task in enumerate(self._tasks):
+            if task.done():
+                self._on_task_done(i, task)
+
+        return list(self._results)
+
+    def __await__(self) -> Generator[Any, None, List[GenerationResult]]:
+        return self.results().__await__()
@@ -0,0 +1,98 @@
+import re
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Pattern, Union
+
+from novelai_api.Preset import Model
+from novelai_api.Tokenizer import Tokenizer
+from novelai_api.utils import b64_to_tokens
+
+if TYPE_CHECKING:
+    from novelai_api.Logprobs import Logprobs
+
+
+class GenerationCandidate:
+    """
+    One of the candidates of :meth:`novelai_api._high_level.HighLevel.generate_candidates`
+    """
+
+    _logprobs: Optional["Logprobs"]
+
+    #: Index of the candidate, in the order the samples were requested
+    index: int
+    #: Generated tokens
+    tokens: List[int]
+    #: Generated text
+    text: str
+    #: Full response of the generation
+    response: Dict[str, Any]
+    #: Score given by the ranking function (None if the candidates are not ranked)
+    score: Optional[float]
+
+    def __init__(self, index: int, model: Model, response: Dict[str, Any]):
+        self.index = index
+        self.tokens = b64_to_tokens(response["output"], 4 if model is Model.Erato else 2)
+        self.text = Tokenizer.decode(model, self.tokens)
+        self.response = response
+        self.score = None
+
+        self._logprobs = None
+
+    @property
+    def logprobs(self) -> Optional["Logprobs"]:
+        """
+        Logprobs of the generation, parsed on first access (None if num_logprobs is not set in the global settings).
+        Requires the ``numpy`` package (``logprobs`` extra)
+        """
+
+        if self._logprobs is None and self.response.get("logprobs") is not None:
+            # optional dependency, only needed if the logprobs are used
+            from novelai_api.Logprobs import Logprobs  # pylint: disable=C0415
+
+            self._logprobs = Logprobs.from_response(self.response)
+
+        return self._logprobs
+
+    def __repr__(self) -> str:
+        score = "" if self.score is None else f", score={self.score:.4f}"
+
+        return f"GenerationCandidate(#{self.index}{score}, {self.text!r})"
+
+
+CandidateScorer = Callable[[GenerationCandidate], float]
+
+
+def score_mean_logprob(candidate: GenerationCandidate) -> float:
+    """
+    Score a candidate by the mean logprob (before sampling) of its tokens. Requires num_logprobs to be set
+    """
+
+    if candidate.logprobs is None:
+        raise ValueError("The candidate has no logprobs, num_logprobs must be set in the global settings")
+
+    if not len(candidate.logprobs):
+        return float("-inf")
+
+    return float(candidate.logprobs.chosen_before.mean(dtype="float64"))
+
+
+def score_length(candidate: GenerationCandidate) -> float:
+    """
+    Score a candidate by its length, in tokens
+    """
+
+    return float(len(candidate.tokens))
+
+
+def score_regex(pattern: Union[str, Pattern], flags: int = 0) -> CandidateScorer:
+    """
+    Create a scorer counting the matches of a pattern in the text of the candidate
+
+    :param pattern: Pattern to search for
+    :param flags: Flags of the pattern, if it is not compiled
+    """
+
+    pattern = re.compile(pattern, flags) if isinstance(pattern, str) else pattern
+
+    def scorer(candidate: GenerationCandidate) -> float:
+        return float(sum(1 for _ in pattern.finditer(candidate.text)))
+
+    return scorer
@@ -0,0 +1,369 @@
+"""
+Relay of a streamed generation to multiple subscribers, so a generation shown to several clients
+only needs one request.
+"""
+
+import asyncio
+import json
+from collections import deque
+from enum import Enum
+from typing import Any, AsyncIterable, Deque, Dict, List, Optional
+
+from novelai_api.Preset import Model
+from novelai_api.StopCondition import StreamStopper
+from novelai_api.utils import b64_to_tokens
+
+
+class SlowSubscriberPolicy(Enum):
+    """
+    What to do when the queue of a subscriber is full
+    """
+
+    #: Wait for the subscriber to catch up. The relay stops reading the stream meanwhile, which slows down
+    #: the other subscribers (and the upstream stream, through flow control)
+    Wait = "wait"
+    #: Disconnect the subscriber (its iteration ends, and :attr:`RelaySubscription.lagged` is set)
+    Disconnect = "disconnect"
+
+
+class RelayError(Exception):
+    """
+    Error raised to the subscribers of a relay when the relayed stream failed. Each subscriber gets its own
+    instance, the error of the stream is its cause
+    """
+
+    #: Error that ended the stream
+    error: BaseException
+
+    def __init__(self, error: BaseException):
+        super().__init__(f"The relayed stream failed: {error}")
+        self.error = error
+
+
+class RelaySubscription:
+    """
+    Events of a relay for one subscriber. Iterate over it (``async for``) to get the events.
+
+    Leaving the iteration early doesn't unsubscribe: use it as a context manager (``async with``), or call
+    :meth:`close`, so it doesn't hold back the relay
+    """
+
+    _relay: "GenerationRelay"
+    _events: Deque[Dict[str, Any]]
+    _capacity: int
+    #: Number of replayed events still waiting, they don't count against the capacity
+    _backlog: int
+    _readable: asyncio.Event
+    _writable: asyncio.Event
+
+    #: True if the subscription is closed (unsubscribed, disconnected or the relay ended)
+    closed: bool
+    #: True if the subscriber has been disconnected for being too slow
+    lagged: bool
+
+    def __init__(self, relay: "GenerationRelay", replay: List[Dict[str, Any]], capacity: int):
+        self._relay = relay
+        self._events = deque(replay)
+        self._capacity = capacity
+        self._backlog = len(replay)
+        self._readable = asyncio.Event()
+        self._writable = asyncio.Event()
+
+        self.closed = False
+        self.lagged = False
+
+        self._writable.set()
+        if self._events:
+            self._readable.set()
+
+    async def _put(self, event: Dict[str, Any]):
+        while not self.closed and self._capacity + self._backlog <= len(self._events):
+            if self._relay.slow_policy is SlowSubscriberPolicy.Disconnect:
+                self.lagged = True
+                self.close()
+                return
+
+            self._writable.clear()
+            await self._writable.wait()
+
+        if not self.closed:
+            self._events.append(event)
+            self._readable.set()
+
+    def _end(self):
+        # wake up the subscriber, the events left can still be read
+        self._readable.set()
+
+    def close(self):
+        """
+        Unsubscribe from the relay
+        """
+
+        if self.closed:
+            return
+
+        self.closed = True
+        self._relay._subscriptions.discard(self)
+
+        # don't leave the relay waiting for this subscription
+        self._writable.set()
+        self._readable.set()
+
+    def __aiter__(self) -> "RelaySubscription":
+        return self
+
+    async def __anext__(self) -> Dict[str, Any]:
+        while not self._events:
+            if self._relay.done:
+                error = self._relay.error
+                if error is not None:
+                    # the error is shared by the subscribers, raising it as is would chain their tracebacks
+                    raise RelayError(error) from error
+
+                raise StopAsyncIteration
+
+            if self.closed:
+                raise StopAsyncIteration
+
+            self._readable.clear()
+            await self._readable.wait()
+
+        event = self._events.popleft()
+        if self._backlog:
+            self._backlog -= 1
+
+        if len(self._events) < self._capacity + self._backlog:
+            self._writable.set()
+
+        return event
+
+    async def __aenter__(self) -> "RelaySubscription":
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class GenerationRelay:
+    """
+    Read a stream (e.g. :meth:`HighLevel.generate_stream <novelai_api._high_level.HighLevel.generate_stream>`) once,
+    and broadcast its events to any number of subscribers.
+
+    Each event is the event of the stream, with the decoded token(s) added:
+
+    * ``index``: index of the event in the stream
+    * ``tokens``: list of token ids
+    * ``text``: text added by the event (can be empty if a character is split between tokens)
+
+    Subscribers joining late get the past events first (see ``replay_size``).
+    """
+
+    _stream: AsyncIterable[Dict[str, Any]]
+    _task: Optional[asyncio.Task]
+    _subscriptions: set
+    _history: Deque[Dict[str, Any]]
+    _stopper: StreamStopper
+    _token_size: int
+
+    #: Model of the generation, for decoding the tokens
+    model: Model
+    #: Number of live events each subscriber can have waiting (the replayed events come on top of it)
+    queue_size: int
+    #: What to do when a subscriber is too slow
+    slow_policy: SlowSubscriberPolicy
+    #: True once the stream ended
+    done: bool
+    #: Error that ended the stream, if any (raised to the subscribers, as the cause of a :class:`RelayError`)
+    error: Optional[BaseException]
+
+    def __init__(
+        self,
+        stream: AsyncIterable[Dict[str, Any]],
+        model: Optional[Model] = None,
+        replay_size: Optional[int] = None,
+        queue_size: int = 64,
+        slow_policy: SlowSubscriberPolicy = SlowSubscriberPolicy.Wait,
+    ):
+        """
+        :param stream: Stream to relay
+        :param model: Model of the generation (taken from the stream if it is a GenerationStream)
+        :param replay_size: Number of past events given to late subscribers (None for all of them)
+        :param queue_size: Number of events each subscriber can have waiting
+        :param slow_policy: What to do when a subscriber is too slow
+        """
+
+        if model is None:
+            metrics = getattr(stream, "metrics", None)
+            model = getattr(metrics, "model", None)
+
+        if model is None:
+            raise ValueError("The model of the generation must be provided")
+
+        if queue_size < 1:
+            raise ValueError(f"queue_size must be at least 1, got {queue_size}")
+
+        self._stream = stream
+        self._task = None
+        self._subscriptions = set()
+        self._history = deque(maxlen=replay_size)
+        self._stopper = StreamStopper(model, [])
+        self._token_size = 4 if model is Model.Erato else 2
+
+        self.model = model
+        self.queue_size = queue_size
+        self.slow_policy = slow_policy
+        self.done = False
+        self.error = None
+
+    @property
+    def text(self) -> str:
+        """
+        Text generated so far
+        """
+
+        return self._stopper.text
+
+    def subscribe(self, replay: bool = True, last_index: Optional[int] = None) -> RelaySubscription:
+        """
+        Subscribe to the events of the relay
+
+        :param replay: Get the past events first (the ones still in the replay buffer)
+        :param last_index: Index of the last event already received (e.g. to resume), only the following ones
+                           are replayed
+
+        :return: The subscription
+        """
+
+        history = []
+        if replay:
+            history = [e for e in self._history if last_index is None or last_index < e["index"]]
+
+        subscription = RelaySubscription(self, history, self.queue_size)
+        if self.done:
+            subscription.closed = True
+        else:
+            self._subscriptions.add(subscription)
+
+        return subscription
+
+    def start(self) -> "GenerationRelay":
+        """
+        Start reading the stream. Subscribers can join before or after
+        """
+
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+        return self
+
+    async def wait(self):
+        """
+        Wait for the stream to end. The error of the stream is not raised (see :attr:`error`)
+        """
+
+        self.start()
+
+        await asyncio.wait([self._task])
+
+    async def close(self):
+        """
+        Stop reading the stream (closing it, which stops the generation) and end the subscriptions
+        """
+
+        if self._task is None:
+            self._finish(None)
+            await self._close_stream()
+        else:
+            self._task.cancel()
+            await asyncio.wait([self._task])
+
+    async def __aenter__(self) -> "GenerationRelay":
+        return self.start()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    def _decode(self, e: Dict[str, Any], index: int) -> Dict[str, Any]:
+        token = e.get("token")
+        tokens = [] if token is None else b64_to_tokens(token, self._token_size)
+
+        start = len(self._stopper.text)
+        self._stopper.feed(tokens)
+
+        return {**e, "index": index, "tokens": tokens, "text": self._stopper.text[start:]}
+
+    async def _close_stream(self):
+        aclose = getattr(self._stream, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+    def _finish(self, error: Optional[BaseException]):
+        self.done = True
+        self.error = error
+
+        for subscription in list(self._subscriptions):
+            subscription._end()
+
+        self._subscriptions.clear()
+
+    async def _run(self):
+        error = None
+
+        try:
+            index = 0
+            async for e in self._stream:
+                event = self._decode(e, index)
+                index += 1
+
+                self._history.append(event)
+                for subscription in list(self._subscriptions):
+                    await subscription._put(event)
+        except asyncio.CancelledError:
+            # the subscribers are notified below, the task still ends cancelled
+            raise
+        except Exception as err:  # pylint: disable=W0703
+            error = err
+        finally:
+            self._finish(error)
+            await self._close_stream()
+
+    def sse_handler(self):
+        """
+        Create an aiohttp handler serving the events of the relay as Server Sent Events (e.g. to re-serve
+        the generation to browsers). The ``Last-Event-ID`` header is supported, to resume after a reconnection.
+        The end of the stream is sent as an ``end`` event (or an ``error`` event if the stream failed, or a ``lagged``
+        event if the client was disconnected for being too slow)
+
+        >>> app.router.add_get("/generation", relay.sse_handler())
+
+        :return: The handler, to add to an aiohttp.web application
+        """
+
+        # imported here, as it is only needed when serving the relay
+        from aiohttp import web  # pylint: disable=C0415
+
+        async def handler(request: web.Request) -> web.StreamResponse:
+            last_event_id = request.headers.get("Last-Event-ID")
+            last_index = int(last_event_id) if last_event_id is not None and last_event_id.isdigit() else None
+
+            response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+            await response.prepare(request)
+
+            async with self.subscribe(last_index=last_index) as subscription:
+                try:
+                    async for event in subscription:
+                        await response.write(f"id: {event['index']}\ndata: {json.dumps(event)}\n\n".encode())
+
+                    if subscription.lagged:
+                        await response.write(b"event: lagged\ndata: {}\n\n")
+                    else:
+                        await response.write(b"event: end\ndata: {}\n\n")
+                except (ConnectionResetError, asyncio.CancelledError):
+                    raise
+                except Exception as e:  # pylint: disable=W0703
+                    error = e.error if isinstance(e, RelayError) else e
+                    await response.write(f"event: error\ndata: {json.dumps({'message': str(error)})}\n\n".encode())
+
+            return response
+
+        return handler
@@ -0,0 +1,227 @@
+import time
+from base64 import b64decode
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from novelai_api.Preset import Model
+from novelai_api.StopCondition import StreamStopper
+
+
+class StreamMetrics:
+    """
+    Timings of a streamed generation. All the durations are in seconds, and are None until known
+    """
+
+    #: Upper bounds (in seconds) of the buckets of the inter-token latency histogram
+    LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, float("inf"))
+
+    #: Model of the generation
+    model: Optional[Model]
+    #: Time the stream started (time.perf_counter)
+    start: Optional[float]
+    #: Time the response headers were received
+    first_byte: Optional[float]
+    #: Time the first token was received
+    first_token: Optional[float]
+    #: Time the stream ended (finished, closed or failed)
+    end: Optional[float]
+    #: Number of tokens received
+    token_count: int
+    #: Time between consecutive tokens
+    inter_token_latencies: List[float]
+    #: Error that ended the stream, if any
+    error: Optional[BaseException]
+
+    _last_token: Optional[float]
+
+    def __init__(self, model: Optional[Model] = None):
+        self.model = model
+        self.start = None
+        self.first_byte = None
+        self.first_token = None
+        self.end = None
+        self.token_count = 0
+        self.inter_token_latencies = []
+        self.error = None
+
+        self._last_token = None
+
+    def _on_start(self):
+        if self.start is None:
+            self.start = time.perf_counter()
+
+    def _on_response(self, *_):
+        if self.first_byte is None:
+            self.first_byte = time.perf_counter()
+
+    def _on_tokens(self, count: int):
+        now = time.perf_counter()
+
+        if self.first_token is None:
+            self.first_token = now
+        else:
+            self.inter_token_latencies.append(now - self._last_token)
+
+        self._last_token = now
+        self.token_count += count
+
+    def _on_end(self, error: Optional[BaseException] = None):
+        if self.end is None:
+            self.end = time.perf_counter()
+            self.error = error
+
+    def _since_start(self, t: Optional[float]) -> Optional[float]:
+        if self.start is None or t is None:
+            return None
+
+        return t - self.start
+
+    @property
+    def ttfb(self) -> Optional[float]:
+        """
+        Time to first byte (time until the response headers were received)
+        """
+
+        return self._since_start(self.first_byte)
+
+    @property
+    def ttft(self) -> Optional[float]:
+        """
+        Time to first token
+        """
+
+        return self._since_start(self.first_token)
+
+    @property
+    def duration(self) -> Optional[float]:
+        """
+        Total duration of the stream
+        """
+
+        return self._since_start(self.end)
+
+    @property
+    def tokens_per_second(self) -> Optional[float]:
+        """
+        Rate of the tokens, after the first one (so it doesn't include the time to first token)
+        """
+
+        if self.first_token is None or self._last_token is None or self._last_token == self.first_token:
+            return None
+
+        return (self.token_count - 1) / (self._last_token - self.first_token)
+
+    def latency_histogram(self) -> Dict[float, int]:
+        """
+        Histogram of the inter-token latencies
+
+        :return: Number of latencies in each bucket, keyed by the upper bound of the bucket (see LATENCY_BUCKETS)
+        """
+
+        histogram = dict.fromkeys(self.LATENCY_BUCKETS, 0)
+        for latency in self.inter_token_latencies:
+            for bound in self.LATENCY_BUCKETS:
+                if latency <= bound:
+                    histogram[bound] += 1
+                    break
+
+        return histogram
+
+    def __repr__(self) -> str:
+        def ms(value: Optional[float]) -> str:
+            return "?" if value is None else f"{value * 1000:.1f}ms"
+
+        tps = self.tokens_per_second
+        tps = "?" if tps is None else f"{tps:.1f}"
+
+        return (
+            f"StreamMetrics(ttfb={ms(self.ttfb)}, ttft={ms(self.ttft)}, tokens={self.token_count}, "
+            f"tokens/s={tps}, duration={ms(self.duration)})"
+        )
+
+
+class GenerationStream:
+    """
+    Stream of a text generation, returned by
+    :meth:`HighLevel.generate_stream <novelai_api._high_level.HighLevel.generate_stream>`.
+    Iterate over it (``async for``) to get the events. The timings are recorded in :attr:`metrics`.
+
+    Leaving the iteration early doesn't close the stream: use it as a context manager (``async with``),
+    or call :meth:`aclose`
+    """
+
+    _events: AsyncIterator[Dict[str, Any]]
+    _callback: Optional[Callable[[StreamMetrics], None]]
+    _token_size: int
+
+    #: Timings of the stream
+    metrics: StreamMetrics
+    #: Stopper checking the stop conditions of the stream (None if there are none). Once the stream ends,
+    #: its ``text`` and ``tokens`` hold the generation, trimmed at the stop condition
+    stopper: Optional[StreamStopper]
+
+    def __init__(
+        self,
+        events: AsyncIterator[Dict[str, Any]],
+        metrics: StreamMetrics,
+        callback: Optional[Callable[[StreamMetrics], None]] = None,
+        stopper: Optional[StreamStopper] = None,
+    ):
+        """
+        :param events: Events of the stream
+        :param metrics: Metrics to record the timings in (shared with the request, for the time to first byte)
+        :param callback: Function called with the metrics once the stream ends
+        :param stopper: Stopper fed with the events of the stream
+        """
+
+        self._events = events
+        self._callback = callback
+        self._token_size = 4 if metrics.model is Model.Erato else 2
+
+        self.metrics = metrics
+        self.stopper = stopper
+
+    def _finish(self, error: Optional[BaseException] = None):
+        if self.metrics.end is not None:
+            return
+
+        self.metrics._on_end(error)
+
+        if self._callback is not None:
+            self._callback(self.metrics)
+
+    def __aiter__(self) -> "GenerationStream":
+        return self
+
+    async def __anext__(self) -> Dict[str, Any]:
+        self.metrics._on_start()
+
+        try:
+            e = await self._events.__anext__()
+        except StopAsyncIteration:
+            self._finish()
+            raise
+        except BaseException as err:
+            self._finish(err)
+            raise
+
+        token = e.get("token")
+        if token is not None:
+            self.metrics._on_tokens(len(b64decode(token)) // self._token_size)
+
+        return e
+
+    async def __aenter__(self) -> "GenerationStream":
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.aclose()
+
+    async def aclose(self):
+        """
+        Close the stream (and the connection), stopping the generation
+        """
+
+        try:
+            await self._events.aclose()
+        finally:
+            self._finish()
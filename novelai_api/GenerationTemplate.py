@@ -0,0 +1,361 @@
+import json
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Type, Union
+
+from novelai_api.BanList import BanList
+from novelai_api.BiasGroup import BiasGroup
+from novelai_api.GlobalSettings import GlobalSettings
+from novelai_api.Preset import Model, Preset
+from novelai_api.Tokenizer import Tokenizer
+
+
+def _as_list(
+    name: str,
+    value: Union[Iterable[BanList], Iterable[BiasGroup], BanList, BiasGroup, None],
+    cls: Union[Type[BanList], Type[BiasGroup]],
+) -> List[Union[BanList, BiasGroup]]:
+    if value is None:
+        return []
+
+    if isinstance(value, cls):
+        return [value]
+
+    value = list(value)
+    for i, obj in enumerate(value):
+        if not isinstance(obj, cls):
+            raise ValueError(f"Expected type '{cls}' for item #{i} of '{name}', but got '{type(obj)}'")
+
+    return value
+
+
+def _tokenize_stop_sequences(model: Model, stop_sequences: Union[List[List[int]], List[str]]) -> List[List[int]]:
+    if not isinstance(stop_sequences, list):
+        raise ValueError(f"Expected type 'list' for 'stop_sequences', but got '{type(stop_sequences)}'")
+
+    tokenized = []
+    for i, obj in enumerate(stop_sequences):
+        if isinstance(obj, str):
+            tokenized.append(Tokenizer.encode(model, obj))
+        elif isinstance(obj, list):
+            tokenized.append(obj)
+        else:
+            raise ValueError(
+                f"Expected type 'str' or 'list' for item #{i} of 'stop_sequences', " f"but got '{type(obj)}'"
+            )
+
+    return tokenized
+
+
+def merge_bad_words_ids(sequences: Iterable[List[int]]) -> List[List[int]]:
+    """
+    Remove the redundant sequences of a "bad_words_ids" parameter, keeping the order of the first occurrences.
+
+    A sequence is redundant if it is a duplicate, or if its last token is already banned on its own
+    (the sequence can never be completed, so banning it changes nothing)
+
+    :param sequences: Tokenized sequences to ban
+
+    :return: Deduplicated sequences
+    """
+
+    sequences = list(sequences)
+    single_tokens = set(s[0] for s in sequences if len(s) == 1)
+
+    seen = set()
+    merged = []
+    for sequence in sequences:
+        if not sequence:
+            continue
+
+        key = tuple(sequence)
+        if key in seen:
+            continue
+
+        if 1 < len(sequence) and sequence[-1] in single_tokens:
+            continue
+
+        seen.add(key)
+        merged.append(sequence)
+
+    return merged
+
+
+def merge_logit_bias_exp(entries: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Merge the entries of a "logit_bias_exp" parameter that bias the same sequence with the same options,
+    by summing their bias, keeping the order of the first occurrences. Entries with a null bias are removed
+
+    :param entries: Bias entries, as returned by :meth:`BiasGroup.to_logit_bias_exp`
+
+    :return: Merged entries
+    """
+
+    merged: Dict[Tuple, Dict[str, Any]] = {}
+    for entry in entries:
+        key = (tuple(entry["sequence"]), entry["ensure_sequence_finish"], entry["generate_once"])
+
+        previous = merged.get(key)
+        if previous is None:
+            # copy, as entries can be shared with the bias groups' cache
+            merged[key] = dict(entry)
+        else:
+            previous["bias"] += entry["bias"]
+
+    return [entry for entry in merged.values() if entry["bias"] != 0 and entry["sequence"]]
+
+
+def get_payload_size(params: Dict[str, Any]) -> int:
+    """
+    Get the size (in bytes) of the parameters, once serialized in a request body
+
+    :param params: Parameters of the request
+    """
+
+    return len(json.dumps(params, separators=(",", ":")).encode())
+
+
+def _copy_param(value: Any) -> Any:
+    # the lists of the compiled parameters are copied with their items (token lists, bias entries), so the
+    # parameters of a request can be modified without changing the template
+    if isinstance(value, list):
+        return [list(e) if isinstance(e, list) else dict(e) if isinstance(e, dict) else e for e in value]
+
+    return value
+
+
+def _adjust_repetition_penalty(model: Model, params: Dict[str, Any]):
+    # adjust repetition penalty value for Sigurd and Euterpe
+    if model in (Model.Sigurd, Model.Euterpe) and "repetition_penalty" in params:
+        rep_pen = params["repetition_penalty"]
+        params["repetition_penalty"] = (0.525 * (rep_pen - 1) / 7) + 1
+
+
+def build_generation_params(
+    model: Model,
+    preset: Preset,
+    global_settings: GlobalSettings,
+    bad_words: Optional[Union[Iterable[BanList], BanList]] = None,
+    biases: Optional[Union[Iterable[BiasGroup], BiasGroup]] = None,
+    prefix: Optional[str] = None,
+    stop_sequences: Optional[Union[List[List[int]], List[str]]] = None,
+    **kwargs,
+) -> Dict[str, Any]:
+    """
+    Build the parameters of a text generation request. None of the arguments are modified
+
+    :param model: Model to use for the AI
+    :param preset: Preset to use for the generation settings
+    :param global_settings: Global settings (used for generation)
+    :param bad_words: Tokens to ban for this generation
+    :param biases: Tokens to bias (up or down) for this generation
+    :param prefix: Module to use for this generation (see :ref:`list of modules <list-of-modules>`)
+    :param stop_sequences: List of strings or tokens to stop the generation at
+    :param kwargs: Additional parameters to pass to the requests. Can also be used to overwrite existing parameters
+
+    :return: Parameters of the request
+    """
+
+    if preset is None:
+        raise ValueError("Uninitialized preset")
+    if preset.model is not model:
+        raise ValueError(f"Preset '{preset.name}' (model {preset.model}) is not compatible with model {model}")
+
+    preset_params = preset.to_settings()
+
+    # special case for repetition penalty whitelist, as it belongs to global settings but is stored in preset files
+    rep_pen_whitelist = True if preset_params.pop("repetition_penalty_default_whitelist", False) else None
+    global_params = global_settings.to_settings(model, rep_pen_whitelist)
+
+    params = {
+        "repetition_penalty_whitelist": list(
+            set(
+                item
+                for sublist in [
+                    global_params.pop("repetition_penalty_whitelist", []),
+                    preset_params.pop("repetition_penalty_whitelist", []),
+                ]
+                for inner_list in sublist
+                for item in inner_list
+            )
+        )
+    }
+
+    params.update(preset_params)
+    params.update(global_params)
+    params.update(kwargs)
+
+    _adjust_repetition_penalty(model, params)
+
+    # module
+    params["prefix"] = "vanilla" if prefix is None else prefix
+
+    # bans and biases
+    for obj in _as_list("bad_words_ids", bad_words, BanList):
+        params["bad_words_ids"].extend(obj.to_bad_words_ids(model))
+
+    for obj in _as_list("logit_bias_exp", biases, BiasGroup):
+        params["logit_bias_exp"].extend(obj.to_logit_bias_exp(model))
+
+    if params.get("bad_words_ids"):
+        params["bad_words_ids"] = merge_bad_words_ids(params["bad_words_ids"])
+
+    if params.get("logit_bias_exp"):
+        params["logit_bias_exp"] = merge_logit_bias_exp(params["logit_bias_exp"])
+
+    for k in ("bad_words_ids", "logit_bias_exp"):
+        if k in params and not params[k]:
+            del params[k]
+
+    # stop sequences
+    if stop_sequences is not None:
+        params["stop_sequences"] = _tokenize_stop_sequences(model, stop_sequences)
+
+    return params
+
+
+class GenerationTemplate:
+    """
+    Generation request compiled once, to be reused for many generations.
+
+    Resolving the preset and the global settings, and tokenizing the ban lists, the biases and the stop sequences
+    is done on the first use only. Changing any of the inputs (preset, global settings, ban lists, bias groups,
+    or the attributes of the template) makes the template recompile on the next use.
+
+    In-place modification of a list nested in a setting of the preset (e.g. ``preset.stop_sequences[0].append(...)``)
+    is not detected, and should be followed by :meth:`invalidate`.
+    """
+
+    _params: Optional[Dict[str, Any]]
+    _signature: Optional[Tuple]
+    _payload_size: Optional[int]
+
+    #: Model to use for the AI
+    model: Model
+    #: Preset to use for the generation settings
+    preset: Preset
+    #: Global settings (used for generation)
+    global_settings: GlobalSettings
+    #: Tokens to ban for the generations
+    bad_words: List[BanList]
+    #: Tokens to bias (up or down) for the generations
+    biases: List[BiasGroup]
+    #: Module to use for the generations
+    prefix: Optional[str]
+    #: List of strings or tokens to stop the generations at
+    stop_sequences: Optional[Union[List[List[int]], List[str]]]
+
+    def __init__(
+        self,
+        model: Model,
+        preset: Preset,
+        global_settings: GlobalSettings,
+        bad_words: Optional[Union[Iterable[BanList], BanList]] = None,
+        biases: Optional[Union[Iterable[BiasGroup], BiasGroup]] = None,
+        prefix: Optional[str] = None,
+        stop_sequences: Optional[Union[List[List[int]], List[str]]] = None,
+    ):
+        """
+        :param model: Model to use for the AI
+        :param preset: Preset to use for the generation settings
+        :param global_settings: Global settings (used for generation)
+        :param bad_words: Tokens to ban for the generations
+        :param biases: Tokens to bias (up or down) for the generations
+        :param prefix: Module to use for the generations (see :ref:`list of modules <list-of-modules>`)
+        :param stop_sequences: List of strings or tokens to stop the generations at
+        """
+
+        self._params = None
+        self._signature = None
+        self._payload_size = None
+
+        self.model = model
+        self.preset = preset
+        self.global_settings = global_settings
+        self.bad_words = _as_list("bad_words", bad_words, BanList)
+        self.biases = _as_list("biases", biases, BiasGroup)
+        self.prefix = prefix
+        self.stop_sequences = stop_sequences
+
+    def _get_signature(self) -> Tuple:
+        stop_sequences = self.stop_sequences
+        if isinstance(stop_sequences, list):
+            stop_sequences = tuple(s if isinstance(s, str) else tuple(s) for s in stop_sequences)
+
+        return (
+            self.model,
+            self.prefix,
+            id(self.preset),
+            getattr(self.preset, "_version", None),
+            id(self.global_settings),
+            self.global_settings._version,
+            tuple((id(b), b._version) for b in self.bad_words),
+            tuple((id(b), b._version) for b in self.biases),
+            stop_sequences,
+        )
+
+    def is_stale(self) -> bool:
+        """
+        True if the inputs changed since the last compilation (or if the template was never compiled)
+        """
+
+        return self._params is None or self._signature != self._get_signature()
+
+    def invalidate(self):
+        """
+        Force the recompilation of the template on the next use
+        """
+
+        self._params = None
+        self._signature = None
+        self._payload_size = None
+
+    def compile(self) -> Dict[str, Any]:
+        """
+        Compile the template, if needed
+
+        :return: Compiled parameters. They should not be modified, use :meth:`build` to get a modifiable copy
+        """
+
+        if self.is_stale():
+            signature = self._get_signature()
+            self._params = build_generation_params(
+                self.model,
+                self.preset,
+                self.global_settings,
+                self.bad_words,
+                self.biases,
+                self.prefix,
+                self.stop_sequences,
+            )
+            self._signature = signature
+            self._payload_size = None
+
+        return self._params
+
+    @property
+    def payload_size(self) -> int:
+        """
+        Size (in bytes) of the compiled parameters, once serialized in a request body
+        """
+
+        params = self.compile()
+        if self._payload_size is None:
+            self._payload_size = get_payload_size(params)
+
+        return self._payload_size
+
+    def build(self, **kwargs) -> Dict[str, Any]:
+        """
+        Get the parameters of a request from the compiled template
+
+        :param kwargs: Additional parameters to pass to the requests. Can also be used to overwrite existing parameters
+
+        :return: Parameters of the request. They can be modified, the lists are copies
+        """
+
+        params = {k: _copy_param(v) for k, v in self.compile().items()}
+
+        if kwargs:
+            _adjust_repetition_penalty(self.model, kwargs)
+            params.update(kwargs)
+
+        return params
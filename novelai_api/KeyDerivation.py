@@ -0,0 +1,322 @@
+import asyncio
+import json
+import os
+from concurrent.futures import Executor
+from hashlib import blake2b, scrypt
+from pathlib import Path
+from threading import Lock
+from typing import Callable, Dict, Optional, Tuple, Union
+
+from nacl.exceptions import CryptoError
+from nacl.secret import SecretBox
+
+from novelai_api.python_utils import assert_type
+from novelai_api.utils import get_access_key, get_encryption_key
+
+
+class DerivedKeyCache:
+    """
+    Persistent storage for the derived keys. The base class doesn't store anything
+    """
+
+    def load(self, digest: str) -> Optional[Dict[str, str]]:
+        """
+        Load the keys stored for the digest
+
+        :param digest: Identifier of the account
+        :return: Dict of stored keys (hex-encoded for bytes), or None if nothing is stored
+        """
+
+        return None
+
+    def save(self, digest: str, keys: Dict[str, str]):
+        """
+        Store the keys for the digest
+
+        :param digest: Identifier of the account
+        :param keys: Dict of keys to store (hex-encoded for bytes)
+        """
+
+    def delete(self, digest: str):
+        """
+        Remove the keys stored for the digest, if any
+
+        :param digest: Identifier of the account
+        """
+
+
+class FileDerivedKeyCache(DerivedKeyCache):
+    """
+    Encrypted on-disk storage for the derived keys.
+
+    The file is encrypted with the provided secret. The derived keys give full access to the account,
+    so the secret should not be stored next to the file.
+    """
+
+    _path: Path
+    _box: SecretBox
+    _lock: Lock
+
+    def __init__(self, path: Union[str, os.PathLike], secret: bytes):
+        """
+        :param path: Path of the cache file
+        :param secret: Secret used to encrypt the file (32 bytes)
+        """
+
+        assert_type(bytes, secret=secret)
+
+        self._path = Path(path)
+        self._box = SecretBox(secret)
+        self._lock = Lock()
+
+    def _read(self) -> Dict[str, Dict[str, str]]:
+        if not self._path.exists():
+            return {}
+
+        try:
+            return json.loads(self._box.decrypt(self._path.read_bytes()).decode())
+        except (CryptoError, ValueError):
+            # wrong secret or corrupted file, start over
+            return {}
+
+    def _write(self, content: Dict[str, Dict[str, str]]):
+        data = bytes(self._box.encrypt(json.dumps(content).encode()))
+
+        tmp_path = self._path.with_name(f"{self._path.name}.tmp")
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+
+        os.replace(tmp_path, self._path)
+
+    def load(self, digest: str) -> Optional[Dict[str, str]]:
+        with self._lock:
+            return self._read().get(digest)
+
+    def save(self, digest: str, keys: Dict[str, str]):
+        with self._lock:
+            content = self._read()
+            content[digest] = keys
+            self._write(content)
+
+    def delete(self, digest: str):
+        with self._lock:
+            content = self._read()
+            if content.pop(digest, None) is not None:
+                self._write(content)
+
+
+class KeyringDerivedKeyCache(DerivedKeyCache):
+    """
+    Storage for the derived keys in the OS keyring. Requires the ``keyring`` package
+    """
+
+    service: str
+
+    def __init__(self, service: str = "novelai_api"):
+        """
+        :param service: Name of the keyring service to store the keys under
+        """
+
+        # optional dependency, only needed if this storage is used
+        import keyring  # pylint: disable=C0415
+
+        self._keyring = keyring
+        self.service = service
+
+    def load(self, digest: str) -> Optional[Dict[str, str]]:
+        value = self._keyring.get_password(self.service, digest)
+
+        return None if value is None else json.loads(value)
+
+    def save(self, digest: str, keys: Dict[str, str]):
+        self._keyring.set_password(self.service, digest, json.dumps(keys))
+
+    def delete(self, digest: str):
+        try:
+            self._keyring.delete_password(self.service, digest)
+        except self._keyring.errors.PasswordDeleteError:
+            pass
+
+
+class KeyDerivation:
+    """
+    Derivation of the access key and encryption key from the credentials.
+
+    The Argon2 derivations are slow by design. They are run in a thread pool, concurrently, and their result is
+    cached in memory for the lifetime of the object. Concurrent derivations of the same key are only run once.
+    A :class:`DerivedKeyCache` can be provided to persist the keys between processes.
+
+    The persisted keys are stored under a digest of the email, with a salted scrypt verifier of the credentials.
+    The keys are only used if the verifier matches, so a wrong (or changed) password derives the keys again.
+    """
+
+    #: Cost of the scrypt verifier of the persisted keys (see hashlib.scrypt)
+    VERIFIER_COST = {"n": 2**14, "r": 8, "p": 1}
+
+    # keys in memory, by digest of the email and digest of the credentials
+    _memory: Dict[Tuple[str, str], Dict[str, str]]
+    # locks of the derivations in progress, by memory id and name of the key
+    _derivations: Dict[Tuple[Tuple[str, str], str], Lock]
+    _lock: Lock
+
+    #: Persistent storage for the keys (None to only keep them in memory)
+    storage: Optional[DerivedKeyCache]
+    #: Executor to run the derivations in (None for the default executor of the loop)
+    executor: Optional[Executor]
+
+    def __init__(self, storage: Optional[DerivedKeyCache] = None, executor: Optional[Executor] = None):
+        self._memory = {}
+        self._derivations = {}
+        self._lock = Lock()
+
+        self.storage = storage
+        self.executor = executor
+
+    @staticmethod
+    def _digest(email: str, password: Optional[str] = None) -> str:
+        blake = blake2b(digest_size=32, person=b"nai_key_cache")
+        blake.update(email.encode() if password is None else f"{email}\0{password}".encode())
+
+        return blake.hexdigest()
+
+    @classmethod
+    def _verifier(cls, email: str, password: str, salt: str) -> str:
+        return scrypt(f"{email}\0{password}".encode(), salt=bytes.fromhex(salt), dklen=32, **cls.VERIFIER_COST).hex()
+
+    def _get(self, email: str, password: str, name: str) -> Optional[str]:
+        # the keys in memory are identified by the credentials, the persisted ones by the email and a verifier
+        email_digest = self._digest(email)
+        memory_id = (email_digest, self._digest(email, password))
+
+        with self._lock:
+            keys = self._memory.get(memory_id)
+
+        if keys is None and self.storage is not None:
+            stored = self.storage.load(email_digest)
+            if stored is not None and "salt" in stored:
+                if stored.get("verifier") == self._verifier(email, password, stored["salt"]):
+                    with self._lock:
+                        keys = self._memory.setdefault(memory_id, stored)
+
+        return None if keys is None else keys.get(name)
+
+    def _set(self, email: str, password: str, name: str, value: str):
+        email_digest = self._digest(email)
+        memory_id = (email_digest, self._digest(email, password))
+
+        with self._lock:
+            keys = self._memory.get(memory_id)
+
+        if keys is None:
+            # new credentials, the verifier is computed outside the lock as it is slow
+            salt = os.urandom(16).hex()
+            verifier = self._verifier(email, password, salt)
+
+            with self._lock:
+                keys = self._memory.setdefault(memory_id, {"salt": salt, "verifier": verifier})
+
+        with self._lock:
+            keys[name] = value
+
+            if self.storage is not None:
+                self.storage.save(email_digest, dict(keys))
+
+    def _get_or_derive(self, email: str, password: str, name: str, derive: Callable[[], str]) -> str:
+        value = self._get(email, password, name)
+        if value is not None:
+            return value
+
+        derivation_id = ((self._digest(email), self._digest(email, password)), name)
+        with self._lock:
+            lock = self._derivations.setdefault(derivation_id, Lock())
+
+        # the concurrent derivations of the same key wait for the first one
+        with lock:
+            value = self._get(email, password, name)
+            if value is None:
+                value = derive()
+                self._set(email, password, name, value)
+
+        with self._lock:
+            self._derivations.pop(derivation_id, None)
+
+        return value
+
+    def get_access_key(self, email: str, password: str) -> str:
+        """
+        Get the access key (used to log in), deriving it if it is not cached
+        """
+
+        return self._get_or_derive(email, password, "access_key", lambda: get_access_key(email, password))
+
+    def get_encryption_key(self, email: str, password: str) -> bytes:
+        """
+        Get the encryption key (used to decrypt the keystore), deriving it if it is not cached
+        """
+
+        encryption_key = self._get_or_derive(
+            email, password, "encryption_key", lambda: get_encryption_key(email, password).hex()
+        )
+
+        return bytes.fromhex(encryption_key)
+
+    async def derive(self, email: str, password: str) -> Tuple[str, bytes]:
+        """
+        Get the access key and the encryption key. The missing keys are derived concurrently, in the executor,
+        so the event loop is never blocked
+
+        :return: (access key, encryption key)
+        """
+
+        assert_type(str, email=email, password=password)
+
+        loop = asyncio.get_running_loop()
+
+        access_key, encryption_key = await asyncio.gather(
+            loop.run_in_executor(self.executor, self.get_access_key, email, password),
+            loop.run_in_executor(self.executor, self.get_encryption_key, email, password),
+        )
+
+        return access_key, encryption_key
+
+    async def derive_access_key(self, email: str, password: str) -> str:
+        """
+        Get the access key only, deriving it in the executor if it is missing
+
+        :return: The access key
+        """
+
+        assert_type(str, email=email, password=password)
+
+        loop = asyncio.get_running_loop()
+
+        return await loop.run_in_executor(self.executor, self.get_access_key, email, password)
+
+    def forget(self, email: str):
+        """
+        Forget the keys of an account, in memory and in the persistent storage (e.g. after a password change)
+
+        :param email: Email of the account
+        """
+
+        email_digest = self._digest(email)
+
+        with self._lock:
+            for memory_id in [i for i in self._memory if i[0] == email_digest]:
+                del self._memory[memory_id]
+
+            if self.storage is not None:
+                self.storage.delete(email_digest)
+
+    def clear(self):
+        """
+        Forget the keys kept in memory. The persistent storage is left untouched
+        """
+
+        with self._lock:
+            self._memory.clear()
+
+
+#: Key derivation shared by the API objects that weren't given one, so keys are derived once per process
+DEFAULT_KEY_DERIVATION = KeyDerivation()
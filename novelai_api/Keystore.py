@@ -6,7 +6,39 @@ from uuid import uuid4
 from nacl.secret import SecretBox
 from nacl.utils import random
 
-from novelai_api.SchemaValidator import SchemaValidator
+# JSON representation of each byte value, to serialize bytes as a list of ints without going through json.dumps
+_BYTE_TO_STR = tuple(str(i) for i in range(256))
+
+
+def bytes_to_json_list(data: bytes) -> str:
+    """
+    Serialize bytes as a JSON list of ints. Same output as ``json.dumps(list(data), separators=(",", ":"))``
+    """
+
+    return f"[{','.join(map(_BYTE_TO_STR.__getitem__, data))}]"
+
+
+def json_list_to_bytes(name: str, data: Any, size: Optional[int] = None) -> bytes:
+    """
+    Convert a JSON list of ints to bytes. The conversion also validates the type and range of every item
+
+    :param name: Name of the value, for the error message
+    :param data: List of ints (0-255) to convert
+    :param size: Expected size of the list, if any
+    """
+
+    if not isinstance(data, list):
+        raise ValueError(f"Expected type 'list' for {name}, but got type '{type(data)}'")
+
+    try:
+        converted = bytes(data)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Expected a list of ints between 0 and 255 for {name}: {e}") from e
+
+    if size is not None and len(converted) != size:
+        raise ValueError(f"Expected {size} items for {name}, but got {len(converted)}")
+
+    return converted
 
 
 class Keystore:
@@ -15,6 +47,9 @@ class Keystore:
     _nonce: bytes
     _version: int
 
+    # serialized "meta":[key] entries, reused between encryptions
+    _serialized_keys: Dict[str, str]
+
     _decrypted: bool
     _compressed: bool
 
@@ -28,6 +63,8 @@ class Keystore:
         self._nonce = b""
         self._version = 0
 
+        self._serialized_keys = {}
+
         self._decrypted = False
         self._compressed = False
 
@@ -42,6 +79,7 @@ class Keystore:
             raise ValueError("Cannot set key in an encrypted keystore")
 
         self._keystore[key] = val
+        self._serialized_keys.pop(key, None)
 
     def __contains__(self, key):
         if not self._decrypted:
@@ -54,6 +92,7 @@ class Keystore:
             raise ValueError("Cannot delete key from an encrypted keystore")
 
         del self._keystore[key]
+        self._serialized_keys.pop(key, None)
 
     def __len__(self) -> int:
         if not self._decrypted:
@@ -67,19 +106,27 @@ class Keystore:
 
         return str(self._keystore)
 
+    @property
+    def change_index(self) -> Optional[int]:
+        """
+        Version of the keystore on the server (None if unknown). It is incremented by the server on each change
+        """
+
+        return self.data.get("changeIndex")
+
     def create(self) -> str:
         """
-        Create a new meta that is not in the keystore and assign a random nonce to it
+        Create a new meta that is not in the keystore and assign a random key to it
         """
 
         if not self._decrypted:
             raise ValueError("Cannot set key in an encrypted keystore")
 
-        meta = next(iter(self._keystore.keys()))
+        meta = str(uuid4())
         while meta in self._keystore:
             meta = str(uuid4())
 
-        self._keystore[meta] = random(SecretBox.NONCE_SIZE)
+        self[meta] = random(SecretBox.KEY_SIZE)
 
         return meta
 
@@ -96,15 +143,14 @@ class Keystore:
         if "keystore" in keystore and keystore["keystore"] is None:  # keystore is null when empty
             self._nonce = random(SecretBox.NONCE_SIZE)
             self._version = 2
-            self.data = {
-                "keystore": {
-                    "version": self._version,
-                    "nonce": str(list(self._nonce)),
-                    "sdata": "",
-                }
+            self.data["keystore"] = {
+                "version": self._version,
+                "nonce": str(list(self._nonce)),
+                "sdata": "",
             }
 
             self._keystore = {}
+            self._serialized_keys = {}
 
             self._compressed = False
             self._decrypted = True
@@ -112,24 +158,29 @@ class Keystore:
             return
 
         # keystore is not empty, decrypt it
+        # the conversions to bytes also validate the content (same checks as the keystore schemas, but much faster)
         keystore = loads(b64decode(self.data["keystore"]).decode())
-        SchemaValidator.validate("schema_keystore_encrypted", keystore)
+        if not isinstance(keystore, dict) or not isinstance(keystore.get("version"), int):
+            raise ValueError("Expected an integer 'version' in the encrypted keystore")
 
         self._version = keystore["version"]
-        self._nonce = bytes(keystore["nonce"])
-        sdata = bytes(keystore["sdata"])
+        self._nonce = json_list_to_bytes("keystore nonce", keystore.get("nonce"), SecretBox.NONCE_SIZE)
+        sdata = json_list_to_bytes("keystore sdata", keystore.get("sdata"))
 
         data, _, is_compressed = Keystore._decrypt_data(sdata, key, self._nonce)
+        if data is None:
+            raise ValueError("Cannot decrypt the keystore, the encryption key is probably wrong")
+
         json_data = loads(data)
-        SchemaValidator.validate("schema_keystore_decrypted", json_data)
+        if not isinstance(json_data, dict) or not isinstance(json_data.get("keys"), dict):
+            raise ValueError("Expected an object 'keys' in the decrypted keystore")
 
-        keys = json_data["keys"]
-        for meta in keys:
-            keys[meta] = bytes(keys[meta])
+        keys = {meta: json_list_to_bytes(f"key of meta {meta}", val) for meta, val in json_data["keys"].items()}
 
         # here, the data should be all valid. Still possible to be false (while valid),
         # but it would be incredibly rare
         self._keystore = keys
+        self._serialized_keys = {}
 
         self._compressed = is_compressed
         self._decrypted = True
@@ -154,21 +205,25 @@ class Keystore:
                 "nonce": list(self._nonce),
                 "sdata": "",
             }
+            keystore_str = dumps(keystore, separators=(",", ":"), ensure_ascii=False)
 
         else:
-            keystore_bytes = {meta: list(key) for meta, key in self._keystore.items()}
-            keys = {"keys": keystore_bytes}
-
-            json_data = dumps(keys, separators=(",", ":"), ensure_ascii=False)
+            # equivalent to dumps({"keys": {meta: list(key)}}, separators=(",", ":"), ensure_ascii=False),
+            # but only the new entries are serialized
+            serialized_keys = self._serialized_keys
+            for meta, val in self._keystore.items():
+                if meta not in serialized_keys:
+                    serialized_keys[meta] = f"{dumps(meta, ensure_ascii=False)}:{bytes_to_json_list(val)}"
+
+            json_data = f'{{"keys":{{{",".join(serialized_keys[meta] for meta in self._keystore)}}}}}'
             encrypted_data = Keystore._encrypt_data(json_data, key, self._nonce, self._compressed)
             # remove automatically prepended nonce
             encrypted_data = encrypted_data[SecretBox.NONCE_SIZE :]
 
-            keystore = {
-                "version": self._version,
-                "nonce": list(self._nonce),
-                "sdata": list(encrypted_data),
-            }
+            keystore_str = (
+                f'{{"version":{self._version},'
+                f'"nonce":{bytes_to_json_list(self._nonce)},'
+                f'"sdata":{bytes_to_json_list(encrypted_data)}}}'
+            )
 
-        keystore_str = dumps(keystore, separators=(",", ":"), ensure_ascii=False)
         self.data["keystore"] = b64encode(keystore_str.encode()).decode()
@@ -0,0 +1,258 @@
+"""
+Compact representation of the logprobs returned by the text generation (when
+:attr:`GlobalSettings.num_logprobs <novelai_api.GlobalSettings.GlobalSettings.num_logprobs>` is set).
+
+Requires the ``numpy`` package (``logprobs`` extra).
+"""
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+
+# one entry of the logprobs: [[token ids], [logprob before sampling, logprob after sampling (or None)]]
+LogprobEntry = List[List[Optional[Union[int, float]]]]
+
+
+def _parse_entries(rows: List[List[LogprobEntry]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Parse the lists of (token, logprobs) entries of each token into padded (ids, before, after) arrays.
+    Missing alternatives have an id of -1 and logprobs of -inf, filtered out tokens have an after logprob of -inf
+    """
+
+    n = len(rows)
+    k = max((len(row) for row in rows), default=0)
+
+    ids = np.full((n, k), -1, dtype=np.int64)
+    before = np.full((n, k), -np.inf, dtype=np.float32)
+    after = np.full((n, k), -np.inf, dtype=np.float32)
+
+    # flatten everything in one pass, then scatter the values in the padded arrays
+    flat = [entry for row in rows for entry in row]
+    if not flat:
+        return ids, before, after
+
+    lengths = np.fromiter((len(row) for row in rows), dtype=np.int64, count=n)
+    row_index = np.repeat(np.arange(n), lengths)
+    col_index = np.arange(len(flat)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+    ids[row_index, col_index] = [entry[0][0] for entry in flat]
+    before[row_index, col_index] = [entry[1][0] for entry in flat]
+    after[row_index, col_index] = [-np.inf if entry[1][1] is None else entry[1][1] for entry in flat]
+
+    return ids, before, after
+
+
+class Logprobs:
+    """
+    Logprobs of a generation, as NumPy arrays (one row per generated token).
+
+    The logprobs "before" are the raw logprobs of the model, the logprobs "after" are the logprobs once the
+    sampling settings are applied (-inf for the tokens removed by the samplers).
+    """
+
+    #: Id of the chosen tokens, shape (n,)
+    token_ids: np.ndarray
+    #: Logprob of the chosen tokens, before sampling, shape (n,)
+    chosen_before: np.ndarray
+    #: Logprob of the chosen tokens, after sampling, shape (n,)
+    chosen_after: np.ndarray
+    #: Id of the top-k tokens before sampling, shape (n, k), -1 if missing
+    top_ids: np.ndarray
+    #: Logprob of the top-k tokens before sampling, shape (n, k), -inf if missing
+    top_logprobs: np.ndarray
+    #: Id of the top-k tokens after sampling, shape (n, k), -1 if missing
+    after_ids: np.ndarray
+    #: Logprob of the top-k tokens after sampling, shape (n, k), -inf if missing
+    after_logprobs: np.ndarray
+
+    def __init__(
+        self,
+        token_ids: np.ndarray,
+        chosen_before: np.ndarray,
+        chosen_after: np.ndarray,
+        top_ids: np.ndarray,
+        top_logprobs: np.ndarray,
+        after_ids: np.ndarray,
+        after_logprobs: np.ndarray,
+    ):
+        self.token_ids = token_ids
+        self.chosen_before = chosen_before
+        self.chosen_after = chosen_after
+        self.top_ids = top_ids
+        self.top_logprobs = top_logprobs
+        self.after_ids = after_ids
+        self.after_logprobs = after_logprobs
+
+    @classmethod
+    def from_list(cls, logprobs: Iterable[Dict[str, List[LogprobEntry]]]) -> "Logprobs":
+        """
+        Parse the logprobs of a response
+
+        :param logprobs: List of {"chosen", "before", "after"} entries, one per token
+        """
+
+        logprobs = list(logprobs)
+
+        chosen_ids, chosen_before, chosen_after = _parse_entries([e["chosen"] for e in logprobs])
+        top_ids, top_logprobs, _ = _parse_entries([e["before"] for e in logprobs])
+        after_ids, _, after_logprobs = _parse_entries([e["after"] for e in logprobs])
+
+        if chosen_ids.shape[1] == 0:
+            chosen_ids = np.full((len(logprobs), 1), -1, dtype=np.int64)
+            chosen_before = chosen_after = np.full((len(logprobs), 1), -np.inf, dtype=np.float32)
+
+        return cls(
+            chosen_ids[:, 0],
+            chosen_before[:, 0],
+            chosen_after[:, 0],
+            top_ids,
+            top_logprobs,
+            after_ids,
+            after_logprobs,
+        )
+
+    @classmethod
+    def from_response(cls, response: Dict[str, Any]) -> "Logprobs":
+        """
+        Parse the logprobs of the response of :meth:`HighLevel.generate <novelai_api._high_level.HighLevel.generate>`
+
+        :param response: Response of the generation
+        """
+
+        logprobs = response.get("logprobs")
+        if logprobs is None:
+            raise ValueError("The response has no logprobs, num_logprobs must be set in the global settings")
+
+        return cls.from_list(logprobs)
+
+    @classmethod
+    def from_stream(cls, events: Iterable[Dict[str, Any]]) -> "Logprobs":
+        """
+        Parse the logprobs of the events of
+        :meth:`HighLevel.generate_stream <novelai_api._high_level.HighLevel.generate_stream>`
+
+        :param events: Events of the stream (the events without logprobs are skipped)
+        """
+
+        logprobs = []
+        for e in events:
+            entry = e.get("logprobs")
+            if entry is None:
+                continue
+
+            if isinstance(entry, dict):
+                logprobs.append(entry)
+            else:
+                logprobs.extend(entry)
+
+        return cls.from_list(logprobs)
+
+    @classmethod
+    def concatenate(cls, logprobs: Iterable["Logprobs"]) -> "Logprobs":
+        """
+        Concatenate the logprobs of multiple generations, to analyze them at once
+
+        :param logprobs: Logprobs to concatenate
+        """
+
+        logprobs = list(logprobs)
+        if not logprobs:
+            return cls.from_list([])
+
+        def pad(arrays: List[np.ndarray], value) -> np.ndarray:
+            k = max(a.shape[1] for a in arrays)
+
+            return np.concatenate(
+                [np.pad(a, ((0, 0), (0, k - a.shape[1])), constant_values=value) for a in arrays], axis=0
+            )
+
+        return cls(
+            np.concatenate([lp.token_ids for lp in logprobs]),
+            np.concatenate([lp.chosen_before for lp in logprobs]),
+            np.concatenate([lp.chosen_after for lp in logprobs]),
+            pad([lp.top_ids for lp in logprobs], -1),
+            pad([lp.top_logprobs for lp in logprobs], -np.inf),
+            pad([lp.after_ids for lp in logprobs], -1),
+            pad([lp.after_logprobs for lp in logprobs], -np.inf),
+        )
+
+    def __len__(self) -> int:
+        return len(self.token_ids)
+
+    def __repr__(self) -> str:
+        return f"Logprobs({len(self)} tokens, top-{self.top_ids.shape[1]})"
+
+    def perplexity(self, after: bool = False) -> float:
+        """
+        Perplexity of the sequence (exp of the mean negative logprob of the chosen tokens)
+
+        :param after: Use the logprobs after sampling instead of the raw logprobs
+        """
+
+        if not len(self):
+            return float("nan")
+
+        logprobs = self.chosen_after if after else self.chosen_before
+
+        return float(np.exp(-np.mean(logprobs, dtype=np.float64)))
+
+    def entropy(self, normalize: bool = True) -> np.ndarray:
+        """
+        Entropy (in nats) of each token, over the top-k tokens before sampling
+
+        :param normalize: Renormalize the top-k probabilities so they sum to 1. If False, the probability mass
+                          outside the top-k is ignored
+
+        :return: Entropy of each token, shape (n,)
+        """
+
+        p = np.exp(self.top_logprobs.astype(np.float64))
+        if normalize:
+            total = p.sum(axis=1, keepdims=True)
+            p = np.divide(p, total, out=np.zeros_like(p), where=total > 0)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            terms = np.where(p > 0, p * np.log(p), 0.0)
+
+        return -terms.sum(axis=1)
+
+    def in_top_k(self, k: int = 1) -> np.ndarray:
+        """
+        Whether the chosen token is in the k most likely tokens, before sampling
+
+        :param k: Number of tokens to consider
+
+        :return: Boolean mask, shape (n,)
+        """
+
+        return (self.top_ids[:, :k] == self.token_ids[:, None]).any(axis=1)
+
+    def top_k_agreement(self, k: int = 1) -> float:
+        """
+        Proportion of chosen tokens that are in the k most likely tokens (k = 1 is the agreement with greedy decoding)
+
+        :param k: Number of tokens to consider
+        """
+
+        if not len(self):
+            return float("nan")
+
+        return float(self.in_top_k(k).mean())
+
+    def low_confidence_spans(self, threshold: float = -2.5, min_length: int = 1) -> List[Tuple[int, int]]:
+        """
+        Find the runs of consecutive tokens whose logprob (before sampling) is under the threshold
+
+        :param threshold: Logprob under which a token is considered low-confidence
+        :param min_length: Minimum number of tokens in a span
+
+        :return: List of [start, end) token index ranges
+        """
+
+        mask = np.concatenate(([False], self.chosen_before < threshold, [False]))
+        edges = np.flatnonzero(mask[1:] != mask[:-1])
+        starts, ends = edges[0::2], edges[1::2]
+
+        keep = (ends - starts) >= min_length
+
+        return list(zip(starts[keep].tolist(), ends[keep].tolist()))
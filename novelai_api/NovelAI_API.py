@@ -1,7 +1,7 @@
 from http.cookies import SimpleCookie
 from logging import Logger
 from os.path import abspath, dirname
-from typing import Optional
+from typing import Callable, Optional
 
 from aiohttp import BasicAuth, ClientSession, ClientTimeout
 from aiohttp.typedefs import StrOrURL
@@ -9,6 +9,10 @@ from multidict import CIMultiDict
 
 from novelai_api._high_level import HighLevel
 from novelai_api._low_level import GENERAL_API_ADDRESS, LowLevel
+from novelai_api.GenerationStream import StreamMetrics
+from novelai_api.KeyDerivation import DEFAULT_KEY_DERIVATION, KeyDerivation
+from novelai_api.TokenManager import TokenManager
+from novelai_api.utils import CompressionPolicy
 
 
 class NovelAIAPI:
@@ -37,6 +41,20 @@ class NovelAIAPI:
     #: The proxy authentication for a request (None if no proxy)
     proxy_auth: Optional[BasicAuth] = None
 
+    #: The compression used when re-compressing user data for upload
+    compression: CompressionPolicy
+    #: The derivation (and cache) of the access and encryption keys
+    key_derivation: KeyDerivation
+    #: The tracking (expiration, refresh, persistence) of the access token
+    token_manager: TokenManager
+    #: Subscription tier of the account (see :class:`LowLevel.SubscriptionTier`), used for the context size.
+    #: None uses the largest context size of the model
+    subscription_tier: Optional[int]
+    #: Trim the prompts to the context size before sending them, instead of letting the server do it
+    trim_prompt: bool
+    #: Function called with the metrics of each streamed generation, once it ends (None to disable)
+    stream_metrics_callback: Optional[Callable[[StreamMetrics], None]]
+
     # API parts
 
     #: The low-level API (thin wrapper)
@@ -44,7 +62,12 @@ class NovelAIAPI:
     #: The high-level API (abstraction on top of low-level)
     high_level: HighLevel
 
-    def __init__(self, session: Optional[ClientSession] = None, logger: Optional[Logger] = None):
+    def __init__(
+        self,
+        session: Optional[ClientSession] = None,
+        logger: Optional[Logger] = None,
+        key_derivation: Optional[KeyDerivation] = None,
+    ):
         """
         Create a new NovelAIAPI object, which can be used to interact with the API.
         Use the low_level and high_level attributes for this purpose
@@ -54,6 +77,7 @@ class NovelAIAPI:
 
         :param session: The ClientSession to use for requests (None for synchronous)
         :param logger: The logger to use for the API (None for creating an empty default logger)
+        :param key_derivation: The key derivation to use (None for the one shared by the process)
         """
 
         # variable passing
@@ -71,6 +95,13 @@ class NovelAIAPI:
         self.proxy = None
         self.proxy_auth = None
 
+        self.compression = CompressionPolicy()
+        self.key_derivation = DEFAULT_KEY_DERIVATION if key_derivation is None else key_derivation
+        self.token_manager = TokenManager(self)
+        self.subscription_tier = None
+        self.trim_prompt = True
+        self.stream_metrics_callback = None
+
         # API parts
         self.low_level = LowLevel(self)
         self.high_level = HighLevel(self)
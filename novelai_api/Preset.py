@@ -1,11 +1,10 @@
 import os
 import pathlib
 import warnings
-from copy import deepcopy
 from enum import Enum, EnumMeta, IntEnum
-from json import loads
+from json import dumps, loads
 from random import choice
-from typing import TYPE_CHECKING, Any, Dict, List, NoReturn, Optional, Union
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, NoReturn, Optional, Tuple, Union
 
 
 class Order(IntEnum):
@@ -96,6 +95,70 @@ def collapse_model(enum_class: EnumMeta, value: str):
     return values.get(_strip_model_version(value))
 
 
+def _copy_value(value: Any) -> Any:
+    # the values are immutable, except for the (possibly nested) lists
+    return [_copy_value(e) for e in value] if isinstance(value, list) else value
+
+
+def _copy_settings(settings: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: _copy_value(v) for k, v in settings.items()}
+
+
+class _SettingList(list):
+    """
+    List setting of a preset, given out by the preset. Modifying it in place marks the preset as modified
+    (only the list itself is tracked, not the nested lists)
+    """
+
+    __slots__ = ("_preset",)
+
+    def __init__(self, preset: "Preset", values: Iterable[Any]):
+        super().__init__(values)
+        self._preset = preset
+
+    def __reduce_ex__(self, protocol):
+        # the items are given to __init__, as the preset can't be marked as modified while it is rebuilt
+        return _SettingList, (self._preset, list(self))
+
+    def _changed(self):
+        preset = self._preset
+        object.__setattr__(preset, "_version", preset._version + 1)
+
+
+def _tracked(name: str):
+    method = getattr(list, name)
+
+    def wrapper(self: _SettingList, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        self._changed()
+
+        return result
+
+    wrapper.__name__ = name
+
+    return wrapper
+
+
+# the methods modifying the list in place
+_LIST_MUTATORS = (
+    "__setitem__",
+    "__delitem__",
+    "__iadd__",
+    "__imul__",
+    "append",
+    "extend",
+    "insert",
+    "pop",
+    "remove",
+    "clear",
+    "sort",
+    "reverse",
+)
+
+for _name in _LIST_MUTATORS:
+    setattr(_SettingList, _name, _tracked(_name))
+
+
 class StrEnum(str, Enum):
     pass
 
@@ -139,6 +202,41 @@ PREAMBLE = {
     Model.Erato: "<|endoftext|>",  # <|reserved_special_token_81|> if context isn't full
 }
 
+#: Maximum context size (in tokens) of each model, per subscription tier (see :class:`LowLevel.SubscriptionTier`).
+#: Tiers that don't have access to a model are missing. The values can be changed if they change on NovelAI's side
+CONTEXT_SIZE: Dict[Model, Dict[int, int]] = {
+    Model.Sigurd: {0: 1024, 1: 1024, 2: 2048, 3: 2048},
+    Model.Euterpe: {0: 1024, 1: 1024, 2: 2048, 3: 2048},
+    Model.Krake: {3: 2048},
+    Model.Genji: {1: 2048, 2: 2048, 3: 2048},
+    Model.Snek: {1: 2048, 2: 2048, 3: 2048},
+    Model.Clio: {0: 3072, 1: 3072, 2: 6144, 3: 8192},
+    Model.Kayra: {0: 3072, 1: 3072, 2: 6144, 3: 8192},
+    Model.Erato: {3: 8192},
+    Model.HypeBot: {0: 2048, 1: 2048, 2: 2048, 3: 2048},
+    Model.Inline: {0: 2048, 1: 2048, 2: 2048, 3: 2048},
+}
+
+
+def get_context_size(model: Model, tier: Optional[int] = None) -> Optional[int]:
+    """
+    Get the maximum context size of a model
+
+    :param model: Model to get the context size of
+    :param tier: Subscription tier (None, or a tier without access to the model, for the largest context size)
+
+    :return: The context size (in tokens), or None if it is unknown
+    """
+
+    sizes = CONTEXT_SIZE.get(model)
+    if not sizes:
+        return None
+
+    if tier is not None and tier in sizes:
+        return sizes[tier]
+
+    return max(sizes.values())
+
 
 class PresetView:
     model: Model
@@ -159,6 +257,8 @@ class _PresetMetaclass(type):
         if not isinstance(model, Model):
             raise ValueError(f"Expected instance of {type(Model)}, got type '{type(model)}'")
 
+        _import_officials(model)
+
         return PresetView(model, cls._officials_values)
 
 
@@ -322,7 +422,16 @@ class Preset(metaclass=_PresetMetaclass):
     _officials_values: Dict[str, List["Preset"]]
     _defaults: Dict[str, str]
 
+    # settings can be shared between copies of a preset, and are only copied when one of them is modified
     _settings: Dict[str, Any]
+    # True if _settings is shared with another preset
+    _shared: bool
+    # True if a list of _settings might be referenced outside the preset (and might be modified in place)
+    _exposed: bool
+    # incremented on every change, so derived data can detect that it is outdated
+    _version: int
+    # result of to_settings, with the state it was computed for
+    _settings_cache: Optional[Tuple[Tuple[int, Tuple[bool, ...]], Dict[str, Any]]]
 
     #: Name of the preset
     name: str
@@ -332,10 +441,14 @@ class Preset(metaclass=_PresetMetaclass):
     sampling_options: List[bool]
 
     def __init__(self, name: str, model: Model, settings: Optional[Dict[str, Any]] = None):
+        object.__setattr__(self, "_version", 0)
+        object.__setattr__(self, "_settings_cache", None)
         object.__setattr__(self, "name", name)
         object.__setattr__(self, "model", model)
 
         object.__setattr__(self, "_settings", {})
+        object.__setattr__(self, "_shared", False)
+        object.__setattr__(self, "_exposed", False)
         self.update(settings)
 
         if "order" in self._settings:
@@ -357,6 +470,17 @@ class Preset(metaclass=_PresetMetaclass):
             )
 
         object.__setattr__(self, "sampling_options", sampling_options_state)
+        object.__setattr__(self, "_version", self._version + 1)
+
+    def _own(self):
+        """
+        Make _settings private to this preset, before modifying it
+        """
+
+        if self._shared:
+            object.__setattr__(self, "_settings", _copy_settings(self._settings))
+            object.__setattr__(self, "_shared", False)
+            object.__setattr__(self, "_exposed", False)
 
     def __setitem__(self, key: str, value: Any):
         if key not in self._TYPE_MAPPING:
@@ -365,8 +489,6 @@ class Preset(metaclass=_PresetMetaclass):
         if not isinstance(value, self._TYPE_MAPPING[key]):  # noqa (pycharm PY-36317)
             raise ValueError(f"Expected type '{self._TYPE_MAPPING[key]}' for {key}, but got type '{type(value)}'")
 
-        self._settings[key] = value
-
         if key == "order":
             if not isinstance(value, list):
                 raise ValueError(f"Expected type 'List[int|Order] for order, but got type '{type(value)}'")
@@ -378,16 +500,41 @@ class Preset(metaclass=_PresetMetaclass):
                 if isinstance(e, int):
                     value[i] = Order(e)
 
+        # the list is copied, so the changes made to it in place go through the preset
+        if isinstance(value, list):
+            value = _SettingList(self, value)
+
+        self._own()
         self._settings[key] = value
+        object.__setattr__(self, "_version", self._version + 1)
+
+        if isinstance(value, list):
+            object.__setattr__(self, "_exposed", True)
 
     def __contains__(self, key: str) -> bool:
         return key in self._settings
 
     def __getitem__(self, key: str) -> Optional[Any]:
-        return self._settings.get(key)
+        value = self._settings.get(key)
+
+        # lists can be modified in place, so they can't be shared anymore. They are given out as lists that mark the
+        # preset as modified when they are changed, so derived data is only outdated by actual changes
+        if isinstance(value, list):
+            self._own()
+            value = self._settings[key]
+
+            if not isinstance(value, _SettingList) or value._preset is not self:
+                value = _SettingList(self, value)
+                self._settings[key] = value
+
+            object.__setattr__(self, "_exposed", True)
+
+        return value
 
     def __delitem__(self, key):
+        self._own()
         del self._settings[key]
+        object.__setattr__(self, "_version", self._version + 1)
 
     # give dot access capabilities to the object
     def __setattr__(self, key, value):
@@ -396,6 +543,9 @@ class Preset(metaclass=_PresetMetaclass):
         else:
             object.__setattr__(self, key, value)
 
+            if not key.startswith("_"):
+                object.__setattr__(self, "_version", self._version + 1)
+
     def __getattr__(self, key):
         if key in self._TYPE_MAPPING:
             return self[key]
@@ -415,12 +565,9 @@ class Preset(metaclass=_PresetMetaclass):
 
         return f"Preset: '{self.name} ({model}, {enabled_keys})'"
 
-    def to_settings(self) -> Dict[str, Any]:
-        """
-        Return the values stored in the preset, for a generate function
-        """
-
-        settings = deepcopy(self._settings)
+    def _compute_settings(self) -> Dict[str, Any]:
+        # only keys are removed or replaced, so a shallow copy is enough
+        settings = dict(self._settings)
 
         if "textGenerationSettingsVersion" in settings:
             del settings["textGenerationSettingsVersion"]  # not API relevant
@@ -438,9 +585,9 @@ class Preset(metaclass=_PresetMetaclass):
                     name = ORDER_TO_NAME[o]
 
                     # special handling for samplers with multiple keys
-                    if order is Order.Mirostat:
+                    if o is Order.Mirostat:
                         keys = ["mirostat_tau", "mirostat_lr"]
-                    elif order is Order.Unified:
+                    elif o is Order.Unified:
                         keys = ["math1_quad", "math1_quad_entropy_scale", "math1_temp"]
                     else:
                         keys = [name]
@@ -466,7 +613,22 @@ class Preset(metaclass=_PresetMetaclass):
         if settings.get("repetition_penalty_slope", None) == 0:
             del settings["repetition_penalty_slope"]
 
-        return settings
+        return _copy_settings(settings)
+
+    def to_settings(self) -> Dict[str, Any]:
+        """
+        Return the values stored in the preset, for a generate function.
+        The result is cached until the preset is modified
+        """
+
+        state = (self._version, tuple(self.sampling_options) if hasattr(self, "sampling_options") else ())
+
+        cache = self._settings_cache
+        if cache is None or cache[0] != state:
+            cache = (state, self._compute_settings())
+            object.__setattr__(self, "_settings_cache", cache)
+
+        return _copy_settings(cache[1])
 
     def __str__(self):
         settings = self.to_settings()  # use the sanitized settings
@@ -490,7 +652,34 @@ class Preset(metaclass=_PresetMetaclass):
         Instantiate a new preset object from the current one
         """
 
-        return Preset(self.name, self.model, deepcopy(self._settings))
+        preset = Preset.__new__(Preset)
+
+        object.__setattr__(preset, "name", self.name)
+        object.__setattr__(preset, "model", self.model)
+        if hasattr(self, "sampling_options"):
+            object.__setattr__(preset, "sampling_options", list(self.sampling_options))
+
+        # lists referenced outside of this preset could be modified in place, so they can't be shared
+        if self._exposed:
+            object.__setattr__(preset, "_settings", _copy_settings(self._settings))
+            object.__setattr__(preset, "_shared", False)
+        else:
+            object.__setattr__(preset, "_settings", self._settings)
+            object.__setattr__(preset, "_shared", True)
+            object.__setattr__(self, "_shared", True)
+
+        object.__setattr__(preset, "_exposed", False)
+        object.__setattr__(preset, "_version", 0)
+
+        # the cached settings are only read, so they can be shared as well
+        cache = self._settings_cache
+        if cache is not None and cache[0] == (self._version, tuple(getattr(self, "sampling_options", ()))):
+            cache = ((0, cache[0][1]), cache[1])
+        else:
+            cache = None
+        object.__setattr__(preset, "_settings_cache", cache)
+
+        return preset
 
     def set(self, name: str, value: Any) -> "Preset":
         """
@@ -570,6 +759,7 @@ class Preset(metaclass=_PresetMetaclass):
         :return: The chosen preset, or None if the name was not found in the list of official presets
         """
 
+        _import_officials(model)
         model_value: str = model.value
 
         if name is None:
@@ -578,7 +768,7 @@ class Preset(metaclass=_PresetMetaclass):
             preset = cls._officials[model_value].get(name)
 
         if preset is not None:
-            preset = deepcopy(preset)
+            preset = preset.copy()
 
         return preset
 
@@ -592,6 +782,7 @@ class Preset(metaclass=_PresetMetaclass):
         :return: The chosen preset, or None if the default preset was not found for the model
         """
 
+        _import_officials(model)
         model_value: str = model.value
 
         default = cls._defaults.get(model_value)
@@ -600,45 +791,238 @@ class Preset(metaclass=_PresetMetaclass):
 
         preset = cls._officials[model_value].get(default)
         if preset is not None:
-            preset = deepcopy(preset)
+            preset = preset.copy()
 
         return preset
 
 
-def _import_officials():
+def _get_user_cache_dir() -> pathlib.Path:
+    if os.name == "nt":
+        base = os.environ.get("LOCALAPPDATA") or pathlib.Path.home() / "AppData" / "Local"
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or pathlib.Path.home() / ".cache"
+
+    return pathlib.Path(base) / "novelai_api"
+
+
+#: Directory of the official presets
+PRESETS_PATH = pathlib.Path(__file__).parent / "presets"
+#: Precompiled official presets, shipped with the package (see :func:`build_preset_bundle`). Used instead of the
+#: preset files if it exists. The preset files are only compared against it in a source checkout, or if the
+#: NAI_CHECK_PRESETS_BUNDLE environment variable is set (to anything but "0")
+PRESETS_BUNDLE_PATH = PRESETS_PATH / "presets_bundle.json"
+#: Bundle of the official presets built on first use when the package doesn't ship one, in the user cache
+#: directory. Rebuilt when the package is installed again
+PRESETS_CACHE_PATH = _get_user_cache_dir() / "presets_bundle.json"
+
+# content of the bundle, loaded on first use
+_presets_bundle: Optional[Dict[str, Any]] = None
+
+
+def _should_check_bundle() -> bool:
     """
-    Import the official presets under the 'presets' directory. Performed once, at import
+    Check if the preset files should be compared against the bundle. It costs a stat per preset file, so it is only
+    done where the preset files are edited: in a source checkout, or on demand
     """
 
-    cls = Preset
+    check = os.environ.get("NAI_CHECK_PRESETS_BUNDLE")
+    if check is not None:
+        return check != "0"
+
+    return (PRESETS_PATH.parent.parent / "pyproject.toml").exists()
+
+
+def _get_officials_folder(model: Model) -> pathlib.Path:
+    return PRESETS_PATH / f"presets_{model.value.replace('-', '_')}"
+
+
+def _get_officials_files(path: pathlib.Path) -> Dict[str, List[int]]:
+    """
+    Get the state of the preset files of a folder, without reading them
+
+    :return: {filename: [size, modification time in ns]}
+    """
+
+    files = {}
+    for filename in path.iterdir():
+        if filename.suffix == ".preset" or filename.name == "default.txt":
+            stat = filename.stat()
+            files[filename.name] = [stat.st_size, stat.st_mtime_ns]
+
+    return files
+
+
+def _get_presets_fingerprint() -> Dict[str, Dict[str, List[int]]]:
+    """
+    Get the state of the preset files of every model, to detect a bundle that is out of date
+    """
+
+    fingerprint = {}
+    for model in Model:
+        path = _get_officials_folder(model)
+        if path.exists():
+            fingerprint[model.value] = _get_officials_files(path)
+
+    return fingerprint
 
-    cls._officials_values = {}
-    cls._officials = {}
-    cls._defaults = {}
 
+def _get_install_id() -> Optional[str]:
+    """
+    Identify the installed preset files with a single stat: their directory is created anew on each install
+    """
+
+    try:
+        return f"{PRESETS_PATH}:{PRESETS_PATH.stat().st_mtime_ns}"
+    except OSError:
+        return None
+
+
+def _read_officials_folder(model: Model) -> Optional[Dict[str, Any]]:
+    """
+    Read the default preset name and the preset data of a model from its folder
+
+    :return: {"default": name or None, "presets": [preset data]}, or None if the folder doesn't exist
+    """
+
+    path = _get_officials_folder(model)
+    if not path.exists():
+        return None
+
+    default = None
+    if (path / "default.txt").exists():
+        with open(path / "default.txt", encoding="utf-8") as f:
+            default = f.read().splitlines()[0]
+
+    presets = []
+    for filename in path.iterdir():
+        if filename.suffix == ".preset":
+            with open(path / filename, encoding="utf-8") as f:
+                presets.append(loads(f.read()))
+
+    return {"default": default, "presets": presets}
+
+
+def _make_bundle(install: Optional[str]) -> Dict[str, Any]:
+    """
+    Read the official presets of every model from their folders
+
+    :param install: Installation the bundle is built for (None for a bundle shipped with the package)
+    """
+
+    models = {}
     for model in Model:
-        model: Model
+        data = _read_officials_folder(model)
+        if data is not None:
+            models[model.value] = data
 
-        path = pathlib.Path(__file__).parent / "presets" / f"presets_{model.value.replace('-', '_')}"
-        if not path.exists():
-            warnings.warn(f"Missing preset folder for model {model.value}")
-            cls._officials_values[model.value] = []
-            cls._officials[model.value] = {}
-            continue
+    return {"install": install, "fingerprint": _get_presets_fingerprint(), "models": models}
+
+
+def _read_bundle(path: pathlib.Path) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            bundle = loads(f.read())
+    except (OSError, ValueError):
+        return None
+
+    # bundle of an older version
+    if not isinstance(bundle, dict) or "models" not in bundle:
+        return None
+
+    return bundle
+
+
+def _load_presets_bundle() -> Dict[str, Any]:
+    """
+    Load the shipped bundle, or the user cache bundle (built and written if missing or out of date)
+    """
+
+    fingerprint = _get_presets_fingerprint() if _should_check_bundle() else None
+
+    bundle = _read_bundle(PRESETS_BUNDLE_PATH)
+    if bundle is not None and (fingerprint is None or bundle.get("fingerprint") == fingerprint):
+        return bundle
+
+    install = _get_install_id()
+    bundle = _read_bundle(PRESETS_CACHE_PATH)
+    if (
+        bundle is not None
+        and install is not None
+        and bundle.get("install") == install
+        and (fingerprint is None or bundle.get("fingerprint") == fingerprint)
+    ):
+        return bundle
+
+    bundle = _make_bundle(install)
+
+    # the cache is only an optimization, the presets are usable without it
+    try:
+        PRESETS_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        with open(PRESETS_CACHE_PATH, "w", encoding="utf-8") as f:
+            f.write(dumps(bundle, ensure_ascii=False, separators=(",", ":")))
+    except OSError:
+        pass
+
+    return bundle
+
+
+def _get_officials_data(model: Model) -> Optional[Dict[str, Any]]:
+    global _presets_bundle  # pylint: disable=W0603
+
+    if _presets_bundle is None:
+        _presets_bundle = _load_presets_bundle()
+
+    return _presets_bundle["models"].get(model.value)
+
+
+def _import_officials(model: Model):
+    """
+    Import the official presets of a model, from the bundle or the 'presets' directory.
+    Performed once per model, on first use
+    """
+
+    cls = Preset
+
+    if model.value in cls._officials:
+        return
+
+    data = _get_officials_data(model)
+    if data is None:
+        warnings.warn(f"Missing preset folder for model {model.value}")
+        cls._officials_values[model.value] = []
+        cls._officials[model.value] = {}
+        return
+
+    if data["default"] is not None:
+        cls._defaults[model.value] = data["default"]
+
+    officials = {}
+    for preset_data in data["presets"]:
+        preset = cls.from_preset_data(preset_data)
+        officials[preset.name] = preset
+
+    cls._officials_values[model.value] = list(officials.values())
+    cls._officials[model.value] = officials
+
+
+def build_preset_bundle(path: Union[str, bytes, os.PathLike, None] = None):
+    """
+    Pack the official presets of every model into a single file, which is faster to load than the preset files.
+    The state of the preset files is stored in the bundle, to detect a bundle that is out of date
+
+    :param path: Path of the bundle to write (default to :data:`PRESETS_BUNDLE_PATH`)
+    """
 
-        if (path / "default.txt").exists():
-            with open(path / "default.txt", encoding="utf-8") as f:
-                cls._defaults[model.value] = f.read().splitlines()[0]
+    if path is None:
+        path = PRESETS_BUNDLE_PATH
 
-        officials = {}
-        for filename in path.iterdir():
-            if filename.suffix == ".preset":
-                preset = cls.from_file(str(path / filename))
-                officials[preset.name] = preset
+    bundle = _make_bundle(None)
 
-        cls._officials_values[model.value] = list(officials.values())
-        cls._officials[model.value] = officials
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(dumps(bundle, ensure_ascii=False, separators=(",", ":")))
 
 
 if not hasattr(Preset, "_officials"):
-    _import_officials()
+    Preset._officials = {}
+    Preset._officials_values = {}
+    Preset._defaults = {}
@@ -3,15 +3,16 @@ from os import listdir
 from os.path import abspath, dirname, join, splitext
 from typing import Any, Dict
 
-from jsonschema import RefResolver, validate
-
 
 class SchemaValidator:
     _schemas: Dict[str, Dict[str, Any]]
-    _resolver: RefResolver
+    _resolver: "RefResolver"  # noqa: F821
 
     def __init__(self):
         if not hasattr(self, "_schemas"):
+            # imported here, as it is only needed once a response has to be validated
+            from jsonschema import RefResolver  # pylint: disable=C0415
+
             schemas = {}
 
             lib_root = abspath(dirname(__file__))
@@ -28,8 +29,10 @@ class SchemaValidator:
 
     @classmethod
     def validate(cls, name: str, obj: Any):
-        validate(obj, cls._schemas[name], resolver=cls._resolver)
+        # initialize the schemas on first use
+        if not hasattr(cls, "_schemas"):
+            cls()
 
+        from jsonschema import validate  # pylint: disable=C0415
 
-# initialize the schemas. A bit dirty, but the simplest
-SchemaValidator()
+        validate(obj, cls._schemas[name], resolver=cls._resolver)
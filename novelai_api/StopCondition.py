@@ -0,0 +1,336 @@
+"""
+Client-side stop conditions for streamed generations.
+
+Unlike the stop sequences (exact tokens, handled by the server), the conditions are checked on the decoded text,
+as it is streamed. Once a condition is met, the stream is closed (which stops the generation on the server) and
+the text is trimmed where the condition matched.
+"""
+
+import re
+from typing import Any, Callable, Dict, Iterable, List, Optional, Pattern, Union
+
+from novelai_api.Preset import Model
+from novelai_api.python_utils import assert_type
+from novelai_api.Tokenizer import Tokenizer
+from novelai_api.utils import b64_to_tokens
+
+
+class StopCondition:
+    """
+    Base class of the stop conditions. The conditions are stateful, as they are checked incrementally,
+    and should not be shared between concurrent generations
+    """
+
+    def reset(self):
+        """
+        Reset the state of the condition, to check a new generation
+        """
+
+    def check(self, text: str, start: int) -> Optional[int]:
+        """
+        Check the condition against the text generated so far
+
+        :param text: Text generated so far
+        :param start: Position in the text of the part added since the last check
+
+        :return: Position at which the text should be cut if the condition is met, None otherwise
+        """
+
+        raise NotImplementedError()
+
+
+class StopOnRegex(StopCondition):
+    """
+    Stop when the regex matches the generated text
+    """
+
+    #: Pattern to search for
+    pattern: Pattern
+    #: Keep the matched text in the trimmed text
+    include_match: bool
+    #: Number of characters before the new text to search again, for matches spanning multiple tokens
+    lookback: int
+
+    _pos: int
+
+    def __init__(self, pattern: Union[str, Pattern], flags: int = 0, include_match: bool = False, lookback: int = 256):
+        """
+        :param pattern: Pattern to search for
+        :param flags: Flags of the pattern, if it is not compiled
+        :param include_match: Keep the matched text in the trimmed text
+        :param lookback: Number of characters before the new text to search again. Matches longer than that
+                         can be missed
+        """
+
+        self.pattern = re.compile(pattern, flags) if isinstance(pattern, str) else pattern
+        self.include_match = include_match
+        self.lookback = lookback
+
+        self._pos = 0
+
+    def reset(self):
+        self._pos = 0
+
+    def check(self, text: str, start: int) -> Optional[int]:
+        m = self.pattern.search(text, max(self._pos, start - self.lookback))
+        if m is not None:
+            return m.end() if self.include_match else m.start()
+
+        self._pos = max(self._pos, len(text) - self.lookback)
+
+        return None
+
+
+class StopAfterSentences(StopCondition):
+    """
+    Stop after a number of sentences. The end of a sentence is only known once the character after it
+    is generated, so the sentence is cut after its punctuation (and closing quotes)
+    """
+
+    SENTENCE_END = re.compile(r"[.!?…]+[\"'”’)\]*]*(?=\s)")
+
+    #: Number of sentences to keep
+    max_sentences: int
+
+    _pos: int
+    _count: int
+
+    def __init__(self, max_sentences: int):
+        """
+        :param max_sentences: Number of sentences to keep
+        """
+
+        if max_sentences < 1:
+            raise ValueError(f"max_sentences must be at least 1, got {max_sentences}")
+
+        self.max_sentences = max_sentences
+
+        self._pos = 0
+        self._count = 0
+
+    def reset(self):
+        self._pos = 0
+        self._count = 0
+
+    def check(self, text: str, start: int) -> Optional[int]:
+        for m in self.SENTENCE_END.finditer(text, self._pos):
+            self._count += 1
+            self._pos = m.end()
+
+            if self._count == self.max_sentences:
+                return m.end()
+
+        return None
+
+
+class StopAfterParagraphs(StopCondition):
+    """
+    Stop after a number of paragraphs (non-empty lines). The text is cut before the newline ending the last one
+    """
+
+    #: Number of paragraphs to keep
+    max_paragraphs: int
+
+    _pos: int
+    _count: int
+    _has_content: bool
+
+    def __init__(self, max_paragraphs: int):
+        """
+        :param max_paragraphs: Number of paragraphs to keep
+        """
+
+        if max_paragraphs < 1:
+            raise ValueError(f"max_paragraphs must be at least 1, got {max_paragraphs}")
+
+        self.max_paragraphs = max_paragraphs
+
+        self._pos = 0
+        self._count = 0
+        self._has_content = False
+
+    def reset(self):
+        self._pos = 0
+        self._count = 0
+        self._has_content = False
+
+    def check(self, text: str, start: int) -> Optional[int]:
+        for i in range(self._pos, len(text)):
+            c = text[i]
+
+            if c == "\n":
+                if self._has_content:
+                    self._count += 1
+                    self._has_content = False
+
+                    if self._count == self.max_paragraphs:
+                        self._pos = i + 1
+                        return i
+            elif not c.isspace():
+                self._has_content = True
+
+        self._pos = len(text)
+
+        return None
+
+
+class StopOnCallable(StopCondition):
+    """
+    Stop when a function returns True (cut at the end of the text) or a position (cut at this position)
+    """
+
+    #: Function called with the text generated so far
+    func: Callable[[str], Union[bool, int, None]]
+
+    def __init__(self, func: Callable[[str], Union[bool, int, None]]):
+        """
+        :param func: Function called with the text generated so far. Returns True to stop at the end of the text,
+                     a position to stop and cut the text at this position, or False/None to continue
+        """
+
+        self.func = func
+
+    def check(self, text: str, start: int) -> Optional[int]:
+        result = self.func(text)
+
+        if result is None or result is False:
+            return None
+
+        if result is True:
+            return len(text)
+
+        return result
+
+
+AnyStopCondition = Union[StopCondition, Callable[[str], Union[bool, int, None]]]
+
+
+class StreamStopper:
+    """
+    Decode the tokens of a stream as they come, and check the stop conditions against the decoded text.
+
+    Pass it as ``stop_conditions`` to :meth:`novelai_api._high_level.HighLevel.generate_stream` to get the trimmed text
+    once the stream ends
+    """
+
+    # number of tokens decoded before the new ones, so the decoding of the new tokens is done in context
+    # (sentencepiece strips the leading space of the first token, for example)
+    DECODE_CONTEXT = 4
+    # number of tokens to wait for before giving up on completing a broken unicode character
+    MAX_PENDING = 4
+
+    #: Model of the generation, for decoding
+    model: Model
+    #: Conditions to check
+    conditions: List[StopCondition]
+    #: Tokens received (trimmed to the kept text once stopped)
+    tokens: List[int]
+    #: Text decoded so far (trimmed once stopped)
+    text: str
+    #: True if a condition has been met
+    stopped: bool
+    #: Condition that stopped the generation
+    reason: Optional[StopCondition]
+
+    _committed: int
+
+    def __init__(self, model: Model, conditions: Union[AnyStopCondition, Iterable[AnyStopCondition]]):
+        """
+        :param model: Model of the generation, for decoding
+        :param conditions: Conditions to check. Callables are wrapped in :class:`StopOnCallable`
+        """
+
+        assert_type(Model, model=model)
+
+        if isinstance(conditions, StopCondition) or callable(conditions):
+            conditions = [conditions]
+
+        self.model = model
+        self.conditions = [c if isinstance(c, StopCondition) else StopOnCallable(c) for c in conditions]
+
+        self.reset()
+
+    def reset(self):
+        """
+        Reset the stopper and its conditions, to check a new generation
+        """
+
+        self.tokens = []
+        self.text = ""
+        self.stopped = False
+        self.reason = None
+
+        self._committed = 0
+
+        for condition in self.conditions:
+            condition.reset()
+
+    def _decode_pending(self) -> Optional[str]:
+        tokens = self.tokens
+        context_start = max(0, self._committed - self.DECODE_CONTEXT)
+
+        full = Tokenizer.decode(self.model, tokens[context_start:])
+        context = Tokenizer.decode(self.model, tokens[context_start : self._committed])
+
+        # the character is split between tokens, wait for the next ones
+        if full.endswith("\ufffd") and len(tokens) - self._committed < self.MAX_PENDING:
+            return None
+
+        if full.startswith(context):
+            return full[len(context) :]
+
+        # the context decodes differently with the new tokens, decode everything (slow, but shouldn't happen)
+        return Tokenizer.decode(self.model, tokens)[len(self.text) :]
+
+    def feed(self, tokens: Union[Dict[str, Any], List[int]]) -> bool:
+        """
+        Add tokens to the stream and check the conditions
+
+        :param tokens: Tokens, or an event of the stream
+
+        :return: True if a condition is met, and the stream should be stopped
+        """
+
+        if self.stopped:
+            return True
+
+        if isinstance(tokens, dict):
+            tokens = b64_to_tokens(tokens["token"], 4 if self.model is Model.Erato else 2)
+
+        self.tokens.extend(tokens)
+
+        new_text = self._decode_pending()
+        if new_text is None:
+            return False
+
+        start = len(self.text)
+        self.text += new_text
+        self._committed = len(self.tokens)
+
+        cut = None
+        for condition in self.conditions:
+            pos = condition.check(self.text, start)
+            if pos is not None and (cut is None or pos < cut):
+                cut = pos
+                self.reason = condition
+
+        if cut is not None:
+            self._stop(cut)
+
+        return self.stopped
+
+    def _stop(self, cut: int):
+        self.stopped = True
+        self.text = self.text[:cut]
+
+        # keep the tokens fully contained in the trimmed text (binary search, as only the prefixes can be decoded)
+        lo, hi = 0, len(self.tokens)
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if len(Tokenizer.decode(self.model, self.tokens[:mid])) <= cut:
+                lo = mid
+            else:
+                hi = mid - 1
+
+        self.tokens = self.tokens[:lo]
+        self._committed = lo
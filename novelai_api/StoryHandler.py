@@ -1,5 +1,8 @@
+import asyncio
+import copy
+import logging
 from asyncio import run
-from copy import deepcopy
+from hashlib import sha256
 from json import dumps, loads
 from time import time
 from typing import Any, Dict, Iterator, List, Optional
@@ -9,12 +12,21 @@ from aiohttp import ClientSession
 from novelai_api import NovelAIAPI
 from novelai_api.BanList import BanList
 from novelai_api.BiasGroup import BiasGroup
+from novelai_api.ContextBuilder import ContextBuilder, ContextEntry, get_activated_lore
+from novelai_api.DatablockTree import DatablockTree
 from novelai_api.GlobalSettings import GlobalSettings
 from novelai_api.Idstore import Idstore
 from novelai_api.Keystore import Keystore
 from novelai_api.Preset import Model, Preset
+from novelai_api.StoryText import StoryText
 from novelai_api.Tokenizer import Tokenizer
-from novelai_api.utils import b64_to_tokens, decrypt_user_data, encrypt_user_data
+from novelai_api.utils import (
+    b64_to_tokens,
+    decrypt_user_data,
+    encrypt_user_data_copy,
+    get_prompt_limit,
+    serialize_user_data,
+)
 
 
 def _get_time() -> int:
@@ -49,7 +61,16 @@ def _set_nested_item(item: Dict[str, Any], val: Any, path: str):
 class NovelAIStory:
     TEXT_GENERATION_SETTINGS_VERSION = 2
 
+    # attributes built from the storycontent on first access (see __getattr__)
+    _LAZY_SETTINGS = ("banlists", "biases", "model", "preset", "prefix", "context_size")
+    _LAZY_STORY = ("text", "datablocks", "context_builder")
+
     DEFAULT_MODEL = Model.Euterpe
+    #: Context size used when the one of the model is unknown
+    DEFAULT_CONTEXT_SIZE = 2048
+
+    #: Delay (in seconds) without new save before a scheduled save is uploaded (see save_later)
+    SAVE_DELAY = 2.0
 
     api: NovelAIAPI
     keystore: Keystore
@@ -58,6 +79,11 @@ class NovelAIStory:
     story: Dict[str, Any]
     storycontent: Dict[str, Any]
     tree: List[int]
+    #: History of the story. Once it is built, the datablocks are removed from the storycontent, and only
+    #: serialized in the uploaded copy of it
+    datablocks: DatablockTree
+    #: Current text of the story, kept in sync with the datablocks
+    text: StoryText
 
     global_settings: GlobalSettings
     banlists: List[BanList]
@@ -65,25 +91,31 @@ class NovelAIStory:
     model: Model
     preset: Preset
     prefix: str
+    #: Maximum number of tokens of the context (the context size of the model, minus the tokens of the output)
     context_size: int
+    #: Builder of the context, keeping the tokens of the previous contexts
+    context_builder: ContextBuilder
 
-    def _handle_banlist(self, data: Dict[str, Any]):
-        if "bannedSequenceGroups" not in data:
-            data["bannedSequenceGroups"] = []
+    # objects ("story", "storycontent") modified since their last upload, and digest of their last upload
+    _modified: Dict[str, bool]
+    _saved_digests: Dict[str, bytes]
+    _save_lock: Optional[asyncio.Lock]
+    _save_timer: Optional[asyncio.TimerHandle]
+    _save_future: Optional[asyncio.Future]
+    _save_task: Optional[asyncio.Task]
 
-        ban_seq = data["bannedSequenceGroups"]
+    def _handle_banlist(self, data: Dict[str, Any]):
+        ban_seq = data.get("bannedSequenceGroups", [])
         self.banlists = [BanList(*seq["sequences"], enabled=seq["enabled"]) for seq in ban_seq]
 
     def _handle_biasgroups(self, data: Dict[str, Any]):
-        if "phraseBiasGroup" not in data:
-            data["phraseBiasGroups"] = []
-
         self.biases = []
-        for bias in data["phraseBiasGroups"]:
+        for bias in data.get("phraseBiasGroups", []):
             self.biases.append(BiasGroup.from_data(bias))
 
     def _handle_preset(self, data: Dict[str, Any]):
-        settings = data["settings"]
+        # the settings are parsed from a copy, as parsing them changes them
+        settings = copy.deepcopy(data["settings"])
 
         if "textGenerationSettingsVersion" not in settings:
             settings["textGenerationSettingsVersion"] = self.TEXT_GENERATION_SETTINGS_VERSION
@@ -114,6 +146,9 @@ class NovelAIStory:
         self.preset.name = settings["preset"]
         self.preset.model = self.model
 
+        limit = get_prompt_limit(self.model, self.preset.to_settings(), self.api.subscription_tier)
+        self.context_size = self.DEFAULT_CONTEXT_SIZE if limit is None else limit
+
     def __init__(
         self,
         api: NovelAIAPI,
@@ -124,105 +159,169 @@ class NovelAIStory:
         storycontent: Dict[str, Any],
     ):
         self.api = api
+        self.keystore = keystore
         self.key = keystore[meta]
         self.story = story
         self.storycontent = storycontent
         self.tree = []
 
+        self._storycontent_stale = False
+
+        self._modified = {"story": False, "storycontent": False}
+        self._saved_digests = {}
+        self._save_lock = None
+        self._save_timer = None
+        self._save_future = None
+        self._save_task = None
+
         data = storycontent["data"]
 
         self.global_settings = global_settings.copy()
 
-        print(dumps(data, indent=4))
-        self._handle_banlist(data)
-        self._handle_biasgroups(data)
-        self._handle_preset(data)
-
-        # FIXME: variable context size ? From global settings ?
-        self.context_size = 2048
+        logger = api.logger
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Storycontent {storycontent.get('id')}: {dumps(data, indent=4)}")
 
         # TODO: trimResponses
         # TODO: banBrackets
         # TODO: dynamicPenaltyRange
+        # TODO: ephemeral context
 
-        # TODO: remember
-        # TODO: AN
+    def _load_settings(self):
+        """
+        Parse the ban lists, bias groups and preset of the storycontent. The storycontent is left untouched
+        """
 
-        # TODO: Lorebook
+        data = self.storycontent["data"]
+
+        self._handle_banlist(data)
+        self._handle_biasgroups(data)
+        self._handle_preset(data)
+
+    def _load_story(self):
+        """
+        Build the text and the history of the story from the storycontent
+        """
 
-    def _create_datablock(self, fragment: Dict[str, str], end_offset: int):
         story = self.storycontent["data"]["story"]
-        blocks = story["datablocks"]
-        fragments = story["fragments"]
 
-        cur_index = story["currentBlock"]
-        cur_block = blocks[cur_index]
+        self.text = StoryText(story["fragments"])
+        # the list of dicts is dropped, as it takes several times the memory of the tree
+        self.datablocks = DatablockTree.from_json(story.pop("datablocks"))
+        self.context_builder = ContextBuilder(self.model)
 
-        story["step"] += 1
+    def __getattr__(self, name: str) -> Any:
+        # only called for missing attributes, so everything is built once, on first use
+        # an AttributeError raised while loading would be taken for the lazy attribute missing
+        if name in self._LAZY_SETTINGS:
+            try:
+                self._load_settings()
+            except AttributeError as e:
+                raise RuntimeError(f"Could not load the settings of the story: {e}") from e
 
-        frag_index = len(fragments)
-        fragments.append(fragment)
+            return self.__dict__[name]
 
-        start = cur_block["endIndex"] + len(cur_block["dataFragment"]["data"])
+        if name in self._LAZY_STORY:
+            try:
+                self._load_story()
+            except AttributeError as e:
+                raise RuntimeError(f"Could not load the text of the story: {e}") from e
 
-        block = {
-            "nextBlock": [],
-            "prevBlock": cur_index,
-            "origin": fragment["origin"],
-            "startIndex": start,
-            "endIndex": start + end_offset,
-            "dataFragment": fragment,
-            "fragmentIndex": frag_index,
-            "removedFragments": [],
-            "chain": False,
-        }
-        new_index = len(blocks)
-        blocks.append(block)
+            return self.__dict__[name]
 
-        cur_block["nextBlock"].append(new_index)
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
 
-        story["currentBlock"] = new_index
-        self.tree.append(new_index)
+    def _sync_storycontent(self):
+        """
+        Write the fragments of the text in the storycontent, if they changed
+        """
 
-    def __str__(self) -> str:
-        story_fragments = self.storycontent["data"]["story"]["fragments"]
+        if self._storycontent_stale:
+            self.storycontent["data"]["story"]["fragments"] = self.text.fragments()
+            self._storycontent_stale = False
 
-        story_content = "".join(fragment["data"] for fragment in story_fragments)
+    def _get_upload_item(self, name: str) -> Dict[str, Any]:
+        """
+        Get the object to upload. The history is serialized in a copy of the storycontent, dropped after the upload
+        """
 
-        # FIXME: handle edit
+        item = getattr(self, name)
+        if name != "storycontent" or "datablocks" not in self.__dict__ or not item.get("decrypted"):
+            return item
 
-        return story_content
+        data = item["data"]
+        story = {**data["story"], "datablocks": self.datablocks.to_json()}
 
-    def build_context(self) -> List[int]:
-        tokens = []
+        return {**item, "data": {**data, "story": story}}
+
+    def _content_changed(self):
+        self._storycontent_stale = True
+        self._modified["storycontent"] = True
+
+    def mark_modified(self, story: bool = False, storycontent: bool = True):
+        """
+        Mark objects of the story as modified, so they are uploaded by the next save. Changes made through the
+        methods of the story are tracked, this is only needed for changes made directly to the objects
+        (e.g. a lorebook entry of the storycontent, or the title in the story)
+
+        :param story: Mark the story (metadata) as modified
+        :param storycontent: Mark the storycontent as modified
+        """
+
+        if story:
+            self._modified["story"] = True
+
+        if storycontent:
+            self._modified["storycontent"] = True
 
-        # TODO: Remember tokens
-        # TODO: AN tokens
+    def _apply_datablock(self, index: int):
+        blocks = self.datablocks
 
-        # TODO: optimize for large stories ?
-        # edit is a pain for input in token form, so we use it's string representation instead
-        story_content = str(self)
-        story_content_size = self.context_size
+        # the fragments of the tree are shared, the text gets a copy as it is exposed in the storycontent
+        removed = self.text.replace(blocks.start(index), blocks.end(index), [dict(blocks.fragment(index))])
+        blocks.set_removed_fragments(index, removed)
+        self._content_changed()
 
-        # TODO: add option to remove superfluous spaces at the end
+    def _revert_datablock(self, index: int):
+        blocks = self.datablocks
 
-        # only tokenize the tail to handle large stories
-        story_tokens = []
-        while len(story_tokens) < self.context_size:
-            story_content_size *= 2
-            story_tokens = Tokenizer.encode(self.model, story_content[-story_content_size:])
+        start = blocks.start(index)
+        end = start + len(blocks.fragment(index)["data"])
+        self.text.replace(start, end, blocks.removed_fragments(index))
+        self._content_changed()
 
-            # whole story content is tokenized
-            if len(story_content) < story_content_size:
-                break
+    def _create_datablock(self, fragment: Dict[str, str], start: int, end: int):
+        story = self.storycontent["data"]["story"]
+
+        story["step"] += 1
+
+        new_index = self.datablocks.append(
+            story["currentBlock"], fragment["origin"], start, end, fragment, self.text.fragment_index(start)
+        )
+        self._apply_datablock(new_index)
+
+        story["currentBlock"] = new_index
+        self.tree.append(new_index)
+
+    def __str__(self) -> str:
+        return str(self.text)
+
+    def build_context(self) -> List[int]:
+        data = self.storycontent["data"]
 
-        story_tokens = story_tokens[-self.context_size :]
+        entries = [
+            ContextEntry(context["text"], context["contextConfig"], name)
+            for name, context in zip(("memory", "authorsnote"), data.get("context", []))
+        ]
 
-        # TODO: LB tokens
+        lorebook = data.get("lorebook", {}).get("entries", [])
+        for entry in get_activated_lore(lorebook, self.text):
+            entries.append(ContextEntry(entry["text"], entry["contextConfig"], entry.get("displayName", "")))
 
-        # TODO: Order and cut everything to fit
+        # the model can be changed in between
+        self.context_builder.model = self.model
 
-        tokens.extend(story_tokens)
+        tokens = self.context_builder.build(self.text, data.get("storyContextConfig", {}), entries, self.context_size)
 
         # Internal assert, should never happen
         assert len(tokens) <= self.context_size
@@ -245,77 +344,193 @@ class NovelAIStory:
         output = Tokenizer.decode(self.model, b64_to_tokens(rsp["output"]))
         fragment = {"data": output, "origin": "ai"}
 
-        self._create_datablock(fragment, 0)
+        end = len(self.text)
+        self._create_datablock(fragment, end, end)
 
         return self
 
     async def edit(self, start: int, end: int, replace: str):
-        # FIXME: redo edit implementation
-
         fragment = {"data": replace, "origin": "edit"}
 
-        self._create_datablock(fragment, end - start)
+        self._create_datablock(fragment, start, end)
 
     async def undo(self):
         story = self.storycontent["data"]["story"]
 
         cur_index = story["currentBlock"]
-        blocks = story["datablocks"]
+        prev_index = self.datablocks.prev(cur_index)
+
+        # the root block can't be undone
+        if prev_index < 0:
+            return
 
-        cur_block = blocks[cur_index]
-        story["currentBlock"] = cur_block["prevBlock"]
+        self._revert_datablock(cur_index)
+        story["currentBlock"] = prev_index
 
     async def redo(self):
         story = self.storycontent["data"]["story"]
 
-        cur_index = story["currentBlock"]
-        blocks = story["datablocks"]
+        next_index = self.datablocks.last_child(story["currentBlock"])
+        if next_index < 0:
+            return
 
-        cur_block = blocks[cur_index]
-        story["currentBlock"] = cur_block["nextBlock"][-1]
+        self._apply_datablock(next_index)
+        story["currentBlock"] = next_index
 
     async def save(self, upload: bool = False) -> bool:
-        encrypted_story = encrypt_user_data(deepcopy(self.story), self.keystore)
-        encrypted_storycontent = encrypt_user_data(deepcopy(self.storycontent), self.keystore)
+        """
+        Save the story. Only the objects modified since their last upload are serialized, encrypted and uploaded
+        (e.g. the story metadata is not uploaded if only the content changed)
+
+        :param upload: Upload the modified objects. If False, the text is only written back into the storycontent
+
+        :return: True if the upload succeeded (or there was nothing to upload), False otherwise
+        """
+
+        self._sync_storycontent()
+
+        if not upload:
+            return True
+
+        if self._save_lock is None:
+            self._save_lock = asyncio.Lock()
+
+        loop = asyncio.get_running_loop()
+
+        async with self._save_lock:
+            # the content first, so the story never points to content that isn't uploaded yet
+            for name in ("storycontent", "story"):
+                if not self._modified[name]:
+                    continue
+
+                # the object is snapshotted before it is encrypted and uploaded, so it can change meanwhile
+                # (and be marked as modified again)
+                self._modified[name] = False
+                item = self._get_upload_item(name)
+                data = serialize_user_data(item) if item.get("decrypted") else None
+                digest = None if data is None else sha256(data.encode()).digest()
+
+                # changed, then changed back
+                if digest is not None and digest == self._saved_digests.get(name):
+                    continue
+
+                try:
+                    encrypted = await loop.run_in_executor(
+                        None, encrypt_user_data_copy, dict(item), self.keystore, self.api.compression, data
+                    )
+                    success = await self.api.high_level.upload_user_content(encrypted)
+                except BaseException:
+                    self._modified[name] = True
+                    raise
+
+                if not success:
+                    self._modified[name] = True
+                    return False
+
+                if digest is not None:
+                    self._saved_digests[name] = digest
+
+        return True
+
+    def save_later(self, delay: Optional[float] = None) -> asyncio.Future:
+        """
+        Schedule an upload of the story. The saves scheduled in quick succession are coalesced into one upload,
+        done once no save has been scheduled for ``delay`` seconds
+
+        :param delay: Delay to wait for (SAVE_DELAY if None)
+
+        :return: Future resolved with the result of the upload (see save)
+        """
+
+        loop = asyncio.get_running_loop()
+
+        if self._save_timer is not None:
+            self._save_timer.cancel()
+
+        if self._save_future is None:
+            self._save_future = loop.create_future()
 
-        success = True
+        future = self._save_future
+        self._save_timer = loop.call_later(self.SAVE_DELAY if delay is None else delay, self._start_scheduled_save)
 
-        # TODO: keep local copy if upload ?
-        if upload:
-            success = success and await self.api.high_level.upload_user_content(encrypted_storycontent)
-            success = success and await self.api.high_level.upload_user_content(encrypted_story)
+        return future
 
-        return success
+    def _start_scheduled_save(self):
+        future = self._save_future
+        self._save_timer = None
+        self._save_future = None
+
+        # already started by flush
+        if future is not None:
+            self._save_task = asyncio.ensure_future(self._run_scheduled_save(future))
+
+    async def _run_scheduled_save(self, future: asyncio.Future) -> asyncio.Future:
+        try:
+            result = await self.save(upload=True)
+        except asyncio.CancelledError:
+            # don't leave the callers of save_later waiting forever
+            future.cancel()
+            raise
+        except Exception as e:  # pylint: disable=W0703
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+        return future
+
+    async def flush(self) -> bool:
+        """
+        Upload the scheduled save now, if there is one, or wait for the scheduled upload in progress
+
+        :return: The result of the upload (True if there was no scheduled save)
+        """
+
+        if self._save_timer is not None:
+            self._save_timer.cancel()
+            self._start_scheduled_save()
+
+        task = self._save_task
+        if task is None or task.done():
+            return True
+
+        future = await task
+
+        return await future
 
     async def choose(self, index: int):
         story = self.storycontent["data"]["story"]
 
-        cur_index = story["currentBlock"]
-        blocks = story["datablocks"]
-
-        cur_block = blocks[cur_index]
-        next_blocks = cur_block["nextBlock"]
+        next_blocks = list(self.datablocks.children(story["currentBlock"]))
         if not (0 <= index < len(next_blocks)):
             raise ValueError(f"Expected index between 0 and {len(next_blocks)}, but got {index}")
 
+        self._apply_datablock(next_blocks[index])
         story["currentBlock"] = next_blocks[index]
 
-    async def flatten(self):
+    async def compact(self, depth: int = 0):
+        """
+        Prune the dead branches of the history (see :meth:`novelai_api.DatablockTree.DatablockTree.compact`)
+
+        :param depth: Number of blocks above the current one whose alternatives are kept
+        """
+
         story = self.storycontent["data"]["story"]
 
-        blocks = story["datablocks"]
-        new_datablocks = [blocks[i] for i in self.tree]
-        self.tree = [i for i in range(len(new_datablocks))]
-        story["datablocks"] = new_datablocks
+        mapping = self.datablocks.compact(story["currentBlock"], depth)
+
+        story["currentBlock"] = mapping[story["currentBlock"]]
+        self.tree = [mapping[i] for i in self.tree if 0 <= mapping[i]]
+        self._content_changed()
+
+    async def flatten(self):
+        # drop every alternative to the path leading to the current block
+        await self.compact(0)
 
     async def delete(self):
         pass
 
     async def get_current_tree(self) -> List[Dict[str, Any]]:
-        story = self.storycontent["data"]["story"]
-
-        blocks = story["datablocks"]
-        return [blocks[i] for i in self.tree]
+        return [self.datablocks.block(i) for i in self.tree]
 
 
 class NovelAIStoryStorage:
@@ -393,8 +608,10 @@ class NovelAIStoryStorage:
         return loaded
 
     async def load_from_remote(self) -> List[NovelAIStory]:
-        stories = await self.api.high_level.download_user_stories()
-        storycontents = await self.api.high_level.download_user_story_contents()
+        stories, storycontents = await asyncio.gather(
+            self.api.high_level.download_user_stories(),
+            self.api.high_level.download_user_story_contents(),
+        )
 
         decrypt_user_data(stories, self.keystore)
         decrypt_user_data(storycontents, self.keystore)
@@ -440,6 +657,9 @@ class NovelAIStoryStorage:
 
         proxy = self.load(story, storycontent)
 
+        # the story doesn't exist remotely yet, so the first save uploads it
+        proxy.mark_modified(story=True, storycontent=True)
+
         return proxy
 
     def select(self, story_id: str) -> Optional[NovelAIStory]:
@@ -0,0 +1,224 @@
+"""
+Text of a story, as a rope of fragments.
+
+The fragments are the leaves of a treap (randomized balanced tree) ordered by position, so replacing a range,
+or extracting the end of the text, is O(log n) in the number of fragments, instead of O(n) for a joined string
+or a list of fragments.
+"""
+
+import random
+from typing import Dict, Iterator, List, Optional, Tuple
+
+Fragment = Dict[str, str]
+
+
+class _Piece:
+    __slots__ = ("fragment", "prio", "left", "right", "size", "count")
+
+    fragment: Fragment
+    prio: float
+    left: Optional["_Piece"]
+    right: Optional["_Piece"]
+    #: Number of characters in the subtree
+    size: int
+    #: Number of pieces in the subtree
+    count: int
+
+    def __init__(self, fragment: Fragment):
+        self.fragment = fragment
+        self.prio = random.random()  # nosec B311
+        self.left = None
+        self.right = None
+        self.size = len(fragment["data"])
+        self.count = 1
+
+    def update(self):
+        size = len(self.fragment["data"])
+        count = 1
+
+        if self.left is not None:
+            size += self.left.size
+            count += self.left.count
+
+        if self.right is not None:
+            size += self.right.size
+            count += self.right.count
+
+        self.size = size
+        self.count = count
+
+
+def _merge(a: Optional[_Piece], b: Optional[_Piece]) -> Optional[_Piece]:
+    if a is None:
+        return b
+
+    if b is None:
+        return a
+
+    if a.prio > b.prio:
+        a.right = _merge(a.right, b)
+        a.update()
+
+        return a
+
+    b.left = _merge(a, b.left)
+    b.update()
+
+    return b
+
+
+def _split(node: Optional[_Piece], pos: int) -> Tuple[Optional[_Piece], Optional[_Piece]]:
+    """
+    Split the tree at a character position. A piece straddling the position is cut in two
+    """
+
+    if node is None:
+        return None, None
+
+    left_size = 0 if node.left is None else node.left.size
+    data = node.fragment["data"]
+
+    # empty pieces at the position go to the left part
+    if pos < left_size or (pos == left_size and data):
+        left, node.left = _split(node.left, pos)
+        node.update()
+
+        return left, node
+
+    if left_size + len(data) <= pos:
+        node.right, right = _split(node.right, pos - left_size - len(data))
+        node.update()
+
+        return node, right
+
+    # the position is inside this piece, cut it
+    cut = pos - left_size
+    origin = node.fragment["origin"]
+
+    head = _Piece({"data": data[:cut], "origin": origin})
+    tail = _Piece({"data": data[cut:], "origin": origin})
+
+    return _merge(node.left, head), _merge(tail, node.right)
+
+
+def _iter_pieces(node: Optional[_Piece], reverse: bool = False) -> Iterator[_Piece]:
+    stack = []
+    while stack or node is not None:
+        if node is not None:
+            stack.append(node)
+            node = node.right if reverse else node.left
+        else:
+            node = stack.pop()
+            yield node
+            node = node.left if reverse else node.right
+
+
+class StoryText:
+    """
+    Text of a story, as a sequence of fragments ({"data": ..., "origin": ...})
+    """
+
+    _root: Optional[_Piece]
+
+    def __init__(self, fragments: Optional[List[Fragment]] = None):
+        """
+        :param fragments: Fragments of the text, in order. The fragments are used as is, not copied
+        """
+
+        self._root = None
+
+        for fragment in fragments or []:
+            self._root = _merge(self._root, _Piece(fragment))
+
+    def __len__(self) -> int:
+        return 0 if self._root is None else self._root.size
+
+    @property
+    def fragment_count(self) -> int:
+        """
+        Number of fragments in the text
+        """
+
+        return 0 if self._root is None else self._root.count
+
+    def __str__(self) -> str:
+        return "".join(piece.fragment["data"] for piece in _iter_pieces(self._root))
+
+    def fragments(self) -> List[Fragment]:
+        """
+        Get the fragments of the text, in order
+        """
+
+        return [piece.fragment for piece in _iter_pieces(self._root)]
+
+    def tail(self, size: int) -> str:
+        """
+        Get the end of the text, without building the whole text
+
+        :param size: Number of characters to get
+
+        :return: The last characters of the text (the whole text if it is shorter)
+        """
+
+        parts = []
+        remaining = size
+        for piece in _iter_pieces(self._root, reverse=True):
+            if remaining <= 0:
+                break
+
+            data = piece.fragment["data"]
+            parts.append(data[-remaining:] if remaining < len(data) else data)
+            remaining -= len(data)
+
+        return "".join(reversed(parts))
+
+    def fragment_index(self, pos: int) -> int:
+        """
+        Get the index of the fragment at a character position (the number of fragments entirely before it)
+
+        :param pos: Character position in the text
+        """
+
+        index = 0
+        node = self._root
+        while node is not None:
+            left_size = 0 if node.left is None else node.left.size
+            left_count = 0 if node.left is None else node.left.count
+
+            if pos <= left_size:
+                node = node.left
+            else:
+                index += left_count + 1
+                pos -= left_size + len(node.fragment["data"])
+                if pos < 0:
+                    return index - 1
+
+                node = node.right
+
+        return index
+
+    def replace(self, start: int, end: int, fragments: List[Fragment]) -> List[Fragment]:
+        """
+        Replace a range of the text
+
+        :param start: Start of the range (in characters)
+        :param end: End of the range (in characters, excluded)
+        :param fragments: Fragments to put in place of the range
+
+        :return: The fragments removed
+        """
+
+        if not 0 <= start <= end <= len(self):
+            raise ValueError(f"Invalid range [{start}, {end}) for a text of length {len(self)}")
+
+        left, rest = _split(self._root, start)
+        middle, right = _split(rest, end - start)
+
+        removed = [piece.fragment for piece in _iter_pieces(middle)]
+
+        for fragment in fragments:
+            left = _merge(left, _Piece(fragment))
+
+        self._root = _merge(left, right)
+
+        return removed
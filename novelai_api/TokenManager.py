@@ -0,0 +1,204 @@
+import asyncio
+import json
+import os
+import time
+from base64 import urlsafe_b64decode
+from hashlib import blake2b
+from pathlib import Path
+from typing import Awaitable, Callable, Optional, Union
+
+from novelai_api.NovelAIError import NovelAIError
+
+
+def get_token_expiration(token: str) -> Optional[float]:
+    """
+    Read the expiration date of an access token (JWT), without verifying it
+
+    :param token: Access token
+    :return: Expiration timestamp (in seconds), or None if the token doesn't hold one
+    """
+
+    parts = token.split(".")
+    if len(parts) != 3:
+        return None
+
+    payload = parts[1]
+    try:
+        data = json.loads(urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+    except ValueError:
+        return None
+
+    exp = data.get("exp") if isinstance(data, dict) else None
+
+    return float(exp) if isinstance(exp, (int, float)) else None
+
+
+class TokenManager:
+    """
+    Keep track of the access token, its expiration, and how to get a new one.
+
+    When a request fails with 401 (or the token is about to expire), a single re-login is done while
+    the other requests wait for it, then the requests are sent again with the new token.
+    Re-login is only possible if the token was obtained with :meth:`HighLevel.login` or
+    :meth:`HighLevel.login_from_key`, not with :meth:`HighLevel.login_with_token`.
+    """
+
+    _parent: "NovelAIAPI"  # noqa: F821
+
+    _relogin: Optional[Callable[[], Awaitable[str]]]
+    _lock: Optional[asyncio.Lock]
+    _lock_loop: Optional[asyncio.AbstractEventLoop]
+    _failed_refresh: Optional[tuple]
+
+    #: Current access token (None if not logged in)
+    token: Optional[str]
+    #: Expiration timestamp of the token (None if unknown)
+    expires_at: Optional[float]
+    #: Refresh the token this many seconds before it expires
+    refresh_margin: float
+    #: Automatically re-login on expired token or 401 response
+    auto_refresh: bool
+    #: File to persist the token in, to reuse it between processes (None to disable)
+    persist_path: Optional[Path]
+
+    def __init__(self, parent: "NovelAIAPI"):  # noqa: F821
+        self._parent = parent
+
+        self._relogin = None
+        self._lock = None
+        self._lock_loop = None
+        self._failed_refresh = None
+
+        self.token = None
+        self.expires_at = None
+        self.refresh_margin = 60
+        self.auto_refresh = True
+        self.persist_path = None
+
+    @property
+    def can_refresh(self) -> bool:
+        """
+        True if a new token can be obtained without the user
+        """
+
+        return self.auto_refresh and self._relogin is not None
+
+    def is_expired(self) -> bool:
+        """
+        True if the token is expired, or will expire within refresh_margin seconds
+        """
+
+        return self.expires_at is not None and self.expires_at - self.refresh_margin <= time.time()
+
+    def set_token(self, token: str, relogin: Optional[Callable[[], Awaitable[str]]] = None, account: str = ""):
+        """
+        Set the token used for the requests
+
+        :param token: Access token
+        :param relogin: Coroutine function logging in again, for refreshing (None if the token cannot be refreshed)
+        :param account: Identifier of the account (e.g. email), used to persist the token
+        """
+
+        self.token = token
+        self.expires_at = get_token_expiration(token)
+        self._relogin = relogin
+
+        self._parent.headers["Authorization"] = f"Bearer {token}"
+
+        if self.persist_path is not None and account:
+            self._save(account)
+
+    @staticmethod
+    def _account_digest(account: str) -> str:
+        return blake2b(account.encode(), digest_size=16).hexdigest()
+
+    def _save(self, account: str):
+        content = {"account": self._account_digest(account), "token": self.token, "expires_at": self.expires_at}
+
+        tmp_path = self.persist_path.with_name(f"{self.persist_path.name}.tmp")
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(json.dumps(content))
+
+        os.replace(tmp_path, self.persist_path)
+
+    def load_persisted(self, account: str) -> Optional[str]:
+        """
+        Load the token persisted for the account, if it is still valid
+
+        :param account: Identifier of the account (e.g. email)
+        :return: The token, or None if there is no valid token persisted
+        """
+
+        if self.persist_path is None or not self.persist_path.exists():
+            return None
+
+        try:
+            with open(self.persist_path, encoding="utf-8") as f:
+                content = json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+
+        if content.get("account") != self._account_digest(account):
+            return None
+
+        expires_at = content.get("expires_at")
+        if expires_at is not None and expires_at - self.refresh_margin <= time.time():
+            return None
+
+        return content.get("token")
+
+    def set_persist_path(self, path: Optional[Union[str, os.PathLike]]):
+        """
+        Set the file to persist the token in (None to disable)
+        """
+
+        self.persist_path = None if path is None else Path(path)
+
+    def _get_lock(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+
+        # synchronous usage can run each request in a different loop
+        if self._lock is None or self._lock_loop is not loop:
+            self._lock = asyncio.Lock()
+            self._lock_loop = loop
+
+        return self._lock
+
+    async def refresh(self, failed_token: Optional[str]):
+        """
+        Get a new token, unless it has already been renewed since failed_token was used.
+        Concurrent calls result in a single re-login
+
+        :param failed_token: Token that was used by the failed (or expired) request
+        """
+
+        if self._relogin is None:
+            raise NovelAIError("<UNKNOWN>", 401, "Access token expired and no credentials are available to re-login")
+
+        async with self._get_lock():
+            # another request already renewed the token
+            if self.token != failed_token:
+                return
+
+            # another request already tried to renew this token, and failed
+            if self._failed_refresh is not None and self._failed_refresh[0] == failed_token:
+                raise self._failed_refresh[1]
+
+            self._parent.logger.info("Access token expired, logging in again")
+
+            try:
+                await self._relogin()
+            except Exception as e:
+                self._failed_refresh = (failed_token, e)
+                raise
+
+            self._failed_refresh = None
+
+    async def ensure_valid(self):
+        """
+        Refresh the token beforehand, if it is about to expire
+        """
+
+        if self.can_refresh and self.is_expired():
+            await self.refresh(self.token)
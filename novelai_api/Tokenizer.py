@@ -1,23 +1,20 @@
 import itertools
 import re
 from pathlib import Path
-from typing import Dict, List, Union
-
-import sentencepiece
-import tokenizers
+from typing import Any, Callable, Dict, List, Union
 
 from novelai_api.ImagePreset import ImageModel
 from novelai_api.Preset import Model
-from novelai_api.tokenizers.simple_tokenizer import SimpleTokenizer
 
 AnyModel = Union[Model, ImageModel]
 
 tokenizers_path = Path(__file__).parent / "tokenizers"
 
 
-class SentencePiece(sentencepiece.SentencePieceProcessor):
+class SentencePiece:
     """
-    Wrapper around sentencepiece.SentencePieceProcessor that adds the encode and decode methods
+    Wrapper around sentencepiece.SentencePieceProcessor that adds the encode and decode methods.
+    The other methods are forwarded to the processor
     """
 
     trans_table_ids: Dict[int, str]
@@ -25,8 +22,11 @@ class SentencePiece(sentencepiece.SentencePieceProcessor):
     trans_regex_str: re.Pattern
 
     def __init__(self, model_path: str):
-        super().__init__()
-        self.Load(model_path)
+        # imported here, as it is only needed when a sentencepiece tokenizer is used
+        import sentencepiece  # pylint: disable=C0415
+
+        self._processor = sentencepiece.SentencePieceProcessor()
+        self._processor.Load(model_path)
 
         self.trans_table_ids = {
             self.unk_id(): "<|unk|>",
@@ -45,6 +45,15 @@ class SentencePiece(sentencepiece.SentencePieceProcessor):
         trans_regex_keys = "|".join(re.escape(e) for e in self.trans_table_str)
         self.trans_regex_str = re.compile(trans_regex_keys)
 
+    def __getattr__(self, name: str) -> Any:
+        # only called for the attributes not defined in this class. The processor is looked up in __dict__, as it is
+        # missing before __init__ (e.g. on unpickling), and looking it up as an attribute would recurse
+        processor = self.__dict__.get("_processor")
+        if processor is None:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+        return getattr(processor, name)
+
     def encode(self, s: str) -> List[int]:
         """
         Encode the provided text using the SentencePiece tokenizer.
@@ -115,6 +124,20 @@ class SentencePiece(sentencepiece.SentencePieceProcessor):
         return "".join((decoded_parts[0], *itertools.chain.from_iterable(zip(junctions, decoded_parts[1:]))))
 
 
+def _load_hf_tokenizer(path: Union[str, Path]) -> Any:
+    # imported here, so the library is only loaded if one of its tokenizers is used
+    import tokenizers  # pylint: disable=C0415
+
+    return tokenizers.Tokenizer.from_file(str(path))
+
+
+def _load_clip_tokenizer() -> Any:
+    # TODO: check differences from NAI tokenizer (from my limited testing, there is None)
+    from novelai_api.tokenizers.simple_tokenizer import SimpleTokenizer  # pylint: disable=C0415
+
+    return SimpleTokenizer()
+
+
 class Tokenizer:
     """
     Abstraction of the tokenizer behind each Model
@@ -148,36 +171,37 @@ class Tokenizer:
         return cls._tokenizers_name[model]
 
     _GPT2_PATH = tokenizers_path / "gpt2_tokenizer.json"
-    _GPT2_TOKENIZER = tokenizers.Tokenizer.from_file(str(_GPT2_PATH))
-
     _GENJI_PATH = tokenizers_path / "gpt2-genji_tokenizer.json"
-    _GENJI_TOKENIZER = tokenizers.Tokenizer.from_file(str(_GENJI_PATH))
-
     _PILE_PATH = tokenizers_path / "pile_tokenizer.json"
-    _PILE_TOKENIZER = tokenizers.Tokenizer.from_file(str(_PILE_PATH))
-
-    # TODO: check differences from NAI tokenizer (from my limited testing, there is None)
-    _CLIP_TOKENIZER = SimpleTokenizer()
-
     _NERDSTASH_TOKENIZER_v1_PATH = str(tokenizers_path / "nerdstash_v1.model")
-    _NERDSTASH_TOKENIZER_v1 = SentencePiece(_NERDSTASH_TOKENIZER_v1_PATH)
-
     _NERDSTASH_TOKENIZER_v2_PATH = str(tokenizers_path / "nerdstash_v2.model")
-    _NERDSTASH_TOKENIZER_v2 = SentencePiece(_NERDSTASH_TOKENIZER_v2_PATH)
-
     _LLAMA3_TOKENIZER_PATH = str(tokenizers_path / "llama3.json")
-    _LLAMA3_TOKENIZER = tokenizers.Tokenizer.from_file(str(_LLAMA3_TOKENIZER_PATH))
-
-    _tokenizers = {
-        "gpt2": _GPT2_TOKENIZER,
-        "gpt2-genji": _GENJI_TOKENIZER,
-        "pile": _PILE_TOKENIZER,
-        "clip": _CLIP_TOKENIZER,
-        "nerdstash_v1": _NERDSTASH_TOKENIZER_v1,
-        "nerdstash_v2": _NERDSTASH_TOKENIZER_v2,
-        "llama3": _LLAMA3_TOKENIZER,
+
+    # tokenizers are loaded on first use
+    _tokenizers_loaders: Dict[str, Callable[[], Any]] = {
+        "gpt2": lambda: _load_hf_tokenizer(Tokenizer._GPT2_PATH),
+        "gpt2-genji": lambda: _load_hf_tokenizer(Tokenizer._GENJI_PATH),
+        "pile": lambda: _load_hf_tokenizer(Tokenizer._PILE_PATH),
+        "clip": _load_clip_tokenizer,
+        "nerdstash_v1": lambda: SentencePiece(Tokenizer._NERDSTASH_TOKENIZER_v1_PATH),
+        "nerdstash_v2": lambda: SentencePiece(Tokenizer._NERDSTASH_TOKENIZER_v2_PATH),
+        "llama3": lambda: _load_hf_tokenizer(Tokenizer._LLAMA3_TOKENIZER_PATH),
     }
 
+    # tokenizers returning an Encoding object instead of a list of tokens
+    _hf_tokenizers = {"gpt2", "gpt2-genji", "pile", "llama3"}
+
+    _tokenizers: Dict[str, Any] = {}
+
+    @classmethod
+    def _get_tokenizer(cls, tokenizer_name: str) -> Any:
+        tokenizer = cls._tokenizers.get(tokenizer_name)
+        if tokenizer is None:
+            tokenizer = cls._tokenizers_loaders[tokenizer_name]()
+            cls._tokenizers[tokenizer_name] = tokenizer
+
+        return tokenizer
+
     @classmethod
     def decode(cls, model: AnyModel, o: List[int]) -> str:
         """
@@ -190,7 +214,7 @@ class Tokenizer:
         """
 
         tokenizer_name = cls._tokenizers_name[model]
-        tokenizer = cls._tokenizers[tokenizer_name]
+        tokenizer = cls._get_tokenizer(tokenizer_name)
 
         return tokenizer.decode(o)
 
@@ -206,12 +230,9 @@ class Tokenizer:
         """
 
         tokenizer_name = cls._tokenizers_name[model]
-        tokenizer = cls._tokenizers[tokenizer_name]
+        tokenizer = cls._get_tokenizer(tokenizer_name)
 
-        if isinstance(tokenizer, tokenizers.Tokenizer):
+        if tokenizer_name in cls._hf_tokenizers:
             return tokenizer.encode(o).ids
 
-        if isinstance(tokenizer, (SimpleTokenizer, sentencepiece.SentencePieceProcessor)):
-            return tokenizer.encode(o)
-
-        raise ValueError(f"Tokenizer {tokenizer} ({tokenizer_name}) not recognized")
+        return tokenizer.encode(o)
@@ -4,5 +4,32 @@
 :class:`NovelAIError`
 """
 
-from novelai_api.NovelAI_API import NovelAIAPI
-from novelai_api.NovelAIError import NovelAIError
+from importlib import import_module
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from novelai_api.NovelAI_API import NovelAIAPI
+    from novelai_api.NovelAIError import NovelAIError
+
+__all__ = ["NovelAIAPI", "NovelAIError"]
+
+# the submodules are imported on first access, so importing the package (or the light submodules) stays fast
+_LAZY_ATTRIBUTES = {
+    "NovelAIAPI": "novelai_api.NovelAI_API",
+    "NovelAIError": "novelai_api.NovelAIError",
+}
+
+
+def __getattr__(name: str):
+    module_name = _LAZY_ATTRIBUTES.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(import_module(module_name), name)
+    globals()[name] = value
+
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -4,14 +4,16 @@ import inspect
 import sys
 from argparse import ArgumentParser
 from logging import Logger, StreamHandler
-from typing import Any, Dict, List, NoReturn, Optional, Set, Tuple
+from typing import TYPE_CHECKING, Any, Dict, List, NoReturn, Optional, Set, Tuple
 
-from aiohttp import ClientSession
-
-from novelai_api import NovelAIAPI
 from novelai_api.Preset import Model
 from novelai_api.Tokenizer import Tokenizer
-from novelai_api.utils import decompress_user_data, decrypt_user_data, get_access_key, get_encryption_key
+
+# the commands import what they need, so the light ones (e.g. decode) start fast
+if TYPE_CHECKING:
+    from aiohttp import ClientSession
+
+    from novelai_api import NovelAIAPI
 
 
 class API:
@@ -21,12 +23,14 @@ class API:
 
     _username: str
     _password: str
-    _session: ClientSession
+    _session: "ClientSession"
 
     logger: Logger
-    api: Optional[NovelAIAPI]
+    api: Optional["NovelAIAPI"]
 
     def __init__(self, username: str, password: str):
+        from novelai_api import NovelAIAPI  # pylint: disable=C0415
+
         self._username = username
         self._password = password
 
@@ -38,9 +42,11 @@ class API:
 
     @property
     def encryption_key(self):
-        return get_encryption_key(self._username, self._password)
+        return self.api.key_derivation.get_encryption_key(self._username, self._password)
 
     async def __aenter__(self):
+        from aiohttp import ClientSession  # pylint: disable=C0415
+
         self._session = ClientSession()
         await self._session.__aenter__()
 
@@ -55,6 +61,8 @@ class API:
 
 # access_key
 def get_access_key_func(username: str, password: str):
+    from novelai_api.utils import get_access_key  # pylint: disable=C0415
+
     print(get_access_key(username, password))
 
 
@@ -135,6 +143,8 @@ def _check_story_content_without_story(stories: List[Dict[str, Any]], story_cont
 
 
 async def sanity_checker_func(username: str, password: str):
+    from novelai_api.utils import decompress_user_data, decrypt_user_data  # pylint: disable=C0415
+
     async with API(username, password) as api_handler:
         api = api_handler.api
         logger = api_handler.logger
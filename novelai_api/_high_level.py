@@ -1,19 +1,33 @@
+import asyncio
 import base64
 import json
+import logging
 from hashlib import sha256
-from typing import Any, AsyncIterable, Dict, Iterable, List, Optional, Tuple, Type, Union
+from typing import Any, AsyncGenerator, AsyncIterable, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, Union
 
 from novelai_api.BanList import BanList
 from novelai_api.BiasGroup import BiasGroup
 from novelai_api.DirectorToolsPreset import DirectorToolsPreset, RequestType
+from novelai_api.GenerationBatch import GenerationBatch, GenerationRequest
+from novelai_api.GenerationCandidate import CandidateScorer, GenerationCandidate
+from novelai_api.GenerationStream import GenerationStream, StreamMetrics
+from novelai_api.GenerationTemplate import GenerationTemplate, build_generation_params, get_payload_size
 from novelai_api.GlobalSettings import GlobalSettings
 from novelai_api.ImagePreset import ImageGenerationType, ImageModel, ImagePreset
 from novelai_api.Keystore import Keystore
 from novelai_api.NovelAIError import NovelAIError
 from novelai_api.Preset import Model, Preset
-from novelai_api.python_utils import assert_type
+from novelai_api.python_utils import aclosing, assert_type
+from novelai_api.StopCondition import AnyStopCondition, StreamStopper
 from novelai_api.Tokenizer import Tokenizer
-from novelai_api.utils import compress_user_data, encrypt_user_data, get_access_key
+from novelai_api.utils import (
+    b64_to_tokens,
+    compress_user_data,
+    encrypt_user_data,
+    get_prompt_limit,
+    tokens_to_b64,
+    trim_prompt,
+)
 
 
 class HighLevel:
@@ -30,8 +44,12 @@ class HighLevel:
 
     _parent: "NovelAIAPI"  # noqa: F821
 
+    # (encryption key, decrypted keystore) of the last keystore retrieved or uploaded
+    _keystore_cache: Optional[Tuple[bytes, Keystore]]
+
     def __init__(self, parent: "NovelAIAPI"):  # noqa: F821
         self._parent = parent
+        self._keystore_cache = None
 
     async def register(
         self,
@@ -56,34 +74,72 @@ class HighLevel:
         assert_type(str, email=email)
 
         hashed_email = sha256(email.encode()).hexdigest() if send_mail else None
-        key = get_access_key(email, password)
+        key = await self._parent.key_derivation.derive_access_key(email, password)
         return await self._parent.low_level.register(recapcha, key, hashed_email, giftkey)
 
+    async def _login_with_key(self, access_key: str, relogin: Callable[[], Awaitable[str]], account: str) -> str:
+        rsp = await self._parent.low_level.login(access_key)
+        self._parent.token_manager.set_token(rsp["accessToken"], relogin, account)
+
+        return rsp["accessToken"]
+
     async def login(self, email: str, password: str) -> str:
         """
         Log in to the account
 
+        The access key and the encryption key are derived concurrently, outside the event loop, and cached
+        in :attr:`NovelAIAPI.key_derivation <novelai_api.NovelAI_API.NovelAIAPI.key_derivation>`.
+        The encryption key can then be retrieved at no cost with :meth:`get_encryption_key`.
+
+        The credentials are kept to log in again when the access token expires. If a persist path is set
+        on :attr:`NovelAIAPI.token_manager <novelai_api.NovelAI_API.NovelAIAPI.token_manager>`,
+        a still valid token persisted for this account is reused instead of logging in.
+
         :param email: Email of the account (username)
         :param password: Password of the account
 
         :return: User's access token
         """
 
-        access_key = get_access_key(email, password)
-        rsp = await self._parent.low_level.login(access_key)
+        async def relogin() -> str:
+            access_key, _ = await self._parent.key_derivation.derive(email, password)
 
-        self._parent.headers["Authorization"] = f"Bearer {rsp['accessToken']}"
+            return await self._login_with_key(access_key, relogin, email)
 
-        return rsp["accessToken"]
+        token_manager = self._parent.token_manager
+
+        persisted_token = token_manager.load_persisted(email)
+        if persisted_token is not None:
+            token_manager.set_token(persisted_token, relogin)
+
+            return persisted_token
+
+        return await relogin()
+
+    async def get_encryption_key(self, email: str, password: str) -> bytes:
+        """
+        Get the encryption key of the account, without blocking the event loop.
+        The key is cached, so it is only derived once
+
+        :param email: Email of the account (username)
+        :param password: Password of the account
+
+        :return: Account's encryption key
+        """
+
+        _, encryption_key = await self._parent.key_derivation.derive(email, password)
+
+        return encryption_key
 
     async def login_with_token(self, access_token: str):
         """
-        Log in with the access token, instead of email and password
+        Log in with the access token, instead of email and password.
+        The token cannot be refreshed automatically when it expires
 
         :param access_token: Access token of the account (persistent token or gotten from login)
         """
 
-        self._parent.headers["Authorization"] = f"Bearer {access_token}"
+        self._parent.token_manager.set_token(access_token)
 
     async def login_from_key(self, access_key: str):
         """
@@ -94,13 +150,12 @@ class HighLevel:
         :return: User's access token
         """
 
-        rsp = await self._parent.low_level.login(access_key)
+        async def relogin() -> str:
+            return await self._login_with_key(access_key, relogin, access_key)
 
-        self._parent.headers["Authorization"] = f"Bearer {rsp['accessToken']}"
+        return await relogin()
 
-        return rsp["accessToken"]
-
-    async def get_keystore(self, key: bytes) -> Keystore:
+    async def get_keystore(self, key: bytes, use_cache: bool = False) -> Keystore:
         """
         Retrieve the keystore and decrypt it in a readable manner.
 
@@ -109,14 +164,36 @@ class HighLevel:
         check your internet connection or the integrity of your keystore.
         Losing your keystore, or overwriting it means losing all content on the account.
 
+        The decrypted keystore is cached. If the keystore on the server did not change since the last call
+        (same changeIndex and content), the cached keystore is returned without being decrypted again.
+
         :param key: Account's encryption key
+        :param use_cache: Return the cached keystore without requesting the server, if there is one for this key
 
         :return: Keystore object
         """
 
-        keystore = Keystore(await self._parent.low_level.get_keystore())
+        cache = self._keystore_cache
+        if cache is not None and cache[0] != key:
+            cache = None
+
+        if use_cache and cache is not None:
+            return cache[1]
+
+        data = await self._parent.low_level.get_keystore()
+
+        if cache is not None:
+            cached_keystore = cache[1]
+            if data.get("changeIndex") == cached_keystore.change_index and data["keystore"] == cached_keystore.data.get(
+                "keystore"
+            ):
+                return cached_keystore
+
+        keystore = Keystore(data)
         keystore.decrypt(key)
 
+        self._keystore_cache = (key, keystore)
+
         return keystore
 
     async def set_keystore(self, keystore: Keystore, key: bytes) -> bytes:
@@ -136,7 +213,44 @@ class HighLevel:
 
         keystore.encrypt(key)
 
-        return await self._parent.low_level.set_keystore(keystore.data)
+        rsp = await self._parent.low_level.set_keystore(keystore.data)
+
+        # keep track of the version, so the cached keystore is still recognized as up to date
+        if isinstance(rsp, dict) and "changeIndex" in rsp:
+            keystore.data["changeIndex"] = rsp["changeIndex"]
+        elif keystore.change_index is not None:
+            keystore.data["changeIndex"] = keystore.change_index + 1
+
+        self._keystore_cache = (key, keystore)
+
+        return rsp
+
+    async def create_keystore_meta(self, key: bytes, keystore: Optional[Keystore] = None) -> str:
+        """
+        Add a new meta (and its encryption key) to the keystore, and upload the keystore.
+
+        Only the new entry is serialized, the rest of the keystore reuses the serialization of the previous upload.
+
+        :param key: Account's encryption key
+        :param keystore: Keystore to add the meta to. If None, the cached keystore (or the remote one) is used
+
+        :return: The new meta
+        """
+
+        if keystore is None:
+            keystore = await self.get_keystore(key, use_cache=True)
+
+        meta = keystore.create()
+
+        try:
+            await self.set_keystore(keystore, key)
+        except Exception:
+            # the remote keystore is not changed, don't keep a meta that doesn't exist there
+            del keystore[meta]
+            self._keystore_cache = None
+            raise
+
+        return meta
 
     async def download_user_stories(self) -> List[Dict[str, Dict[str, Union[str, int]]]]:
         """
@@ -185,42 +299,57 @@ class HighLevel:
 
         return modules["objects"]
 
-    async def upload_user_content(
+    def _prepare_user_content(
         self,
         data: Dict[str, Any],
         encrypt: bool = False,
         keystore: Optional[Keystore] = None,
-    ) -> bool:
+    ) -> Tuple[str, str, str, str]:
         """
-        Upload user content
+        Re-encrypt/re-compress the object if needed, and clean it for upload
 
-        :param data: Object to upload
-        :param encrypt: Re-encrypt/re-compress the data, if True
-        :param keystore: Keystore to encrypt the data, if encrypt is True
-
-        :return: True if the upload succeeded, False otherwise
+        :return: (type, id, meta, data) of the object to upload
         """
 
-        object_id = data["id"]
+        object_id = data.get("id", "")
         object_type = data["type"]
         object_meta = data["meta"]
-        object_data = data["data"]
 
         if encrypt:
             if object_type in ("stories", "storycontent", "aimodules"):
                 if keystore is None:
                     raise ValueError("'keystore' is not set, cannot encrypt data")
 
-                encrypt_user_data(data, keystore)
+                encrypt_user_data(data, keystore, self._parent.compression)
             elif object_type in ("shelf", "presets"):
-                compress_user_data(data)
+                compress_user_data(data, self._parent.compression)
 
         # clean data introduced by decrypt_user_data
         # this step should have been done in encrypt_user_data, but the user could have not called it
         for key in ("nonce", "compressed", "decrypted"):
-            if key in object_data:
+            if key in data:
                 self._parent.logger.warning(f"Data {key} left in object '{object_type}' of id '{object_id}'")
-                del object_data[key]
+                del data[key]
+
+        return object_type, object_id, object_meta, data["data"]
+
+    async def upload_user_content(
+        self,
+        data: Dict[str, Any],
+        encrypt: bool = False,
+        keystore: Optional[Keystore] = None,
+    ) -> bool:
+        """
+        Upload user content
+
+        :param data: Object to upload
+        :param encrypt: Re-encrypt/re-compress the data, if True
+        :param keystore: Keystore to encrypt the data, if encrypt is True
+
+        :return: True if the upload succeeded, False otherwise
+        """
+
+        object_type, object_id, object_meta, object_data = self._prepare_user_content(data, encrypt, keystore)
 
         return await self._parent.low_level.upload_object(object_type, object_id, object_meta, object_data)
 
@@ -254,6 +383,72 @@ class HighLevel:
 
         return status
 
+    async def upload_user_contents_concurrently(
+        self,
+        datas: Iterable[Dict[str, Any]],
+        encrypt: bool = False,
+        keystore: Optional[Keystore] = None,
+        max_in_flight: int = 8,
+    ) -> List[Tuple[str, bool, Optional[Exception]]]:
+        """
+        Upload multiple user contents concurrently, with at most ``max_in_flight`` requests running at once.
+        Re-encryption/re-compression is done in worker threads, so it doesn't block the event loop.
+
+        Objects with an id are updated in place (PATCH /user/objects/{type}/{id}). Objects without an id
+        are created through PUT /user/objects/{type}, and their result holds the id given by the server.
+
+        :param datas: Objects to upload
+        :param encrypt: Re-encrypt/re-compress the data, if True
+        :param keystore: Keystore to encrypt the data, if encrypt is True
+        :param max_in_flight: Maximum number of concurrent uploads
+
+        :return: A list of (id, success, error) for each object, in the same order as datas
+        """
+
+        if max_in_flight < 1:
+            raise ValueError(f"Expected a positive value for 'max_in_flight', but got {max_in_flight}")
+
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(max_in_flight)
+
+        async def upload(data: Dict[str, Any]) -> Tuple[str, bool, Optional[Exception]]:
+            object_id = data.get("id", "")
+
+            try:
+                async with semaphore:
+                    object_type, object_id, object_meta, object_data = await loop.run_in_executor(
+                        None, self._prepare_user_content, data, encrypt, keystore
+                    )
+
+                    if object_id:
+                        rsp = await self._parent.low_level.upload_object(
+                            object_type, object_id, object_meta, object_data
+                        )
+                    else:
+                        rsp = await self._parent.low_level.upload_objects(object_type, object_meta, object_data)
+                        if isinstance(rsp, dict):
+                            object_id = rsp.get("id", object_id)
+
+                return object_id, bool(rsp), None
+            except Exception as e:  # pylint: disable=W0703
+                return object_id, False, e
+
+        # group by type, so objects of the same type are sent together
+        indexed_datas = sorted(enumerate(datas), key=lambda e: e[1]["type"])
+        results = await asyncio.gather(*(upload(data) for _, data in indexed_datas))
+
+        status: List[Optional[Tuple[str, bool, Optional[Exception]]]] = [None] * len(indexed_datas)
+        for (i, _), result in zip(indexed_datas, results):
+            status[i] = result
+
+        return status
+
+    def _get_prompt_limit(self, model: Model, params: Dict[str, Any]) -> Optional[int]:
+        if not self._parent.trim_prompt:
+            return None
+
+        return get_prompt_limit(model, params, self._parent.subscription_tier)
+
     async def _generate(
         self,
         prompt: Union[List[int], str],
@@ -264,7 +459,9 @@ class HighLevel:
         biases: Optional[Union[Iterable[BiasGroup], BiasGroup]] = None,
         prefix: Optional[str] = None,
         stop_sequences: Optional[Union[List[int], str]] = None,
+        keep_head: Union[int, List[int], None] = None,
         stream: bool = False,
+        on_response: Optional[Callable[[Any], None]] = None,
         **kwargs,
     ):
         """
@@ -278,89 +475,69 @@ class HighLevel:
         :param biases: Tokens to bias (up or down) for this generation
         :param prefix: Module to use for this generation (see :ref:`list of modules <list-of-modules>`)
         :param stop_sequences: List of strings or tokens to stop the generation at
+        :param keep_head: Tokens at the start of the prompt to keep if it has to be trimmed
+                          (see :func:`novelai_api.utils.trim_prompt`)
         :param stream: Use data streaming for the response
+        :param on_response: Function called when the response headers are received
         :param kwargs: Additional parameters to pass to the requests. Can also be used to overwrite existing parameters
 
         :return: Content that has been generated
         """
 
-        if preset is None:
-            raise ValueError("Uninitialized preset")
-        if preset.model is not model:
-            raise ValueError(f"Preset '{preset.name}' (model {preset.model}) is not compatible with model {model}")
-
-        preset_params = preset.to_settings()
-
-        # special case for repetition penalty whitelist, as it belongs to global settings but is stored in preset files
-        repetition_penalty_default_whitelist = global_settings.rep_pen_whitelist
-        if preset_params.pop("repetition_penalty_default_whitelist", False):
-            global_settings.rep_pen_whitelist = True
-
-        global_params = global_settings.to_settings(model)
-        global_settings.rep_pen_whitelist = repetition_penalty_default_whitelist
-
-        params = {
-            "repetition_penalty_whitelist": list(
-                set(
-                    item
-                    for sublist in [
-                        global_params.pop("repetition_penalty_whitelist", []),
-                        preset_params.pop("repetition_penalty_whitelist", []),
-                    ]
-                    for inner_list in sublist
-                    for item in inner_list
-                )
-            )
-        }
-
-        params.update(preset_params)
-        params.update(global_params)
-        params.update(kwargs)
-
-        # adjust repetition penalty value for Sigurd and Euterpe
-        if model in (Model.Sigurd, Model.Euterpe) and "repetition_penalty" in params:
-            rep_pen = params["repetition_penalty"]
-            params["repetition_penalty"] = (0.525 * (rep_pen - 1) / 7) + 1
-
-        # module
-        params["prefix"] = "vanilla" if prefix is None else prefix
-
-        # bans and biases
-        for k, v, c in (("bad_words_ids", bad_words, BanList), ("logit_bias_exp", biases, BiasGroup)):
-            k: str
-            v: Union[Iterable[BanList], Iterable[BiasGroup], BanList, BiasGroup, None]
-            c: Union[Type[BanList], Type[BiasGroup]]
-
-            if v is not None:
-                if isinstance(v, c):
-                    v = [v]
-
-                for i, obj in enumerate(v):
-                    if not isinstance(obj, c):
-                        raise ValueError(f"Expected type '{c}' for item #{i} of '{k}', but got '{type(obj)}'")
-
-                    params[k].extend(obj.get_tokenized_entries(model))
-
-            if k in params and not params[k]:
-                del params[k]
-
-        # stop sequences
-        if stop_sequences is not None:
-            if not isinstance(stop_sequences, list):
-                raise ValueError(f"Expected type 'list' for 'stop_sequences', but got '{type(stop_sequences)}'")
-
-            for i, obj in enumerate(stop_sequences):
-                if isinstance(obj, str):
-                    stop_sequences[i] = Tokenizer.encode(model, obj)
-                elif not isinstance(obj, list):
-                    raise ValueError(
-                        f"Expected type 'str' or 'list' for item #{i} of 'stop_sequences', " f"but got '{type(obj)}'"
-                    )
+        params = build_generation_params(
+            model, preset, global_settings, bad_words, biases, prefix, stop_sequences, **kwargs
+        )
 
-            params["stop_sequences"] = stop_sequences
+        logger = self._parent.logger
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Generation parameters: {get_payload_size(params)} bytes")
 
-        async for i in self._parent.low_level.generate(prompt, model, params, stream):
-            yield i
+        prompt_limit = self._get_prompt_limit(model, params)
+
+        async with aclosing(
+            self._parent.low_level.generate(prompt, model, params, stream, prompt_limit, keep_head, on_response)
+        ) as gen:
+            async for i in gen:
+                yield i
+
+    @staticmethod
+    def _get_stopper(
+        model: Model,
+        stop_conditions: Union[StreamStopper, AnyStopCondition, Iterable[AnyStopCondition], None],
+    ) -> Optional[StreamStopper]:
+        if stop_conditions is None or isinstance(stop_conditions, StreamStopper):
+            return stop_conditions
+
+        return StreamStopper(model, stop_conditions)
+
+    @staticmethod
+    async def _stream_until(
+        gen: AsyncGenerator[str, None], stopper: Optional[StreamStopper]
+    ) -> AsyncIterable[Dict[str, Any]]:
+        """
+        Parse the events of a stream, and close it as soon as a stop condition is met.
+        The tokens past the stop condition are not yielded
+        """
+
+        async with aclosing(gen):
+            async for e in gen:
+                e = json.loads(e)
+
+                if stopper is None or "token" not in e:
+                    yield e
+                    continue
+
+                token_count = len(stopper.tokens)
+                if not stopper.feed(e):
+                    yield e
+                    continue
+
+                # only keep the tokens of the event that are before the stop condition
+                kept = stopper.tokens[token_count:]
+                if kept:
+                    yield {**e, "token": tokens_to_b64(kept, 4 if stopper.model is Model.Erato else 2)}
+
+                break
 
     async def generate(
         self,
@@ -372,6 +549,7 @@ class HighLevel:
         biases: Optional[Union[Iterable[BiasGroup], BiasGroup]] = None,
         prefix: Optional[str] = None,
         stop_sequences: Optional[Union[List[int], str]] = None,
+        keep_head: Union[int, List[int], None] = None,
         **kwargs,
     ) -> Dict[str, Any]:
         """
@@ -391,6 +569,8 @@ class HighLevel:
         :param biases: Tokens to bias (up or down) for this generation
         :param prefix: Module to use for this generation (see :ref:`list of modules <list-of-modules>`)
         :param stop_sequences: List of strings or tokens to stop the generation at
+        :param keep_head: Tokens at the start of the prompt to keep if it has to be trimmed
+                          (see :func:`novelai_api.utils.trim_prompt`)
         :param kwargs: Additional parameters to pass to the requests. Can also be used to overwrite existing parameters
 
         :return: Content that has been generated
@@ -405,12 +585,13 @@ class HighLevel:
             biases,
             prefix,
             stop_sequences,
+            keep_head,
             False,
             **kwargs,
         ):
             return e
 
-    async def generate_stream(
+    def generate_stream(
         self,
         prompt: Union[List[int], str],
         model: Model,
@@ -420,11 +601,21 @@ class HighLevel:
         biases: Optional[Union[Iterable[BiasGroup], BiasGroup]] = None,
         prefix: Optional[str] = None,
         stop_sequences: Optional[Union[List[int], str]] = None,
+        keep_head: Union[int, List[int], None] = None,
+        stop_conditions: Union[StreamStopper, AnyStopCondition, Iterable[AnyStopCondition], None] = None,
         **kwargs,
-    ) -> AsyncIterable[Dict[str, Any]]:
+    ) -> GenerationStream:
         """
         Generate text. The text is returned one token at a time, as it is generated.
 
+        The returned stream records its timings (time to first byte and token, inter-token latencies, tokens per
+        second) in its ``metrics`` (see :class:`novelai_api.GenerationStream.StreamMetrics`), and passes them to
+        :attr:`novelai_api.NovelAI_API.NovelAIAPI.stream_metrics_callback` once it ends.
+
+        Stop conditions are checked client-side, on the decoded text (see :mod:`novelai_api.StopCondition`).
+        Once one is met, the stream is closed, which stops the generation, and the tokens past the stop condition
+        are dropped. The trimmed text is in the ``stopper`` of the stream after the iteration.
+
         As the model accepts a complete prompt, the context building must be done before calling this function.
         Any content going beyond the tokens limit will be truncated, starting from the top.
 
@@ -437,12 +628,18 @@ class HighLevel:
         :param biases: Tokens to bias (up or down) for this generation
         :param prefix: Module to use for this generation (see :ref:`list of modules <list-of-modules>`)
         :param stop_sequences: List of strings or tokens to stop the generation at
+        :param keep_head: Tokens at the start of the prompt to keep if it has to be trimmed
+                          (see :func:`novelai_api.utils.trim_prompt`)
+        :param stop_conditions: Client-side conditions to stop the generation at (regexes, sentence or paragraph
+                                count, callables), or a :class:`StreamStopper <novelai_api.StopCondition.StreamStopper>`
         :param kwargs: Additional parameters to pass to the requests. Can also be used to overwrite existing parameters
 
-        :return: Content that has been generated
+        :return: Stream of the content that has been generated
         """
 
-        async for e in self._generate(
+        metrics = StreamMetrics(model)
+
+        gen = self._generate(
             prompt,
             model,
             preset,
@@ -451,10 +648,284 @@ class HighLevel:
             biases,
             prefix,
             stop_sequences,
+            keep_head,
             True,
+            metrics._on_response,
             **kwargs,
-        ):
-            yield json.loads(e)
+        )
+
+        stopper = self._get_stopper(model, stop_conditions)
+
+        return GenerationStream(
+            self._stream_until(gen, stopper), metrics, self._parent.stream_metrics_callback, stopper
+        )
+
+    async def generate_from_template(
+        self,
+        prompt: Union[List[int], str],
+        template: GenerationTemplate,
+        keep_head: Union[int, List[int], None] = None,
+        **kwargs,
+    ) -> Dict[str, Any]:
+        """
+        Generate text from a compiled template. The b64-encoded text is returned at once, when generation is finished.
+        See :meth:`generate` for details.
+
+        :param prompt: Context to give to the AI (raw text or list of tokens)
+        :param template: Template holding the model and the generation settings
+        :param keep_head: Tokens at the start of the prompt to keep if it has to be trimmed
+                          (see :func:`novelai_api.utils.trim_prompt`)
+        :param kwargs: Additional parameters to pass to the requests. Can also be used to overwrite existing parameters
+
+        :return: Content that has been generated
+        """
+
+        assert_type(GenerationTemplate, template=template)
+
+        params = template.build(**kwargs)
+        prompt_limit = self._get_prompt_limit(template.model, params)
+
+        async for e in self._parent.low_level.generate(prompt, template.model, params, False, prompt_limit, keep_head):
+            return e
+
+    def generate_stream_from_template(
+        self,
+        prompt: Union[List[int], str],
+        template: GenerationTemplate,
+        keep_head: Union[int, List[int], None] = None,
+        stop_conditions: Union[StreamStopper, AnyStopCondition, Iterable[AnyStopCondition], None] = None,
+        **kwargs,
+    ) -> GenerationStream:
+        """
+        Generate text from a compiled template. The text is returned one token at a time, as it is generated.
+        See :meth:`generate_stream` for details.
+
+        :param prompt: Context to give to the AI (raw text or list of tokens)
+        :param template: Template holding the model and the generation settings
+        :param keep_head: Tokens at the start of the prompt to keep if it has to be trimmed
+                          (see :func:`novelai_api.utils.trim_prompt`)
+        :param stop_conditions: Client-side conditions to stop the generation at (see :meth:`generate_stream`)
+        :param kwargs: Additional parameters to pass to the requests. Can also be used to overwrite existing parameters
+
+        :return: Stream of the content that has been generated
+        """
+
+        assert_type(GenerationTemplate, template=template)
+
+        params = template.build(**kwargs)
+        prompt_limit = self._get_prompt_limit(template.model, params)
+        metrics = StreamMetrics(template.model)
+
+        gen = self._parent.low_level.generate(
+            prompt, template.model, params, True, prompt_limit, keep_head, metrics._on_response
+        )
+
+        stopper = self._get_stopper(template.model, stop_conditions)
+
+        return GenerationStream(
+            self._stream_until(gen, stopper), metrics, self._parent.stream_metrics_callback, stopper
+        )
+
+    async def generate_long(
+        self,
+        prompt: Union[List[int], str],
+        target_tokens: int,
+        model: Model,
+        preset: Preset,
+        global_settings: GlobalSettings,
+        bad_words: Optional[Union[Iterable[BanList], BanList]] = None,
+        biases: Optional[Union[Iterable[BiasGroup], BiasGroup]] = None,
+        prefix: Optional[str] = None,
+        stop_sequences: Optional[Union[List[int], str]] = None,
+        keep_head: Union[int, List[int], None] = None,
+        stop_conditions: Union[StreamStopper, AnyStopCondition, Iterable[AnyStopCondition], None] = None,
+        **kwargs,
+    ) -> Tuple[List[int], str]:
+        """
+        Generate a long text, by chaining generations until the target number of tokens is reached.
+
+        The prompt and the generated tokens are kept in a token buffer, the output of each generation is appended to
+        it as is (without decoding and encoding it again), and the prompt of the next generation is the end of the
+        buffer, slid to the context size (see :func:`novelai_api.utils.trim_prompt`).
+        The next generation is sent as soon as the previous one is received, and the decoding and the check of the
+        stop conditions run meanwhile. If a stop condition is met, the generation in flight is cancelled.
+
+        The generation also stops if the server ended a generation early: shorter than requested (e.g. end of text),
+        or ending with one of the stop sequences.
+
+        :param prompt: Context to give to the AI (raw text or list of tokens)
+        :param target_tokens: Number of tokens to generate. The last generation can go slightly over it if
+                              generate_until_sentence is set
+        :param model: Model to use for the AI
+        :param preset: Preset to use for the generation settings
+        :param global_settings: Global settings (used for generation)
+        :param bad_words: Tokens to ban for this generation
+        :param biases: Tokens to bias (up or down) for this generation
+        :param prefix: Module to use for this generation (see :ref:`list of modules <list-of-modules>`)
+        :param stop_sequences: List of strings or tokens to stop each generation at
+        :param keep_head: Tokens at the start of the prompt to always keep in the context
+                          (see :func:`novelai_api.utils.trim_prompt`)
+        :param stop_conditions: Client-side conditions to stop the generation at (see :meth:`generate_stream`)
+        :param kwargs: Additional parameters to pass to the requests. Can also be used to overwrite existing parameters
+
+        :return: The generated tokens and text (trimmed if a stop condition is met)
+        """
+
+        if target_tokens < 1:
+            raise ValueError(f"target_tokens must be at least 1, got {target_tokens}")
+
+        stopper = stop_conditions
+        if not isinstance(stopper, StreamStopper):
+            stopper = StreamStopper(model, [] if stop_conditions is None else stop_conditions)
+
+        template = GenerationTemplate(model, preset, global_settings, bad_words, biases, prefix, stop_sequences)
+        params = template.build(**kwargs)
+        max_length = params.get("max_length", Preset.DEFAULTS["max_length"])
+        stop_sequences = [s for s in params.get("stop_sequences", []) if s]
+        # the buffer grows past the context, so it is always slid client-side (whatever trim_prompt is)
+        prompt_limit = get_prompt_limit(model, params, self._parent.subscription_tier)
+        token_size = 4 if model is Model.Erato else 2
+
+        loop = asyncio.get_running_loop()
+
+        if isinstance(prompt, str):
+            prompt = await loop.run_in_executor(None, Tokenizer.encode, model, prompt)
+
+        buffer = list(prompt)
+
+        async def generate_chunk(length: int) -> List[int]:
+            chunk_params = params
+            if length < max_length:
+                chunk_params = {**params, "max_length": length}
+                chunk_params["min_length"] = min(chunk_params.get("min_length", 1), length)
+
+            window = buffer if prompt_limit is None else trim_prompt(buffer, prompt_limit, keep_head)
+
+            async for e in self._parent.low_level.generate(window, model, chunk_params, False):
+                return b64_to_tokens(e["output"], token_size)
+
+        generated = 0
+        requests = 1
+        next_chunk: Optional[asyncio.Future] = None
+        try:
+            requested = min(target_tokens, max_length)
+            chunk = await generate_chunk(requested)
+
+            while chunk:
+                buffer.extend(chunk)
+                generated += len(chunk)
+
+                # the server stopped on its own (end of text or stop sequence)
+                ended = len(chunk) < requested or any(chunk[-len(s) :] == s for s in stop_sequences)
+
+                # send the next generation before decoding this one, so the decoding is hidden by the request
+                next_chunk = None
+                if generated < target_tokens and not ended:
+                    requested = min(target_tokens - generated, max_length)
+                    next_chunk = asyncio.ensure_future(generate_chunk(requested))
+                    requests += 1
+
+                stopped = await loop.run_in_executor(None, stopper.feed, chunk)
+                if stopped or next_chunk is None:
+                    break
+
+                chunk = await next_chunk
+        finally:
+            if next_chunk is not None and not next_chunk.done():
+                next_chunk.cancel()
+                requests -= 1
+
+        self._parent.logger.debug(f"Long generation: {generated} tokens in {requests} requests")
+
+        return stopper.tokens, stopper.text
+
+    def generate_many(
+        self,
+        requests: Iterable[Union[GenerationRequest, Tuple]],
+        concurrency: int = 4,
+    ) -> GenerationBatch:
+        """
+        Run many text generations concurrently. Requests sharing the same settings share the same compiled
+        :class:`GenerationTemplate`.
+
+        Await the returned batch to get the results in the order of the requests, or iterate over it
+        (``async for``) to get them as they complete. A failing generation doesn't stop the others,
+        its error is stored in its result.
+
+        :param requests: Generations to run. Tuples are expanded as the arguments of :class:`GenerationRequest`,
+                         e.g. (prompt, model, preset, global_settings)
+        :param concurrency: Maximum number of generations in flight
+
+        :return: The batch of generations (see :class:`GenerationBatch`)
+        """
+
+        return GenerationBatch(self, requests, concurrency)
+
+    async def generate_candidates(
+        self,
+        prompt: Union[List[int], str],
+        model: Model,
+        preset: Preset,
+        global_settings: GlobalSettings,
+        n: int = 4,
+        bad_words: Optional[Union[Iterable[BanList], BanList]] = None,
+        biases: Optional[Union[Iterable[BiasGroup], BiasGroup]] = None,
+        prefix: Optional[str] = None,
+        stop_sequences: Optional[Union[List[int], str]] = None,
+        keep_head: Union[int, List[int], None] = None,
+        rank: Optional[CandidateScorer] = None,
+        concurrency: Optional[int] = None,
+        **kwargs,
+    ) -> List[GenerationCandidate]:
+        """
+        Generate multiple candidates for the same prompt. The samples are requested concurrently
+        (see :meth:`generate_many`), so the wall-clock time is about the latency of a single generation.
+
+        The candidates that failed are left out. If all of them failed, the error of the first one is raised.
+
+        :param prompt: Context to give to the AI (raw text or list of tokens)
+        :param model: Model to use for the AI
+        :param preset: Preset to use for the generation settings
+        :param global_settings: Global settings (used for generation). Set num_logprobs to get the logprobs
+                                of the candidates
+        :param n: Number of candidates to generate
+        :param bad_words: Tokens to ban for this generation
+        :param biases: Tokens to bias (up or down) for this generation
+        :param prefix: Module to use for this generation (see :ref:`list of modules <list-of-modules>`)
+        :param stop_sequences: List of strings or tokens to stop the generation at
+        :param keep_head: Tokens at the start of the prompt to keep if it has to be trimmed
+                          (see :func:`novelai_api.utils.trim_prompt`)
+        :param rank: Function scoring the candidates, to sort them from best to worst
+                     (e.g. :func:`score_mean_logprob <novelai_api.GenerationCandidate.score_mean_logprob>`)
+        :param concurrency: Maximum number of samples in flight (all of them at once, if None)
+        :param kwargs: Additional parameters to pass to the requests. Can also be used to overwrite existing parameters
+
+        :return: The candidates, sorted by score if rank is set, in request order otherwise
+        """
+
+        if n < 1:
+            raise ValueError(f"n must be at least 1, got {n}")
+
+        if isinstance(prompt, str):
+            prompt = await asyncio.get_running_loop().run_in_executor(None, Tokenizer.encode, model, prompt)
+
+        # the same template is shared by all the samples, so the settings are compiled once
+        template = GenerationTemplate(model, preset, global_settings, bad_words, biases, prefix, stop_sequences)
+        requests = [GenerationRequest(prompt, keep_head=keep_head, template=template, **kwargs) for _ in range(n)]
+
+        results = await self.generate_many(requests, n if concurrency is None else concurrency)
+
+        candidates = [GenerationCandidate(r.index, model, r.result) for r in results if r.succeeded]
+        if not candidates:
+            raise results[0].error
+
+        if rank is not None:
+            for candidate in candidates:
+                candidate.score = rank(candidate)
+
+            candidates.sort(key=lambda c: c.score, reverse=True)
+
+        return candidates
 
     async def generate_image(
         self,
@@ -1,4 +1,5 @@
 import base64
+import codecs
 import copy
 import enum
 import io
@@ -6,7 +7,7 @@ import json
 import operator
 import os
 import zipfile
-from typing import Any, AsyncIterator, Dict, List, NoReturn, Optional, Tuple, Union
+from typing import Any, AsyncIterator, Callable, Dict, List, NoReturn, Optional, Tuple, Union
 from urllib.parse import quote, urlencode
 
 from aiohttp import ClientSession
@@ -16,10 +17,10 @@ from novelai_api.DirectorToolsPreset import DirectorToolsPreset, RequestType
 from novelai_api.ImagePreset import ControlNetModel, ImageGenerationType, ImageModel
 from novelai_api.NovelAIError import NovelAIError
 from novelai_api.Preset import Model
-from novelai_api.python_utils import NoneType, assert_len, assert_type
+from novelai_api.python_utils import NoneType, aclosing, assert_len, assert_type
 from novelai_api.SchemaValidator import SchemaValidator
 from novelai_api.Tokenizer import Tokenizer
-from novelai_api.utils import tokens_to_b64
+from novelai_api.utils import tokens_to_b64, trim_prompt
 
 PRINT_WITH_PARAMETERS = os.environ.get("NAI_PRINT", False)
 
@@ -124,9 +125,15 @@ class LowLevel:
         sse_data = {"data": []}
         modified = False
 
+        # a chunk can end in the middle of a multibyte character
+        decoder = codecs.getincrementaldecoder("utf-8")()
+
         partial_data: str = ""
         async for chunk in rsp.content.iter_any():  # type: bytes
-            for line in f"{partial_data}{chunk.decode('utf-8')}".splitlines(True):
+            data = f"{partial_data}{decoder.decode(chunk)}"
+            partial_data = ""
+
+            for line in data.splitlines(True):
                 if line in ("", "\n"):
                     # empty line = dispatch event if modified
                     if modified:
@@ -213,14 +220,22 @@ class LowLevel:
         endpoint: str,
         data: Optional[Union[Dict[str, Any], str]] = None,
         custom_base_address: Union[str, None] = None,
+        authenticated: bool = True,
+        on_response: Optional[Callable[[ClientResponse], None]] = None,
     ):
         """
         Send request with support for data streaming
 
+        If the access token expired (or the request fails with 401), the token is refreshed through
+        :attr:`NovelAIAPI.token_manager <novelai_api.NovelAI_API.NovelAIAPI.token_manager>` when possible,
+        and the request is sent again
+
         :param method: Method of the request (get, post, delete)
         :param endpoint: Endpoint of the request
         :param data: Data to pass to the method if needed
         :param custom_base_address: Custom address to use for the request
+        :param authenticated: Whether the request uses the access token (False for login requests)
+        :param on_response: Function called when the response headers are received, before its content is read
         """
 
         if PRINT_WITH_PARAMETERS:
@@ -231,6 +246,10 @@ class LowLevel:
 
         url = f"{custom_base_address}{endpoint}"
 
+        token_manager = self._parent.token_manager
+        if authenticated:
+            await token_manager.ensure_valid()
+
         is_sync = self._parent.session is None
         session = ClientSession() if is_sync else self._parent.session
 
@@ -248,9 +267,21 @@ class LowLevel:
             kwargs["proxy_auth"] = self._parent.proxy_auth
 
         try:
-            async with session.request(method, url, **kwargs) as rsp:
-                async for e in self._parse_response(rsp):
-                    yield rsp, e
+            # second attempt only happens after refreshing the token
+            for attempt in range(2):
+                used_token = token_manager.token
+
+                async with session.request(method, url, **kwargs) as rsp:
+                    if not (authenticated and rsp.status == 401 and attempt == 0 and token_manager.can_refresh):
+                        if on_response is not None:
+                            on_response(rsp)
+
+                        async for e in self._parse_response(rsp):
+                            yield rsp, e
+
+                        break
+
+                await token_manager.refresh(used_token)
         except Exception as e:
             raise e
         finally:
@@ -293,7 +324,7 @@ class LowLevel:
         if giftkey is not None:
             data["giftkey"] = giftkey
 
-        async for rsp, content in self.request("post", "/user/register", data):
+        async for rsp, content in self.request("post", "/user/register", data, authenticated=False):
             self._treat_response_object(rsp, content, 201)
 
             if self.is_schema_validation_enabled:
@@ -313,7 +344,7 @@ class LowLevel:
         assert_type(str, access_key=access_key)
         assert_len(64, access_key=access_key)
 
-        async for rsp, content in self.request("post", "/user/login", {"key": access_key}):
+        async for rsp, content in self.request("post", "/user/login", {"key": access_key}, authenticated=False):
             self._treat_response_object(rsp, content, 201)
 
             if self.is_schema_validation_enabled:
@@ -397,7 +428,7 @@ class LowLevel:
 
         assert_type(str, email=email)
 
-        async for rsp, content in self.request("post", "/user/recovery/request", {"email": email}):
+        async for rsp, content in self.request("post", "/user/recovery/request", {"email": email}, authenticated=False):
             return self._treat_response_bool(rsp, content, 202)
 
     async def recover_account(self, recovery_token: str, new_key: str, delete_content: bool = False) -> Dict[str, Any]:
@@ -420,7 +451,7 @@ class LowLevel:
             "deleteContent": delete_content,
         }
 
-        async for rsp, content in self.request("post", "/user/recovery/recover", data):
+        async for rsp, content in self.request("post", "/user/recovery/recover", data, authenticated=False):
             self._treat_response_object(rsp, content, 201)
 
             if self.is_schema_validation_enabled:
@@ -645,7 +676,16 @@ class LowLevel:
         async for rsp, content in self.request("post", "/user/subscription/change", {"newSubscriptionPlan": new_plan}):
             return self._treat_response_bool(rsp, content, 200)
 
-    async def generate(self, prompt: Union[List[int], str], model: Model, params: Dict[str, Any], stream: bool = False):
+    async def generate(
+        self,
+        prompt: Union[List[int], str],
+        model: Model,
+        params: Dict[str, Any],
+        stream: bool = False,
+        prompt_limit: Optional[int] = None,
+        keep_head: Union[int, List[int], None] = None,
+        on_response: Optional[Callable[[ClientResponse], None]] = None,
+    ):
         """
         Generate text with streaming support. As the model accepts a complete prompt,
         the context building must be done before calling this function.
@@ -655,6 +695,9 @@ class LowLevel:
         :param model: Model of the AI
         :param params: Generation parameters
         :param stream: Use data streaming for the response
+        :param prompt_limit: Trim the prompt to this number of tokens before sending it (None to send it whole)
+        :param keep_head: Tokens at the start of the prompt to keep when trimming (see :func:`utils.trim_prompt`)
+        :param on_response: Function called when the response headers are received (e.g. for the time to first byte)
 
         :return: Generated output
         """
@@ -667,6 +710,9 @@ class LowLevel:
         if isinstance(prompt, str):
             prompt = Tokenizer.encode(model, prompt)
 
+        if prompt_limit is not None:
+            prompt = trim_prompt(prompt, prompt_limit, keep_head)
+
         token_size = 4 if model is Model.Erato else 2
         prompt = tokens_to_b64(prompt, token_size)
         data = {"input": prompt, "model": model.value, "parameters": params}
@@ -681,10 +727,12 @@ class LowLevel:
             base_address = GENERAL_API_ADDRESS
             status = 201
 
-        async for rsp, content in self.request("post", endpoint, data, base_address):
-            self._treat_response_object(rsp, content, status)
+        # the stream is closed as soon as the caller stops iterating, which stops the generation server-side
+        async with aclosing(self.request("post", endpoint, data, base_address, on_response=on_response)) as gen:
+            async for rsp, content in gen:
+                self._treat_response_object(rsp, content, status)
 
-            yield content
+                yield content
 
     async def generate_image(
         self, prompt: str, model: ImageModel, action: ImageGenerationType, parameters: Dict[str, Any]
@@ -89,6 +89,14 @@ def build_docs():
     _run("make", "html", cwd=str(ROOT / "docs"))
 
 
+def build_presets():
+    # imported here, as it loads the whole package
+    from novelai_api.Preset import PRESETS_BUNDLE_PATH, build_preset_bundle  # pylint: disable=C0415
+
+    build_preset_bundle()
+    print(f"Official presets packed into {PRESETS_BUNDLE_PATH}")
+
+
 def bump_version():
     bump_types = ["major", "minor", "patch"]
 
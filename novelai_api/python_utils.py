@@ -1,6 +1,7 @@
 import inspect
 import operator
-from typing import Callable, Iterable, Union
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, Callable, Iterable, Union
 
 NoneType: type = type(None)
 
@@ -47,3 +48,17 @@ def expand_kwargs(keys: Iterable[str], types: Union[Iterable[type], Iterable[typ
         return func
 
     return wrapper
+
+
+@asynccontextmanager
+async def aclosing(agen: AsyncGenerator):
+    """
+    Close the async generator when leaving the context (contextlib.aclosing, which needs python 3.10).
+    Breaking out of an async for doesn't close the generator, so the resources it holds (e.g. an HTTP stream)
+    would stay open until it is garbage collected
+    """
+
+    try:
+        yield agen
+    finally:
+        await agen.aclose()
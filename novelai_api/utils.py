@@ -1,26 +1,52 @@
 import json
 from base64 import b64decode, b64encode, urlsafe_b64encode
+from enum import Enum
 from hashlib import blake2b
 from typing import Any, AsyncGenerator, AsyncIterable, Dict, Iterable, List, Optional, Tuple, Union
 from zlib import MAX_WBITS, Z_BEST_COMPRESSION
 from zlib import compressobj as deflate_obj
 from zlib import decompress as inflate
 
-import argon2
-from msgpackr import Unpacker
 from nacl.exceptions import CryptoError
 from nacl.secret import SecretBox
 
 from novelai_api.Keystore import Keystore
-from novelai_api.Msgpackr_Extensions import Ext20, Ext30, Ext31, Ext40, Ext41, Ext42
 from novelai_api.NovelAIError import NovelAIError
-from novelai_api.Preset import Model, Preset
+from novelai_api.Preset import Model, Preset, get_context_size
 from novelai_api.python_utils import assert_type
 from novelai_api.Tokenizer import Tokenizer
 
-unpacker = Unpacker()
-unpacker.register_extensions(Ext20, Ext30, Ext31, Ext40, Ext41, Ext42)
-unpacker_state = unpacker.export_state()
+try:
+    import deflate as libdeflate
+except ImportError:
+    libdeflate = None
+
+try:
+    from zlib_ng import zlib_ng
+except ImportError:
+    zlib_ng = None
+
+# msgpackr unpacker for the story documents, created on first use
+_unpacker: Optional[Tuple[Any, Any]] = None
+
+
+def _unpack_document(document: bytes) -> Any:
+    global _unpacker  # pylint: disable=W0603
+
+    if _unpacker is None:
+        # imported here, as documents are only unpacked on demand
+        from msgpackr import Unpacker  # pylint: disable=C0415
+
+        from novelai_api.Msgpackr_Extensions import Ext20, Ext30, Ext31, Ext40, Ext41, Ext42  # pylint: disable=C0415
+
+        unpacker = Unpacker()
+        unpacker.register_extensions(Ext20, Ext30, Ext31, Ext40, Ext41, Ext42)
+        _unpacker = (unpacker, unpacker.export_state())
+
+    unpacker, state = _unpacker
+    unpacker.restore_state(state)
+
+    return unpacker.unpack(document)
 
 
 # API utils
@@ -32,6 +58,9 @@ def argon_hash(email: str, password: str, size: int, domain: str) -> str:
     blake.update(pre_salt.encode())
     salt = blake.digest()
 
+    # imported here, as it is only needed on login
+    import argon2  # pylint: disable=C0415
+
     raw = argon2.low_level.hash_secret_raw(
         password.encode(),
         salt,
@@ -66,6 +95,106 @@ def get_encryption_key(email: str, password: str) -> bytes:
 COMPRESSION_PREFIX = b"\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01"
 
 
+class DeflateBackend(Enum):
+    """
+    Implementation used to deflate user data. All of them produce raw deflate streams that the web client can read
+    """
+
+    #: Standard library zlib. Always available
+    Zlib = "zlib"
+    #: zlib-ng bindings (``pip install zlib-ng``). Same levels as zlib, but faster
+    ZlibNg = "zlib-ng"
+    #: libdeflate bindings (``pip install deflate``). Levels go up to 12, fastest for whole-buffer compression
+    Libdeflate = "libdeflate"
+
+
+class CompressionPolicy:
+    """
+    Compression settings for the user data that is deflated before upload (stories, storycontent, presets...).
+
+    The default policy (zlib at Z_BEST_COMPRESSION) produces the same output as previous versions.
+    Lower levels, or a faster backend, trade a slightly bigger payload for a much faster compression.
+    """
+
+    _MAX_LEVEL = {
+        DeflateBackend.Zlib: 9,
+        DeflateBackend.ZlibNg: 9,
+        DeflateBackend.Libdeflate: 12,
+    }
+
+    #: Compression level (0-9 for zlib and zlib-ng, 0-12 for libdeflate)
+    level: int
+    #: Implementation used for deflating
+    backend: DeflateBackend
+
+    def __init__(self, level: int = Z_BEST_COMPRESSION, backend: DeflateBackend = DeflateBackend.Zlib):
+        """
+        :param level: Compression level
+        :param backend: Implementation to use for deflating. It must be installed
+        """
+
+        if not isinstance(backend, DeflateBackend):
+            raise ValueError(f"Expected type 'DeflateBackend' for backend, but got type '{type(backend)}'")
+
+        if not self.is_available(backend):
+            raise ValueError(f"Backend '{backend.value}' is not installed")
+
+        max_level = self._MAX_LEVEL[backend]
+        if not isinstance(level, int) or not 0 <= level <= max_level:
+            raise ValueError(f"Expected a level between 0 and {max_level} for backend '{backend.value}', got {level}")
+
+        self.level = level
+        self.backend = backend
+
+    @staticmethod
+    def is_available(backend: DeflateBackend) -> bool:
+        """
+        Check if the backend can be used in the current environment
+        """
+
+        if backend is DeflateBackend.Libdeflate:
+            return libdeflate is not None
+
+        if backend is DeflateBackend.ZlibNg:
+            return zlib_ng is not None
+
+        return True
+
+    @classmethod
+    def fastest(cls, level: int = 6) -> "CompressionPolicy":
+        """
+        Create a policy using the fastest backend installed
+
+        :param level: Compression level, on the zlib scale (0-9)
+        """
+
+        for backend in (DeflateBackend.Libdeflate, DeflateBackend.ZlibNg):
+            if cls.is_available(backend):
+                return cls(level, backend)
+
+        return cls(level, DeflateBackend.Zlib)
+
+    def compress(self, data: bytes) -> bytes:
+        """
+        Deflate the data into a raw deflate stream (no header, no checksum)
+        """
+
+        if self.backend is DeflateBackend.Libdeflate:
+            return libdeflate.deflate_compress(data, self.level)
+
+        compressobj = zlib_ng.compressobj if self.backend is DeflateBackend.ZlibNg else deflate_obj
+
+        deflater = compressobj(self.level, wbits=-MAX_WBITS)
+        return deflater.compress(data) + deflater.flush()
+
+    def __repr__(self) -> str:
+        return f"CompressionPolicy(level={self.level}, backend={self.backend.value})"
+
+
+#: Compression policy used when none is provided
+DEFAULT_COMPRESSION = CompressionPolicy()
+
+
 def decrypt_data(
     data: Union[str, bytes], key: bytes, nonce: Optional[bytes] = None
 ) -> Union[Tuple[str, bytes, bool], Tuple[None, None, bool]]:
@@ -98,6 +227,7 @@ def encrypt_data(
     key: bytes,
     nonce: Optional[bytes] = None,
     is_compressed: bool = False,
+    compression: Optional[CompressionPolicy] = None,
 ) -> bytes:
     box = SecretBox(key)
 
@@ -106,8 +236,7 @@ def encrypt_data(
 
     # NOTE: zlib results in different data than the library used by NAI, but they are fully compatible
     if is_compressed:
-        deflater = deflate_obj(Z_BEST_COMPRESSION, wbits=-MAX_WBITS)
-        data = deflater.compress(data) + deflater.flush()
+        data = (compression or DEFAULT_COMPRESSION).compress(data)
 
     data = bytes(box.encrypt(data, nonce))
 
@@ -159,13 +288,21 @@ def decompress_user_data(items: Union[List[Dict[str, Any]], Dict[str, Any]]):
             item["decrypted"] = False
 
 
-def compress_user_data(items: Union[List[Dict[str, Any]], Dict[str, Any]]):
+def compress_user_data(
+    items: Union[List[Dict[str, Any]], Dict[str, Any]], compression: Optional[CompressionPolicy] = None
+):
     """
     Compress the data of each item in :ref: items
     Doesn't encrypt, but does a UTF8 to b64 translation
     Must have been decompressed by decompress_user_data()
+
+    :param items: Item or list of items to compress
+    :param compression: Compression policy to use (None for the default policy)
     """
 
+    if compression is None:
+        compression = DEFAULT_COMPRESSION
+
     if not isinstance(items, (list, tuple)):
         items = [items]
 
@@ -182,9 +319,7 @@ def compress_user_data(items: Union[List[Dict[str, Any]], Dict[str, Any]]):
 
                 if "compressed" in item:
                     if item["compressed"]:
-                        deflater = deflate_obj(Z_BEST_COMPRESSION, wbits=-MAX_WBITS)
-                        data = deflater.compress(data) + deflater.flush()
-                        data = COMPRESSION_PREFIX + data
+                        data = COMPRESSION_PREFIX + compression.compress(data)
                     del item["compressed"]
 
                 item["data"] = b64encode(data).decode()
@@ -240,8 +375,7 @@ def decrypt_user_data(
 
                 document = data.get("document")
                 if uncompress_document and isinstance(document, str):
-                    unpacker.restore_state(unpacker_state)
-                    data["document"] = unpacker.unpack(b64decode(document))
+                    data["document"] = _unpack_document(b64decode(document))
 
                 continue
 
@@ -251,7 +385,49 @@ def decrypt_user_data(
         item["decrypted"] = False
 
 
-def encrypt_user_data(items: Union[List[Dict[str, Any]], Dict[str, Any]], keystore: Keystore):
+def _encrypt_item_data(
+    item: Dict[str, Any],
+    i: int,
+    keystore: Keystore,
+    compression: Optional[CompressionPolicy],
+    data: Optional[str],
+) -> str:
+    if "data" not in item:
+        raise ValueError(f"Expected key 'data' in item #{i} of 'items'")
+    if "meta" not in item:
+        raise ValueError(f"Expected key 'meta' in item #{i} of 'items'")
+    if "nonce" not in item:
+        raise ValueError(f"Expected key 'nonce' in item #{i} of 'items'")
+    if "compressed" not in item:
+        raise ValueError(f"Expected key 'compressed' in item #{i} of 'items'")
+
+    meta = item["meta"]
+    if meta not in keystore:
+        raise NovelAIError("<UNKNOWN>", -1, f"Meta of item #{i} ({meta}) missing from keystore")
+
+    key = keystore[meta]
+
+    if data is None:
+        data = serialize_user_data(item)
+
+    return b64encode(encrypt_data(data, key, item["nonce"], item["compressed"], compression)).decode()
+
+
+def serialize_user_data(item: Dict[str, Any]) -> str:
+    """
+    Serialize the data of a decrypted item, as it is encrypted
+
+    :param item: Item to serialize the data of
+    """
+
+    return json.dumps(item["data"], separators=(",", ":"), ensure_ascii=False)
+
+
+def encrypt_user_data(
+    items: Union[List[Dict[str, Any]], Dict[str, Any]],
+    keystore: Keystore,
+    compression: Optional[CompressionPolicy] = None,
+):
     """
     Encrypt the data of each item in :ref: items
     If an item has already been encrypted, it won't be encrypted a second time
@@ -259,6 +435,7 @@ def encrypt_user_data(items: Union[List[Dict[str, Any]], Dict[str, Any]], keysto
 
     :param items: Item or list of items to encrypt
     :param keystore: Keystore retrieved with the get_keystore method
+    :param compression: Compression policy to use for compressed items (None for the default policy)
     """
 
     # 1 item
@@ -271,29 +448,41 @@ def encrypt_user_data(items: Union[List[Dict[str, Any]], Dict[str, Any]], keysto
 
         if "decrypted" in item:
             if item["decrypted"]:
-                if "data" not in item:
-                    raise ValueError(f"Expected key 'data' in item #{i} of 'items'")
-                if "meta" not in item:
-                    raise ValueError(f"Expected key 'meta' in item #{i} of 'items'")
-                if "nonce" not in item:
-                    raise ValueError(f"Expected key 'nonce' in item #{i} of 'items'")
-                if "compressed" not in item:
-                    raise ValueError(f"Expected key 'compressed' in item #{i} of 'items'")
+                item["data"] = _encrypt_item_data(item, i, keystore, compression, None)
+                del item["nonce"]
+                del item["compressed"]
 
-                meta = item["meta"]
-                if meta not in keystore:
-                    raise NovelAIError("<UNKNOWN>", -1, f"Meta of item #{i} ({meta}) missing from keystore")
+            del item["decrypted"]
 
-                key = keystore[meta]
 
-                data = json.dumps(item["data"], separators=(",", ":"), ensure_ascii=False)
-                data = b64encode(encrypt_data(data, key, item["nonce"], item["compressed"])).decode()
+def encrypt_user_data_copy(
+    item: Dict[str, Any],
+    keystore: Keystore,
+    compression: Optional[CompressionPolicy] = None,
+    data: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Encrypt the data of an item into a new item, leaving the original one decrypted (unlike encrypt_user_data,
+    there is no need to deepcopy the item to keep it)
 
-                item["data"] = data
-                del item["nonce"]
-                del item["compressed"]
+    :param item: Item to encrypt
+    :param keystore: Keystore retrieved with the get_keystore method
+    :param compression: Compression policy to use for compressed items (None for the default policy)
+    :param data: Serialized data of the item (see serialize_user_data), to encrypt a snapshot of the item.
+                 The data of the item is serialized if None
 
-            del item["decrypted"]
+    :return: The encrypted item
+    """
+
+    assert_type(dict, item=item)
+
+    encrypted = {k: v for k, v in item.items() if k not in ("data", "nonce", "compressed", "decrypted")}
+    if item.get("decrypted"):
+        encrypted["data"] = _encrypt_item_data(item, 0, keystore, compression, data)
+    else:
+        encrypted["data"] = item["data"]
+
+    return encrypted
 
 
 def link_content_to_story(
@@ -382,6 +571,67 @@ def extract_preset_data(presets: List[Dict[str, Any]]) -> Dict[str, Preset]:
     return preset_list
 
 
+#: Tokens generated past max_length when generate_until_sentence is enabled, that must fit in the context
+GENERATE_UNTIL_SENTENCE_TOKENS = 20
+
+
+def get_prompt_limit(
+    model: Model, params: Dict[str, Any], tier: Optional[int] = None, context_size: Optional[int] = None
+) -> Optional[int]:
+    """
+    Get the maximum number of prompt tokens the model will use, for the given generation parameters.
+    The limit is the context size, minus max_length, minus 20 if generate_until_sentence is enabled
+
+    :param model: Model used for the generation
+    :param params: Parameters of the generation
+    :param tier: Subscription tier (None for the largest context size of the model)
+    :param context_size: Context size to use instead of the one of the model and tier
+
+    :return: The limit (in tokens), or None if the context size of the model is unknown
+    """
+
+    if context_size is None:
+        context_size = get_context_size(model, tier)
+        if context_size is None:
+            return None
+
+    limit = context_size - params.get("max_length", Preset.DEFAULTS["max_length"])
+    if params.get("generate_until_sentence", False):
+        limit -= GENERATE_UNTIL_SENTENCE_TOKENS
+
+    return max(limit, 0)
+
+
+def trim_prompt(tokens: List[int], limit: int, keep_head: Union[int, List[int], None] = None) -> List[int]:
+    """
+    Trim the prompt to the limit, by removing tokens from the top (as the server does)
+
+    :param tokens: Tokenized prompt
+    :param limit: Maximum number of tokens
+    :param keep_head: Tokens at the start of the prompt that must be kept (e.g. preamble).
+                      Either a number of tokens, or the tokens themselves (only kept if the prompt starts with them)
+
+    :return: The trimmed prompt (the prompt itself if it fits)
+    """
+
+    if len(tokens) <= limit:
+        return tokens
+
+    head_size = 0
+    if isinstance(keep_head, int):
+        head_size = keep_head
+    elif keep_head and tokens[: len(keep_head)] == keep_head:
+        head_size = len(keep_head)
+
+    # the head can't be kept if it doesn't leave room for anything else
+    if limit <= head_size:
+        head_size = 0
+
+    tail_size = limit - head_size
+
+    return tokens[:head_size] + tokens[len(tokens) - tail_size :]
+
+
 def tokenize_if_not(model: Model, o: Union[str, List[int]]) -> List[int]:
     """
     Tokenize the string if it is not already tokenized
@@ -10,7 +10,6 @@ import pytest
 from aiohttp import ClientConnectionError, ClientPayloadError, ClientSession
 
 from novelai_api import NovelAIAPI, NovelAIError
-from novelai_api.utils import get_encryption_key
 
 
 class API:
@@ -48,7 +47,7 @@ class API:
 
     @property
     def encryption_key(self):
-        return get_encryption_key(self._username, self._password)
+        return self.api.key_derivation.get_encryption_key(self._username, self._password)
 
     def __enter__(self) -> NoReturn:
         raise TypeError("Use async with instead")
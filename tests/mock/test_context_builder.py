@@ -0,0 +1,137 @@
+"""
+Tests of the assembly of the context of a story
+"""
+
+import pytest
+
+from novelai_api.ContextBuilder import ContextBuilder, ContextEntry, get_activated_lore
+from novelai_api.Preset import Model
+from novelai_api.StoryText import StoryText
+from novelai_api.Tokenizer import Tokenizer
+
+MODEL = Model.Kayra
+
+STORY_CONFIG = {"prefix": "", "suffix": "", "trimDirection": "trimTop", "maximumTrimType": "sentence"}
+
+LINES = [f"Line {i} of the story. It has two sentences." for i in range(200)]
+
+
+def _story(lines=LINES) -> StoryText:
+    return StoryText([{"data": "\n".join(lines), "origin": "root"}])
+
+
+def _decode(tokens) -> str:
+    return Tokenizer.decode(MODEL, tokens)
+
+
+def test_story_fits():
+    builder = ContextBuilder(MODEL)
+    story = _story(LINES[:5])
+
+    context = builder.build(story, STORY_CONFIG, [], 2048)
+    assert _decode(context) == str(story)
+
+
+@pytest.mark.parametrize("size", [100, 333, 1000])
+def test_story_trimmed_to_budget(size: int):
+    builder = ContextBuilder(MODEL)
+    story = _story()
+
+    context = builder.build(story, STORY_CONFIG, [], size)
+    text = _decode(context)
+
+    assert len(context) <= size
+    assert str(story).endswith(text)
+    # trimmed by sentence, so not much of the budget is lost
+    assert size - 20 <= len(context)
+
+
+def test_entry_budget_and_insertion():
+    builder = ContextBuilder(MODEL)
+
+    memory = ContextEntry("The memory.", {"insertionPosition": 0, "budgetPriority": 800}, "memory")
+    note = ContextEntry(
+        "[ Author's note ]",
+        {"insertionPosition": -2, "budgetPriority": -400, "reservedTokens": 10},
+        "an",
+    )
+    lore = ContextEntry(
+        " ".join(LINES[:50]),
+        {"insertionPosition": 1, "budgetPriority": 600, "tokenBudget": 30, "maximumTrimType": "token"},
+        "lore",
+    )
+
+    context = builder.build(_story(), STORY_CONFIG, [memory, note, lore], 500)
+    text = _decode(context)
+
+    assert len(context) <= 500
+    assert text.startswith("The memory.\n")
+    # the note has the lowest priority, but its tokens are reserved
+    assert "[ Author's note ]\n" in text
+    assert text.index("Line 198") < text.index("[ Author's note ]") < text.index("Line 199")
+    # the lore is cut to its budget, and inserted after the memory
+    assert "Line 0 of the story" in text
+    assert "Line 5 of" not in text
+    assert text.index("Line 0 of the story") > text.index("The memory.")
+
+
+def test_entry_fraction_budget():
+    builder = ContextBuilder(MODEL)
+
+    entry = ContextEntry(" ".join(LINES[:50]), {"tokenBudget": 0.1, "maximumTrimType": "token"}, "entry")
+    context = builder.build(_story(LINES[:1]), STORY_CONFIG, [entry], 1000)
+
+    assert len(context) <= len(Tokenizer.encode(MODEL, LINES[0])) + 100
+
+
+def test_do_not_trim_entry_dropped():
+    builder = ContextBuilder(MODEL)
+
+    entry = ContextEntry(" ".join(LINES[:50]), {"tokenBudget": 10, "trimDirection": "doNotTrim"}, "entry")
+    context = builder.build(_story(LINES[:1]), STORY_CONFIG, [entry], 1000)
+
+    assert _decode(context) == LINES[0]
+
+
+def test_activated_lore():
+    entries = [
+        {"text": "a", "keys": ["dragon"]},
+        {"text": "b", "keys": [r"/kn[i]ght/i"]},
+        {"text": "c", "keys": ["castle"], "searchRange": 5},
+        {"text": "d", "keys": [], "forceActivation": True},
+        {"text": "e", "keys": ["dragon"], "enabled": False},
+    ]
+    story = StoryText([{"data": "The Dragon saw a KNIGHT near the castle. The end.", "origin": "root"}])
+
+    assert [e["text"] for e in get_activated_lore(entries, story)] == ["a", "b", "d"]
+
+
+def test_invalid_regex_key():
+    entries = [{"text": "a", "keys": ["/[unclosed/"]}, {"text": "b", "keys": ["/dragon/"]}]
+    story = StoryText([{"data": "The dragon and the /[unclosed/ bracket.", "origin": "root"}])
+
+    assert [e["text"] for e in get_activated_lore(entries, story)] == ["a", "b"]
+
+
+@pytest.mark.parametrize("budget", [1, 1.0])
+def test_whole_context_budget(budget):
+    builder = ContextBuilder(MODEL)
+
+    context = builder.build(_story(), {**STORY_CONFIG, "tokenBudget": budget}, [], 1000)
+    assert 980 <= len(context) <= 1000
+
+
+def test_story_default_config():
+    builder = ContextBuilder(MODEL)
+    story = _story()
+
+    text = _decode(builder.build(story, {}, [], 300))
+
+    # the end of the story is kept, and nothing is added to it
+    assert str(story).endswith(text)
+    assert text.endswith("Line 199 of the story. It has two sentences.")
+
+
+def test_empty_context_size():
+    with pytest.raises(ValueError):
+        ContextBuilder(MODEL).build(_story(), STORY_CONFIG, [], 0)
@@ -0,0 +1,123 @@
+"""
+Tests of the columnar storage of the history of a story
+"""
+
+import random
+from typing import Any, Dict, List
+
+import pytest
+
+from novelai_api.DatablockTree import DatablockTree
+
+
+def _random_tree(seed: int, size: int = 100) -> DatablockTree:
+    rng = random.Random(seed)
+
+    tree = DatablockTree()
+    tree.append(-1, "root", 0, 0, {"data": "Once", "origin": "root"}, 0)
+    for i in range(1, size):
+        removed = [{"data": f"r{i}", "origin": "edit"}] if rng.random() < 0.2 else None
+        tree.append(
+            rng.randrange(i),
+            rng.choice(["ai", "edit", "user"]),
+            rng.randint(0, 10),
+            rng.randint(10, 20),
+            {"data": rng.choice(["a", "b", "c"]), "origin": "ai"},
+            rng.randint(0, 5),
+            removed,
+            rng.random() < 0.5,
+        )
+
+    return tree
+
+
+def _path(blocks: List[Dict[str, Any]], index: int) -> List[Dict[str, Any]]:
+    # blocks from the root to the block, without their links, to compare them across renumbering
+    path = []
+    while 0 <= index:
+        block = blocks[index]
+        path.append({k: v for k, v in block.items() if k not in ("nextBlock", "prevBlock")})
+        index = block["prevBlock"]
+
+    return path
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_json_round_trip(seed: int):
+    blocks = _random_tree(seed).to_json()
+    blocks[3]["unknownKey"] = [1, 2]
+
+    assert DatablockTree.from_json(blocks).to_json() == blocks
+
+
+def test_from_json_children_order():
+    blocks = _random_tree(0, 3).to_json()
+    blocks[0]["nextBlock"] = [2, 1]
+    blocks[1]["prevBlock"] = blocks[2]["prevBlock"] = 0
+    blocks[1]["nextBlock"] = blocks[2]["nextBlock"] = []
+
+    tree = DatablockTree.from_json(blocks)
+    assert list(tree.children(0)) == [2, 1]
+    assert tree.last_child(0) == 1
+
+
+@pytest.mark.parametrize("next_block", [[5], [1, 1]])
+def test_from_json_invalid_links(next_block: List[int]):
+    blocks = _random_tree(0, 2).to_json()
+    blocks[0]["nextBlock"] = next_block
+
+    with pytest.raises(ValueError):
+        DatablockTree.from_json(blocks)
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("depth", [0, 2])
+def test_compact_mapping(seed: int, depth: int):
+    tree = _random_tree(seed)
+    blocks = tree.to_json()
+
+    current = random.Random(seed).randrange(len(tree))
+    mapping = tree.compact(current, depth)
+    compacted = tree.to_json()
+
+    kept = [i for i, new in enumerate(mapping) if 0 <= new]
+    assert [mapping[i] for i in kept] == list(range(len(tree)))
+
+    # the path to the current block and the blocks after it are kept as is
+    assert _path(compacted, mapping[current]) == _path(blocks, current)
+
+    node = blocks[current]["prevBlock"]
+    while 0 <= node:
+        assert 0 <= mapping[node]
+        node = blocks[node]["prevBlock"]
+
+    for i in kept:
+        for child in blocks[i]["nextBlock"]:
+            if i == current or 0 <= mapping[child]:
+                assert mapping[child] in compacted[mapping[i]]["nextBlock"]
+
+    if depth == 0:
+        # only the path to the current block and its descendants are left
+        expected = set()
+        stack = [current]
+        while stack:
+            node = stack.pop()
+            expected.add(node)
+            stack.extend(blocks[node]["nextBlock"])
+
+        node = blocks[current]["prevBlock"]
+        while 0 <= node:
+            expected.add(node)
+            node = blocks[node]["prevBlock"]
+
+        assert set(kept) == expected
+
+
+def test_compact_invalid():
+    tree = _random_tree(0, 3)
+
+    with pytest.raises(ValueError):
+        tree.compact(3)
+
+    with pytest.raises(ValueError):
+        tree.compact(0, -1)
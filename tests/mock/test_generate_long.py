@@ -0,0 +1,80 @@
+"""
+Tests of the chaining of generations of HighLevel.generate_long, with a fake low level API
+"""
+
+import logging
+from typing import Any, Dict, List
+
+from novelai_api._high_level import HighLevel
+from novelai_api.GlobalSettings import GlobalSettings
+from novelai_api.Preset import Model, Preset
+from novelai_api.utils import get_prompt_limit, tokens_to_b64
+
+
+class FakeLowLevel:
+    def __init__(self, outputs: List[List[int]]):
+        self.outputs = list(outputs)
+        self.prompts: List[List[int]] = []
+        self.params: List[Dict[str, Any]] = []
+
+    async def generate(self, prompt: List[int], model: Model, params: Dict[str, Any], stream: bool):
+        self.prompts.append(list(prompt))
+        self.params.append(params)
+
+        yield {"output": tokens_to_b64(self.outputs.pop(0), 2)}
+
+
+class FakeAPI:
+    def __init__(self, outputs: List[List[int]]):
+        self.logger = logging.getLogger("test_generate_long")
+        self.trim_prompt = False
+        self.subscription_tier = 3
+        self.low_level = FakeLowLevel(outputs)
+
+
+def _preset() -> Preset:
+    preset = Preset("test", Model.Kayra)
+    preset["max_length"] = 10
+
+    return preset
+
+
+async def test_chunks_until_target():
+    api = FakeAPI([[300] * 10, [301] * 10, [302] * 5])
+
+    tokens, _ = await HighLevel(api).generate_long([1] * 10, 25, Model.Kayra, _preset(), GlobalSettings())
+
+    assert tokens == [300] * 10 + [301] * 10 + [302] * 5
+    assert [p["max_length"] for p in api.low_level.params] == [10, 10, 5]
+    assert [len(p) for p in api.low_level.prompts] == [10, 20, 30]
+
+
+async def test_prompt_slid_without_trim_prompt():
+    api = FakeAPI([[300] * 10, [301] * 10])
+    preset = _preset()
+    limit = get_prompt_limit(Model.Kayra, {"max_length": 10}, 3)
+
+    await HighLevel(api).generate_long([1] * (limit + 100), 20, Model.Kayra, preset, GlobalSettings())
+
+    assert [len(p) for p in api.low_level.prompts] == [limit, limit]
+    assert api.low_level.prompts[1][-10:] == [300] * 10
+
+
+async def test_stop_on_short_chunk():
+    api = FakeAPI([[300] * 10, [301] * 4, [302] * 10])
+
+    tokens, _ = await HighLevel(api).generate_long([1] * 10, 30, Model.Kayra, _preset(), GlobalSettings())
+
+    assert tokens == [300] * 10 + [301] * 4
+    assert len(api.low_level.prompts) == 2
+
+
+async def test_stop_on_stop_sequence():
+    api = FakeAPI([[300] * 8 + [85, 86], [302] * 10])
+
+    tokens, _ = await HighLevel(api).generate_long(
+        [1] * 10, 30, Model.Kayra, _preset(), GlobalSettings(), stop_sequences=[[85, 86]]
+    )
+
+    assert tokens == [300] * 8 + [85, 86]
+    assert len(api.low_level.prompts) == 1
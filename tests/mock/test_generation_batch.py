@@ -0,0 +1,57 @@
+"""
+Tests of the scheduling and cancellation of the generation batches, with a fake high level API
+"""
+
+import asyncio
+from typing import Any, Dict
+
+from novelai_api.GenerationBatch import GenerationBatch, GenerationRequest
+from novelai_api.GlobalSettings import GlobalSettings
+from novelai_api.Preset import Model, Preset
+
+
+class FakeHighLevel:
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    async def generate_from_template(self, prompt, template, keep_head, **kwargs) -> Dict[str, Any]:
+        await asyncio.sleep(self.delay)
+
+        return {"output": ""}
+
+
+def _batch(delay: float, n: int = 4) -> GenerationBatch:
+    requests = [
+        GenerationRequest([1, 2, 3], Model.Kayra, Preset("test", Model.Kayra), GlobalSettings()) for _ in range(n)
+    ]
+
+    return GenerationBatch(FakeHighLevel(delay), requests, concurrency=2)
+
+
+async def test_results():
+    results = await _batch(0)
+
+    assert [r.index for r in results] == [0, 1, 2, 3]
+    assert all(r.succeeded for r in results)
+
+
+async def test_cancel_before_start():
+    batch = _batch(0)
+    batch.cancel()
+
+    results = await batch.results()
+    assert all(isinstance(r.error, asyncio.CancelledError) for r in results)
+    assert [r.index async for r in batch] == [0, 1, 2, 3]
+
+
+async def test_cancel_running():
+    batch = _batch(10)
+    batch._start()
+    await asyncio.sleep(0.01)
+
+    batch.cancel()
+    results = await batch.results()
+
+    assert all(isinstance(r.error, asyncio.CancelledError) for r in results)
+    # the running tasks end up cancelled, not finished
+    assert all(task.cancelled() for task in batch._tasks)
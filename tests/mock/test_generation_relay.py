@@ -0,0 +1,82 @@
+"""
+Tests of the relay of a stream to several subscribers
+"""
+
+import asyncio
+
+import pytest
+
+from novelai_api.GenerationRelay import GenerationRelay, RelayError, SlowSubscriberPolicy
+from novelai_api.Preset import Model
+from novelai_api.utils import tokens_to_b64
+
+
+async def _stream(n: int, error: bool = False, delay: float = 0):
+    for i in range(n):
+        await asyncio.sleep(delay)
+        yield {"token": tokens_to_b64([300 + i], 2)}
+
+    if error:
+        raise ValueError("stream failed")
+
+
+async def test_subscribers_get_all_events():
+    relay = GenerationRelay(_stream(5), Model.Kayra)
+    early = relay.subscribe()
+
+    await relay.start().wait()
+    late = relay.subscribe()
+
+    assert [e["index"] async for e in early] == [0, 1, 2, 3, 4]
+    assert [e["tokens"] async for e in late] == [[300 + i] for i in range(5)]
+
+
+async def test_replay_not_counted_in_queue_size():
+    gate = asyncio.Event()
+
+    async def stream():
+        async for e in _stream(6):
+            yield e
+
+        await gate.wait()
+        async for e in _stream(2):
+            yield e
+
+    relay = GenerationRelay(stream(), Model.Kayra, queue_size=2, slow_policy=SlowSubscriberPolicy.Disconnect).start()
+    await asyncio.sleep(0.01)
+
+    subscription = relay.subscribe()
+    gate.set()
+    await relay.wait()
+
+    assert len([e async for e in subscription]) == 8
+    assert not subscription.lagged
+
+
+async def test_error_raised_to_each_subscriber():
+    relay = GenerationRelay(_stream(2, error=True), Model.Kayra)
+    subscriptions = [relay.subscribe(), relay.subscribe()]
+    await relay.start().wait()
+
+    errors = []
+    for subscription in subscriptions:
+        with pytest.raises(RelayError) as info:
+            async for _ in subscription:
+                pass
+
+        errors.append(info.value)
+
+    assert errors[0] is not errors[1]
+    assert all(isinstance(e.__cause__, ValueError) and e.error is relay.error for e in errors)
+
+
+async def test_close_cancels_task():
+    relay = GenerationRelay(_stream(100, delay=0.01), Model.Kayra).start()
+    subscription = relay.subscribe()
+    await asyncio.sleep(0.03)
+
+    await relay.close()
+
+    assert relay._task.cancelled()
+    assert relay.done and relay.error is None
+    assert len([e async for e in subscription]) < 100
@@ -0,0 +1,85 @@
+"""
+Regression tests for the import time of the package.
+
+The budget can be changed with the NAI_IMPORT_TIME_BUDGET environment variable (in ms), for slow machines.
+"""
+
+import os
+import re
+import subprocess  # nosec B404
+import sys
+from pathlib import Path
+from typing import Dict, List
+
+import pytest
+
+ROOT = Path(__file__).parent.parent.parent
+
+IMPORT_TIME_BUDGET = float(os.environ.get("NAI_IMPORT_TIME_BUDGET", 150))
+
+HEAVY_MODULES = ["aiohttp", "tokenizers", "sentencepiece", "jsonschema", "PIL", "ftfy", "argon2", "msgpackr", "numpy"]
+
+
+def _run_python(code: str, *args: str) -> subprocess.CompletedProcess:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([str(ROOT), env.get("PYTHONPATH", "")])
+
+    return subprocess.run(  # nosec B603
+        [sys.executable, *args, "-c", code], capture_output=True, text=True, env=env, check=True
+    )
+
+
+def _get_import_times(statement: str) -> Dict[str, int]:
+    """
+    Get the cumulative import time (in µs) of every module imported by the statement
+    """
+
+    result = _run_python(statement, "-X", "importtime")
+
+    times = {}
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \|\s+(.+)$", line)
+        if match:
+            times[match.group(2).strip()] = int(match.group(1))
+
+    return times
+
+
+def _get_imported_modules(statement: str) -> List[str]:
+    code = f"{statement}\nimport sys\nprint(' '.join(sys.modules))"
+
+    return _run_python(code).stdout.split()
+
+
+@pytest.mark.parametrize(
+    "statement",
+    [
+        "import novelai_api",
+        "import novelai_api.utils",
+        "import novelai_api.Tokenizer",
+        "import novelai_api.GlobalSettings",
+        "import novelai_api.Preset",
+        "import novelai_api.SchemaValidator",
+        "import novelai_api.DirectorToolsPreset",
+        "import novelai_api.__main__",
+    ],
+)
+def test_no_heavy_import(statement: str):
+    modules = _get_imported_modules(statement)
+    heavy = [name for name in HEAVY_MODULES if name in modules]
+
+    assert not heavy, f"'{statement}' imports {', '.join(heavy)}"
+
+
+def test_import_time():
+    times = []
+    for _ in range(3):
+        import_times = _get_import_times("import novelai_api.utils")
+        assert "novelai_api.utils" in import_times, "The output of -X importtime could not be parsed"
+
+        times.append(import_times["novelai_api.utils"])
+
+    # best of 3, to smooth the noise
+    best = min(times)
+
+    assert best / 1000 < IMPORT_TIME_BUDGET, f"Importing novelai_api.utils took {best / 1000:.1f}ms"
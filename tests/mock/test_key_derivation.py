@@ -0,0 +1,95 @@
+"""
+Tests of the caching of the derived keys (the Argon2 derivations are replaced by fast fakes)
+"""
+
+import asyncio
+import threading
+import time
+from typing import Dict, List, Optional
+
+import pytest
+
+import novelai_api.KeyDerivation as key_derivation_module
+from novelai_api.KeyDerivation import DerivedKeyCache, KeyDerivation
+
+
+class MemoryKeyCache(DerivedKeyCache):
+    def __init__(self):
+        self.content: Dict[str, Dict[str, str]] = {}
+
+    def load(self, digest: str) -> Optional[Dict[str, str]]:
+        keys = self.content.get(digest)
+
+        return None if keys is None else dict(keys)
+
+    def save(self, digest: str, keys: Dict[str, str]):
+        self.content[digest] = dict(keys)
+
+    def delete(self, digest: str):
+        self.content.pop(digest, None)
+
+
+@pytest.fixture
+def derivations(monkeypatch) -> List[str]:
+    calls = []
+    lock = threading.Lock()
+
+    def fake_access_key(email: str, password: str) -> str:
+        with lock:
+            calls.append("access_key")
+
+        time.sleep(0.05)
+
+        return f"access:{email}:{password}"
+
+    def fake_encryption_key(email: str, password: str) -> bytes:
+        with lock:
+            calls.append("encryption_key")
+
+        return f"encryption:{email}:{password}".encode()
+
+    monkeypatch.setattr(key_derivation_module, "get_access_key", fake_access_key)
+    monkeypatch.setattr(key_derivation_module, "get_encryption_key", fake_encryption_key)
+    monkeypatch.setattr(KeyDerivation, "VERIFIER_COST", {"n": 2**4, "r": 8, "p": 1})
+
+    return calls
+
+
+def test_persisted_keys_need_the_password(derivations: List[str]):
+    storage = MemoryKeyCache()
+
+    assert KeyDerivation(storage).get_access_key("a@b.c", "pass") == "access:a@b.c:pass"
+    assert derivations == ["access_key"]
+
+    # a new process with the right password uses the persisted keys
+    assert KeyDerivation(storage).get_access_key("a@b.c", "pass") == "access:a@b.c:pass"
+    assert derivations == ["access_key"]
+
+    # a wrong password doesn't get them
+    assert KeyDerivation(storage).get_access_key("a@b.c", "wrong") == "access:a@b.c:wrong"
+    assert derivations == ["access_key", "access_key"]
+
+    # the persisted keys are now the ones of the new password
+    assert KeyDerivation(storage).get_access_key("a@b.c", "wrong") == "access:a@b.c:wrong"
+    assert derivations == ["access_key", "access_key"]
+
+
+def test_forget(derivations: List[str]):
+    storage = MemoryKeyCache()
+    kd = KeyDerivation(storage)
+
+    kd.get_encryption_key("a@b.c", "pass")
+    kd.forget("a@b.c")
+    assert not storage.content
+
+    kd.get_encryption_key("a@b.c", "pass")
+    assert derivations == ["encryption_key", "encryption_key"]
+
+
+async def test_concurrent_derivations_run_once(derivations: List[str]):
+    kd = KeyDerivation()
+
+    results = await asyncio.gather(*(kd.derive("a@b.c", "pass") for _ in range(5)))
+
+    assert all(r == ("access:a@b.c:pass", b"encryption:a@b.c:pass") for r in results)
+    assert sorted(derivations) == ["access_key", "encryption_key"]
@@ -0,0 +1,65 @@
+"""
+Tests of the change tracking of the presets, that the generation templates rely on
+"""
+
+import copy
+import pickle
+
+from novelai_api.GenerationTemplate import GenerationTemplate
+from novelai_api.GlobalSettings import GlobalSettings
+from novelai_api.Preset import Model, Preset
+
+
+def _preset() -> Preset:
+    preset = Preset("test", Model.Kayra, {"temperature": 1.0})
+    preset["stop_sequences"] = [[1]]
+
+    return preset
+
+
+def test_reading_lists_keeps_template():
+    preset = _preset()
+    template = GenerationTemplate(Model.Kayra, preset, GlobalSettings())
+    template.compile()
+
+    assert preset["stop_sequences"] == [[1]]
+    assert preset.stop_sequences == [[1]]
+    assert not template.is_stale()
+
+
+def test_modifying_lists_invalidates_template():
+    preset = _preset()
+    template = GenerationTemplate(Model.Kayra, preset, GlobalSettings())
+    template.compile()
+
+    preset.stop_sequences.append([2])
+    assert template.is_stale()
+    assert preset.to_settings()["stop_sequences"] == [[1], [2]]
+
+    template.compile()
+    preset.stop_sequences[0] = [3]
+    assert template.is_stale()
+
+
+def test_set_list_is_copied():
+    values = [[1]]
+    preset = Preset("test", Model.Kayra)
+    preset["stop_sequences"] = values
+
+    values.append([2])
+    assert preset.stop_sequences == [[1]]
+
+
+def test_copies_are_independent():
+    preset = _preset()
+    other = preset.copy()
+
+    other.stop_sequences.append([2])
+    assert preset.stop_sequences == [[1]]
+
+    for clone in (copy.deepcopy(preset), pickle.loads(pickle.dumps(preset))):
+        version = clone._version
+        clone.stop_sequences.append([3])
+
+        assert clone._version != version
+        assert preset.stop_sequences == [[1]]
@@ -0,0 +1,84 @@
+"""
+Tests of the loading of the official presets bundle, with a copy of the preset files
+"""
+
+import json
+import shutil
+
+import pytest
+
+import novelai_api.Preset as preset_module
+from novelai_api.Preset import Model, build_preset_bundle
+
+
+@pytest.fixture
+def presets(monkeypatch, tmp_path):
+    path = tmp_path / "presets"
+    shutil.copytree(preset_module._get_officials_folder(Model.Kayra), path / "presets_kayra_v1")
+
+    monkeypatch.setattr(preset_module, "PRESETS_PATH", path)
+    monkeypatch.setattr(preset_module, "PRESETS_BUNDLE_PATH", path / "presets_bundle.json")
+    monkeypatch.setattr(preset_module, "PRESETS_CACHE_PATH", tmp_path / "cache" / "presets_bundle.json")
+    monkeypatch.delenv("NAI_CHECK_PRESETS_BUNDLE", raising=False)
+
+    return path
+
+
+def _load(monkeypatch):
+    monkeypatch.setattr(preset_module, "_presets_bundle", None)
+
+    return preset_module._get_officials_data(Model.Kayra)
+
+
+def _no_stat(monkeypatch):
+    def fail(*_):
+        raise AssertionError("preset files checked")
+
+    monkeypatch.setattr(preset_module, "_get_officials_files", fail)
+
+
+def test_shipped_bundle_not_checked(monkeypatch, presets):
+    build_preset_bundle()
+    _no_stat(monkeypatch)
+
+    assert _load(monkeypatch)["presets"]
+    assert not preset_module.PRESETS_CACHE_PATH.exists()
+
+
+def test_shipped_bundle_checked_on_demand(monkeypatch, presets):
+    build_preset_bundle()
+    (presets / "presets_kayra_v1" / "default.txt").write_text("Other\n", encoding="utf-8")
+
+    assert _load(monkeypatch)["default"] != "Other"
+
+    monkeypatch.setenv("NAI_CHECK_PRESETS_BUNDLE", "1")
+    assert _load(monkeypatch)["default"] == "Other"
+
+
+def test_user_cache_bundle(monkeypatch, presets):
+    data = _load(monkeypatch)
+    assert data["presets"]
+    assert preset_module.PRESETS_CACHE_PATH.exists()
+
+    # reused as long as the installation is the same
+    _no_stat(monkeypatch)
+    monkeypatch.setattr(preset_module, "_read_officials_folder", lambda model: pytest.fail("preset files read"))
+    assert _load(monkeypatch) == json.loads(json.dumps(data))
+
+
+def test_user_cache_bundle_of_other_install(monkeypatch, presets):
+    _load(monkeypatch)
+    cache = json.loads(preset_module.PRESETS_CACHE_PATH.read_text(encoding="utf-8"))
+    cache["install"] = "other"
+    cache["models"] = {}
+    preset_module.PRESETS_CACHE_PATH.write_text(json.dumps(cache), encoding="utf-8")
+
+    assert _load(monkeypatch)["presets"]
+
+
+def test_unwritable_cache(monkeypatch, presets, tmp_path):
+    # the parent of the cache is a file, so the cache can't be written (even as root)
+    (tmp_path / "file").write_text("", encoding="utf-8")
+    monkeypatch.setattr(preset_module, "PRESETS_CACHE_PATH", tmp_path / "file" / "presets_bundle.json")
+
+    assert _load(monkeypatch)["presets"]
@@ -0,0 +1,225 @@
+"""
+Tests of the story proxy, with a fake API (no encryption, uploads are recorded)
+"""
+
+import asyncio
+import copy
+import logging
+from typing import Any, Dict, List
+
+import pytest
+
+import novelai_api.StoryHandler as story_handler_module
+from novelai_api.GlobalSettings import GlobalSettings
+from novelai_api.Preset import Model
+from novelai_api.StoryHandler import NovelAIStory
+
+
+class FakeHighLevel:
+    def __init__(self):
+        self.uploads: List[Dict[str, Any]] = []
+        self.delay = 0.0
+        self.fail = False
+
+    async def upload_user_content(self, item: Dict[str, Any]) -> bool:
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            return False
+
+        self.uploads.append(item)
+
+        return True
+
+
+class FakeAPI:
+    def __init__(self):
+        self.logger = logging.getLogger("test_story_handler")
+        self.high_level = FakeHighLevel()
+        self.compression = None
+        self.subscription_tier = None
+
+
+@pytest.fixture(autouse=True)
+def no_encryption(monkeypatch):
+    monkeypatch.setattr(story_handler_module, "encrypt_user_data_copy", lambda item, *_: item)
+
+
+def _make_story(api: FakeAPI) -> NovelAIStory:
+    fragment = {"data": "Once upon a time", "origin": "root"}
+    root = {
+        "nextBlock": [],
+        "prevBlock": -1,
+        "origin": "root",
+        "startIndex": 0,
+        "endIndex": 0,
+        "dataFragment": dict(fragment),
+        "fragmentIndex": -1,
+        "removedFragments": [],
+        "chain": False,
+    }
+
+    story = {"id": "story", "meta": "meta", "decrypted": True, "data": {"title": "Title"}}
+    storycontent = {
+        "id": "content",
+        "meta": "meta",
+        "decrypted": True,
+        "data": {
+            "story": {"version": 2, "step": 0, "datablocks": [root], "fragments": [fragment], "currentBlock": 0},
+            "context": [],
+            "settings": {"model": "kayra-v1", "parameters": {}},
+        },
+    }
+
+    return NovelAIStory(api, {"meta": b"key"}, "meta", GlobalSettings(), story, storycontent)
+
+
+def _uploaded(api: FakeAPI, name: str) -> List[Dict[str, Any]]:
+    return [item for item in api.high_level.uploads if item["id"] == name]
+
+
+async def test_history_only_in_upload():
+    api = FakeAPI()
+    story = _make_story(api)
+
+    await story.edit(16, 16, ", there was")
+    assert str(story) == "Once upon a time, there was"
+    assert "datablocks" not in story.storycontent["data"]["story"]
+
+    assert await story.save(upload=True)
+    (content,) = _uploaded(api, "content")
+    assert len(content["data"]["story"]["datablocks"]) == 2
+    assert content["data"]["story"]["fragments"][-1] == {"data": ", there was", "origin": "edit"}
+
+
+async def test_fragments_are_not_shared_with_history():
+    api = FakeAPI()
+    story = _make_story(api)
+
+    await story.edit(16, 16, "!")
+    await story.save()
+
+    # changing the exposed fragments doesn't change the history
+    story.storycontent["data"]["story"]["fragments"][-1]["data"] = "?"
+    assert story.datablocks.fragment(1)["data"] == "!"
+
+
+async def test_upload_only_marked_objects():
+    api = FakeAPI()
+    story = _make_story(api)
+
+    assert await story.save(upload=True)
+    assert not api.high_level.uploads
+
+    story.story["data"]["title"] = "New title"
+    story.mark_modified(story=True, storycontent=False)
+    assert await story.save(upload=True)
+    assert [item["id"] for item in api.high_level.uploads] == ["story"]
+
+    # changed back to the uploaded version
+    story.mark_modified(story=True, storycontent=False)
+    assert await story.save(upload=True)
+    assert len(api.high_level.uploads) == 1
+
+
+async def test_failed_upload_marks_again():
+    api = FakeAPI()
+    story = _make_story(api)
+
+    await story.edit(0, 0, "Hey. ")
+    api.high_level.fail = True
+    assert not await story.save(upload=True)
+    assert story._modified["storycontent"]
+
+    api.high_level.fail = False
+    assert await story.save(upload=True)
+    assert len(_uploaded(api, "content")) == 1
+    assert not story._modified["storycontent"]
+
+
+async def test_save_later_coalesced():
+    api = FakeAPI()
+    story = _make_story(api)
+
+    futures = []
+    for i in range(5):
+        await story.edit(0, 0, f"{i}")
+        futures.append(story.save_later(0.01))
+
+    assert all(f is futures[0] for f in futures)
+    assert await futures[0]
+    assert len(_uploaded(api, "content")) == 1
+    assert _uploaded(api, "content")[0]["data"]["story"]["fragments"][0]["data"] == "4"
+
+
+async def test_flush_waits_for_upload_in_progress():
+    api = FakeAPI()
+    api.high_level.delay = 0.1
+    story = _make_story(api)
+
+    await story.edit(0, 0, "Hey. ")
+    future = story.save_later(0.01)
+
+    # the timer fired, the upload is in progress
+    await asyncio.sleep(0.05)
+    assert not api.high_level.uploads
+
+    assert await story.flush()
+    assert future.done()
+    assert len(_uploaded(api, "content")) == 1
+
+
+async def test_flush_scheduled_save():
+    api = FakeAPI()
+    story = _make_story(api)
+
+    await story.edit(0, 0, "Hey. ")
+    future = story.save_later(60)
+
+    assert await story.flush()
+    assert future.result()
+    assert len(_uploaded(api, "content")) == 1
+    assert await story.flush()
+
+
+async def test_cancelled_save_cancels_future():
+    api = FakeAPI()
+    api.high_level.delay = 1
+    story = _make_story(api)
+
+    await story.edit(0, 0, "Hey. ")
+    future = story.save_later(0)
+    await asyncio.sleep(0.05)
+
+    story._save_task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await future
+
+    assert story._modified["storycontent"]
+
+
+def test_lazy_settings_leave_storycontent_untouched():
+    api = FakeAPI()
+    story = _make_story(api)
+    parameters = story.storycontent["data"]["settings"]["parameters"]
+    parameters["bad_words_ids"] = [[1, 2]]
+    parameters["order"] = [{"id": "temperature", "enabled": True}]
+    expected = copy.deepcopy(story.storycontent)
+
+    assert "model" not in story.__dict__
+    assert story.model is Model.Kayra
+    assert len(story.banlists) == 1
+    assert story.prefix == "vanilla"
+
+    assert story.storycontent == expected
+    assert not any(story._modified.values())
+
+
+def test_lazy_load_error_not_hidden(monkeypatch):
+    def broken(self, data):
+        raise AttributeError("broken")
+
+    monkeypatch.setattr(NovelAIStory, "_handle_preset", broken)
+    story = _make_story(FakeAPI())
+
+    with pytest.raises(RuntimeError, match="broken"):
+        story.model  # pylint: disable=W0104
@@ -0,0 +1,72 @@
+"""
+Tests of the rope holding the text of a story, compared with a plain string
+"""
+
+import random
+from typing import List
+
+import pytest
+
+from novelai_api.StoryText import StoryText
+
+
+def _random_fragments(rng: random.Random) -> List[dict]:
+    return [
+        {"data": "".join(rng.choice("ab \n.") for _ in range(rng.randint(1, 8))), "origin": "edit"}
+        for _ in range(rng.randint(0, 3))
+    ]
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_random_replace_undo(seed: int):
+    rng = random.Random(seed)
+
+    fragments = _random_fragments(rng)
+    text = StoryText(fragments)
+    expected = "".join(f["data"] for f in fragments)
+
+    history = []
+    for _ in range(200):
+        if history and rng.random() < 0.3:
+            # undo the last replace, by putting the removed fragments back
+            start, inserted, removed, before = history.pop()
+            text.replace(start, start + inserted, removed)
+            expected = before
+        else:
+            start = rng.randint(0, len(expected))
+            end = rng.randint(start, len(expected))
+            new = _random_fragments(rng)
+            data = "".join(f["data"] for f in new)
+
+            removed = text.replace(start, end, new)
+            history.append((start, len(data), removed, expected))
+            expected = expected[:start] + data + expected[end:]
+
+        assert str(text) == expected
+        assert len(text) == len(expected)
+        assert "".join(f["data"] for f in text.fragments()) == expected
+        assert text.fragment_count == len(text.fragments())
+
+        size = rng.randint(0, len(expected) + 5)
+        assert text.tail(size) == (expected[len(expected) - size :] if size < len(expected) else expected)
+
+
+def test_replace_returns_removed_fragments():
+    a, b, c = {"data": "abc", "origin": "root"}, {"data": "de", "origin": "ai"}, {"data": "f", "origin": "edit"}
+    text = StoryText([a, b, c])
+
+    assert text.fragment_index(0) == 0
+    assert text.fragment_index(3) == 1
+    assert text.fragment_index(5) == 2
+
+    removed = text.replace(3, 5, [{"data": "XYZ", "origin": "edit"}])
+    assert removed == [b]
+    assert str(text) == "abcXYZf"
+
+
+@pytest.mark.parametrize("start, end", [(-1, 0), (2, 1), (0, 4)])
+def test_replace_invalid_range(start: int, end: int):
+    text = StoryText([{"data": "abc", "origin": "root"}])
+
+    with pytest.raises(ValueError):
+        text.replace(start, end, [])
@@ -0,0 +1,110 @@
+"""
+Benchmark the size/time tradeoff of the compression policies on real storycontent documents.
+
+The documents are either downloaded from the account (NAI_USERNAME and NAI_PASSWORD), or read from .scenario files
+(as dumped by download_all_stories.py) if paths are provided.
+"""
+
+from argparse import ArgumentParser
+from asyncio import run
+from json import dumps, loads
+from time import perf_counter
+from typing import List
+from zlib import MAX_WBITS
+from zlib import decompress as inflate
+
+from novelai_api.utils import CompressionPolicy, DeflateBackend
+
+
+async def download_documents() -> List[bytes]:
+    # imported here, so the benchmark can run on local files without credentials
+    from boilerplate import API  # pylint: disable=C0415
+
+    from novelai_api.utils import decrypt_user_data  # pylint: disable=C0415
+
+    async with API() as api_handler:
+        api = api_handler.api
+        key = api_handler.encryption_key
+
+        keystore = await api.high_level.get_keystore(key)
+
+        story_contents = await api.high_level.download_user_story_contents()
+        decrypt_user_data(story_contents, keystore)
+
+    return [
+        dumps(content["data"], separators=(",", ":"), ensure_ascii=False).encode()
+        for content in story_contents
+        if content.get("decrypted")
+    ]
+
+
+def read_documents(paths: List[str]) -> List[bytes]:
+    documents = []
+
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            content = loads(f.read())["content"]
+
+        documents.append(dumps(content, separators=(",", ":"), ensure_ascii=False).encode())
+
+    return documents
+
+
+def get_policies() -> List[CompressionPolicy]:
+    policies = []
+
+    for backend in DeflateBackend:
+        if not CompressionPolicy.is_available(backend):
+            print(f"Backend {backend.value} is not installed, skipping it")
+            continue
+
+        max_level = CompressionPolicy._MAX_LEVEL[backend]
+        policies.extend(CompressionPolicy(level, backend) for level in range(1, max_level + 1))
+
+    return policies
+
+
+def benchmark(documents: List[bytes], repeat: int):
+    total_size = sum(len(document) for document in documents)
+    print(f"{len(documents)} documents, {total_size / 1024:.1f} KiB uncompressed\n")
+
+    print(f"{'backend':<12}{'level':>6}{'size (KiB)':>14}{'ratio':>8}{'time (ms)':>12}{'MiB/s':>10}")
+    for policy in get_policies():
+        best_time = float("inf")
+        compressed_size = 0
+
+        for _ in range(repeat):
+            compressed_size = 0
+
+            start = perf_counter()
+            for document in documents:
+                compressed_size += len(policy.compress(document))
+            best_time = min(best_time, perf_counter() - start)
+
+        # the output must stay readable by a plain raw inflate (what the web client does)
+        for document in documents:
+            assert inflate(policy.compress(document), -MAX_WBITS) == document, f"Round trip failed for {policy}"
+
+        print(
+            f"{policy.backend.value:<12}{policy.level:>6}{compressed_size / 1024:>14.1f}"
+            f"{compressed_size / total_size:>8.3f}{best_time * 1000:>12.1f}"
+            f"{total_size / (1024 * 1024) / best_time:>10.1f}"
+        )
+
+
+async def main():
+    parser = ArgumentParser()
+    parser.add_argument("paths", nargs="*", help="Scenario files to use instead of the account's storycontent")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs per policy (best time is kept)")
+
+    args = parser.parse_args()
+
+    documents = read_documents(args.paths) if args.paths else await download_documents()
+    if not documents:
+        print("No document to benchmark")
+        return
+
+    benchmark(documents, args.repeat)
+
+
+run(main())
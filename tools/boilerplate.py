@@ -5,7 +5,6 @@ from typing import Optional
 from aiohttp import ClientSession
 
 from novelai_api import NovelAIAPI
-from novelai_api.utils import get_encryption_key
 
 
 class API:
@@ -32,7 +31,7 @@ class API:
 
     @property
     def encryption_key(self):
-        return get_encryption_key(self._username, self._password)
+        return self.api.key_derivation.get_encryption_key(self._username, self._password)
 
     async def __aenter__(self):
         self._session = ClientSession()